@@ -1,5 +1,9 @@
 import logging
 import multiprocessing
+import os
+import queue
+import socket
+import tempfile
 import time
 from typing import *
 
@@ -59,6 +63,53 @@ def run(config_file: str):
     processes: Dict[str, ru.RoyalnetProcess] = {}
     """A list of all processes that the launcher should start and monitor."""
 
+    report_queue: multiprocessing.Queue = multiprocessing.Queue()
+    """The queue the processes send their reports through, as ``(kind, process_name, payload)`` tuples."""
+
+    started: Dict[str, float] = {}
+    """The :func:`time.monotonic` time each process was last started at."""
+
+    metrics_cfg = config.get("Metrics")
+    if metrics_cfg is None:
+        log.info("Metrics: Not configured")
+    elif not metrics_cfg["enabled"]:
+        log.info("Metrics: Disabled")
+    else:
+        log.info(f"Metrics: Enabled ({metrics_cfg['file']})")
+
+    metrics: Dict[str, str] = {}
+    """The latest metrics received from each process, in the Prometheus text format."""
+
+    def handle_report(kind: str, name: str, payload):
+        if kind == "startup":
+            # The time not measured by the process itself is spent starting the interpreter and importing modules
+            total = time.monotonic() - started[name]
+            phases = {"spawn": total - sum(payload.values()), **payload}
+            log.info(f"{name}: Started in {total:.3f}s "
+                     f"({', '.join(f'{phase} {seconds:.3f}s' for phase, seconds in phases.items())})")
+        elif kind == "metrics":
+            metrics[name] = payload
+            # Replace the file at once, so that it's never read while half written
+            temporary = f"{metrics_cfg['file']}.tmp"
+            with open(temporary, "w", encoding="utf8") as file:
+                file.write("".join(metrics.values()))
+            os.replace(temporary, metrics_cfg["file"])
+        else:
+            log.warning(f"{name}: Unknown report kind: {kind}")
+
+    def gather_reports(timeout: float):
+        """Wait ``timeout`` seconds, handling the reports received in the meantime."""
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                report = report_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            handle_report(*report)
+
     herald_cfg = config.get("Herald")
     if rh is None:
         log.info("Herald: Not installed")
@@ -68,6 +119,10 @@ def run(config_file: str):
         log.info("Herald: Disabled")
     elif herald_cfg["mode"] == "local":
         log.info("Herald: Enabled (local server)")
+        if hasattr(socket, "AF_UNIX"):
+            # The serfs run on the same host as the server, so they can skip the websocket
+            herald_cfg.setdefault("local_socket",
+                                  os.path.join(tempfile.gettempdir(), f"royalnet-herald-{herald_cfg['port']}.sock"))
 
         def herald_constructor() -> multiprocessing.Process:
             # Create a Herald server
@@ -116,6 +171,8 @@ def run(config_file: str):
                             "sentry_cfg": config["Sentry"],
                             "logging_cfg": config["Logging"],
                             "serf_cfg": serf_cfg,
+                            "metrics_cfg": metrics_cfg,
+                            "report_queue": report_queue,
                         }
                     )
 
@@ -148,6 +205,7 @@ def run(config_file: str):
                     "sentry_cfg": config["Sentry"],
                     "logging_cfg": config["Logging"],
                     "constellation_cfg": config["Constellation"],
+                    "report_queue": report_queue,
                 }
             )
 
@@ -164,12 +222,14 @@ def run(config_file: str):
                     log.info(f"{name}: Starting...")
                     process.current_process = process.constructor()
                     process.current_process.start()
+                    started[name] = time.monotonic()
                 elif not process.current_process.is_alive():
                     log.error(f"{name}: Process is dead, restarting...")
                     process.current_process = process.constructor()
                     process.current_process.start()
+                    started[name] = time.monotonic()
             log.debug("Done, checking again in 60 seconds.")
-            time.sleep(60)
+            gather_reports(60)
     except KeyboardInterrupt:
         log.info("Received SIGTERM, stopping everything!")
         for name, process in processes.items():
@@ -10,7 +10,7 @@ from sqlalchemy.orm.session import Session
 from sqlalchemy.schema import Table
 
 from royalnet.alchemy.errors import TableNotFoundError
-from royalnet.utils import asyncify
+from royalnet.utils import asyncify, trace_phase
 
 if TYPE_CHECKING:
     # noinspection PyProtectedMember
@@ -112,11 +112,15 @@ class Alchemy:
                     ...
                     # Commit the session
                     await asyncify(session.commit)"""
-        session = await asyncify(self.Session)
+        # Only the setup and the teardown of the session are timed, not the code using it
+        with trace_phase("session"):
+            session = await asyncify(self.Session)
         try:
             yield session
         except Exception:
-            session.rollback()
+            with trace_phase("session"):
+                session.rollback()
             raise
         finally:
-            session.close()
+            with trace_phase("session"):
+                session.close()
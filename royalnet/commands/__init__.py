@@ -6,7 +6,7 @@ from .commanddata import CommandData
 from .configdict import ConfigDict
 from .errors import \
     CommandError, InvalidInputError, UnsupportedError, ConfigurationError, ExternalError, UserError, ProgramError
-from .heraldevent import HeraldEvent
+from .heraldevent import HeraldEvent, CACHE_INVALIDATION_HANDLER
 from .keyboardkey import KeyboardKey
 
 __all__ = [
@@ -21,6 +21,7 @@ __all__ = [
     "UserError",
     "ProgramError",
     "HeraldEvent",
+    "CACHE_INVALIDATION_HANDLER",
     "KeyboardKey",
     "ConfigDict",
 ]
@@ -1,10 +1,15 @@
 import asyncio as aio
-from typing import TYPE_CHECKING, Union
+from typing import TYPE_CHECKING, Optional, Union, Hashable
+
+import royalnet.utils as ru
 
 if TYPE_CHECKING:
     from ..serf import Serf
     from ..constellation import Constellation
 
+CACHE_INVALIDATION_HANDLER = "__cache_invalidation__"
+"""The name of the Herald broadcasts purging the cached responses of an event, handled by every process."""
+
 
 class HeraldEvent:
     """A remote procedure call triggered by a :mod:`royalnet.herald` request."""
@@ -12,9 +17,35 @@ class HeraldEvent:
     name = NotImplemented
     """The event_name that will trigger this event."""
 
+    max_concurrency: Optional[int] = None
+    """The maximum number of times this event can be running at the same time in a single process.
+
+    If :const:`None`, the ``max_running_per_handler`` option of the Herald configuration is used."""
+
+    idempotent: bool = False
+    """Can a single run of this event answer all the identical calls made at the same time by a process?
+
+    If :data:`True`, the calls to ``call_herald_event`` with the same destination and arguments that are waiting for a
+    response are collapsed in a single request."""
+
+    cache_ttl: Optional[float] = None
+    """If set, the responses of this event are cached for this many seconds, and the calls with the same
+    :meth:`.cache_key` made in the meantime don't run it again."""
+
+    cache_size: int = 128
+    """The maximum number of responses of this event that can be cached at the same time."""
+
     def __init__(self, parent: Union["Serf", "Constellation"], config):
         self.parent: Union["Serf", "Constellation"] = parent
         self.config = config
+        self._response_cache: Optional[ru.TTLCache] = None
+
+    @property
+    def response_cache(self) -> ru.TTLCache:
+        """The cache containing the recent responses of this event."""
+        if self._response_cache is None:
+            self._response_cache = ru.TTLCache(maxsize=self.cache_size, ttl=self.cache_ttl or 0)
+        return self._response_cache
 
     @property
     def alchemy(self):
@@ -27,4 +58,62 @@ class HeraldEvent:
         return self.parent.loop
 
     async def run(self, **kwargs):
+        """Run the event, returning the data of the response.
+
+        It can also be an async generator, yielding the data of the response in multiple chunks: they will be sent
+        one at a time to the callers of ``stream_herald_event``, as fast as they are read."""
         raise NotImplementedError()
+
+    def cache_key(self, **kwargs) -> Optional[Hashable]:
+        """Get the key identifying the response to a call with these kwargs in the :attr:`.response_cache`.
+
+        By default, all the kwargs are part of the key; override it to ignore some of them, or return :const:`None`
+        to never cache the response."""
+        return ru.SingleFlight.key(kwargs)
+
+    async def run_cached(self, **kwargs):
+        """Run the event, unless it was run with the same :meth:`.cache_key` less than :attr:`.cache_ttl` seconds ago:
+        in that case, return the cached response instead."""
+        if self.cache_ttl is None:
+            return await self.run(**kwargs)
+        key = self.cache_key(**kwargs)
+        if key is None:
+            return await self.run(**kwargs)
+        try:
+            return self.response_cache[key]
+        except KeyError:
+            pass
+        response = await self.run(**kwargs)
+        self.response_cache[key] = response
+        return response
+
+    def forget(self, kwargs: Optional[dict] = None) -> None:
+        """Purge the cached response to a call with these kwargs from this process, or all the cached responses if
+        ``kwargs`` is :const:`None`."""
+        if self._response_cache is None:
+            return
+        if kwargs is None:
+            self._response_cache.clear()
+            return
+        key = self.cache_key(**kwargs)
+        if key is not None:
+            self._response_cache.pop(key)
+
+    async def invalidate(self, **kwargs) -> None:
+        """Purge the cached response to a call with these kwargs from this process, and from all the others connected
+        to the Herald.
+
+        Call it when the data the response is based on changes."""
+        self.forget(kwargs)
+        await self._publish_invalidation(kwargs)
+
+    async def invalidate_all(self) -> None:
+        """Purge all the cached responses of this event from this process, and from all the others connected to the
+        Herald."""
+        self.forget()
+        await self._publish_invalidation(None)
+
+    async def _publish_invalidation(self, kwargs: Optional[dict]) -> None:
+        if self.parent.herald is None:
+            return
+        await self.parent.publish_herald_event(CACHE_INVALIDATION_HANDLER, event=self.name, kwargs=kwargs)
@@ -1,11 +1,14 @@
 import asyncio as aio
-import importlib
+import inspect
 import logging
+import multiprocessing
 from typing import *
 
 import starlette.applications
 import starlette.middleware
 import starlette.middleware.cors
+import starlette.requests
+import starlette.responses
 import uvicorn
 
 import royalnet.alchemy as ra
@@ -40,21 +43,12 @@ class Constellation:
                  constellation_cfg: Dict[str, Any],
                  logging_cfg: Dict[str, Any]
                  ):
-        # Import packs
-        pack_names = packs_cfg["active"]
-        packs = {}
-        for pack_name in pack_names:
-            log.debug(f"Importing pack: {pack_name}")
-            try:
-                packs[pack_name] = {
-                    "commands": importlib.import_module(f"{pack_name}.commands"),
-                    "events": importlib.import_module(f"{pack_name}.events"),
-                    "stars": importlib.import_module(f"{pack_name}.stars"),
-                    "tables": importlib.import_module(f"{pack_name}.tables"),
-                }
-            except ImportError as e:
-                log.error(f"Error during the import of {pack_name}: {e}")
-        log.info(f"Packs: {len(packs)} imported")
+        self.startup: ru.Trace = ru.Trace("startup", "constellation")
+        """The time spent in each phase of the startup of the :class:`Constellation`."""
+
+        # Import packs lazily
+        packs: List[ru.Pack] = ru.Pack.from_config(packs_cfg)
+        log.info(f"Packs: {len(packs)} active")
 
         self.alchemy = None
         """The :class:`~ra.Alchemy` of this Constellation."""
@@ -67,16 +61,12 @@ class Constellation:
         else:
             # Find all tables
             tables = set()
-            for pack in packs.values():
-                try:
-                    # noinspection PyUnresolvedReferences
-                    tables = tables.union(pack["tables"].available_tables)
-                except AttributeError:
-                    log.warning(f"Pack `{pack}` does not have the `available_tables` attribute.")
-                    continue
+            for pack in packs:
+                tables = tables.union(pack.tables)
             # Create the Alchemy
             self.alchemy = ra.Alchemy(alchemy_cfg["database_url"], tables)
             log.info(f"Alchemy: {self.alchemy}")
+        self.startup.mark("alchemy")
 
         # Logging
         self._logging_cfg: Dict[str, Any] = logging_cfg
@@ -98,6 +88,9 @@ class Constellation:
         self.events: Dict[str, rc.HeraldEvent] = {}
         """A dictionary containing all :class:`~rc.Event` that can be handled by this :class:`Constellation`."""
 
+        self.herald_calls: ru.SingleFlight = ru.SingleFlight()
+        """The calls to :meth:`.call_herald_event` for idempotent events that are waiting for a response."""
+
         self.starlette = starlette.applications.Starlette(debug=__debug__)
         """The :class:`~starlette.Starlette` app."""
 
@@ -105,17 +98,10 @@ class Constellation:
         """A list of all the :class:`PageStar` registered to this :class:`Constellation`."""
 
         # Register Events
-        for pack_name in packs:
-            pack = packs[pack_name]
-            pack_cfg = packs_cfg.get(pack_name, {})
-            try:
-                # noinspection PyUnresolvedReferences
-                events = pack["events"].available_events
-            except AttributeError:
-                log.warning(f"Pack `{pack}` does not have the `available_events` attribute.")
-            else:
-                self.register_events(events, pack_cfg)
+        for pack in packs:
+            self.register_events(pack.events, packs_cfg.get(pack.name, {}))
         log.info(f"Events: {len(self.events)} events")
+        self.startup.mark("events")
 
         if rh.Link is None:
             log.info("Herald: not installed")
@@ -125,17 +111,16 @@ class Constellation:
             log.info(f"Herald: will be enabled on first request")
 
         # Register PageStars and ExceptionStars
-        for pack_name in packs:
-            pack = packs[pack_name]
-            pack_cfg = packs_cfg.get(pack_name, {})
-            try:
-                # noinspection PyUnresolvedReferences
-                page_stars = pack["stars"].available_page_stars
-            except AttributeError:
-                log.warning(f"Pack `{pack}` does not have the `available_page_stars` attribute.")
-            else:
-                self.register_page_stars(page_stars, pack_cfg)
+        for pack in packs:
+            self.register_page_stars(pack.page_stars, packs_cfg.get(pack.name, {}))
         log.info(f"PageStars: {len(self.starlette.routes)} stars")
+        self.startup.mark("stars")
+
+        # The metrics are not protected in any way, so they are served only if a path is configured for them
+        herald_metrics_path: Optional[str] = constellation_cfg.get("herald_metrics_path")
+        if herald_metrics_path is not None:
+            log.info(f"Herald metrics: {herald_metrics_path}")
+            self.starlette.add_route(herald_metrics_path, self.page_herald_metrics, ["GET"])
 
         self.running: bool = False
         """Is the :class:`Constellation` server currently running?"""
@@ -154,15 +139,68 @@ class Constellation:
     def init_herald(self, herald_cfg: Dict[str, Any]):
         """Create a :class:`rh.Link`."""
         herald_cfg["name"] = "constellation"
-        self.herald: rh.Link = rh.Link(rh.Config.from_config(**herald_cfg), self.network_handler)
+        handler_limits = {name: event.max_concurrency
+                          for name, event in self.events.items()
+                          if event.max_concurrency is not None}
+        self.herald: rh.Link = rh.Link(rh.Config.from_config(**herald_cfg), self.network_handler,
+                                       handler_limits=handler_limits,
+                                       subscriptions=[*self.events, rc.CACHE_INVALIDATION_HANDLER])
+
+    async def publish_herald_event(self, event_name: str, **kwargs) -> None:
+        """Send a :class:`royalherald.Broadcast` to all the links with an event named ``event_name``, without waiting
+        for them to run it."""
+        if self.herald is None:
+            raise rc.UnsupportedError("`royalherald` is not enabled on this serf.")
+        broadcast: rh.Broadcast = rh.Broadcast(handler=event_name, data=kwargs)
+        await self.herald.publish(broadcast)
 
     async def call_herald_event(self, destination: str, event_name: str, **kwargs) -> Dict:
         """Send a :class:`royalherald.Request` to a specific destination, and wait for a
-        :class:`royalherald.Response`."""
+        :class:`royalherald.Response`.
+
+        If the event is :attr:`~rc.HeraldEvent.idempotent`, identical calls made while waiting for the response share
+        it, instead of sending another request."""
         if self.herald is None:
             raise rc.UnsupportedError("`royalherald` is not enabled on this serf.")
+        # Only the events known by this process can be checked
+        event: Optional[rc.HeraldEvent] = self.events.get(event_name)
+        if event is not None and event.idempotent:
+            key = ru.SingleFlight.key(destination, event_name, kwargs)
+            if key is not None:
+                return await self.herald_calls.run(key, self._call_herald_event, destination, event_name, kwargs)
+        return await self._call_herald_event(destination, event_name, kwargs)
+
+    async def _call_herald_event(self, destination: str, event_name: str, kwargs: Dict) -> Dict:
         request: rh.Request = rh.Request(handler=event_name, data=kwargs)
-        response: rh.Response = await self.herald.request(destination=destination, request=request)
+        try:
+            # Someone is usually waiting for the result, so it shouldn't wait for the broadcasts
+            response: rh.Response = await self.herald.request(destination=destination, request=request, priority=1)
+        except rh.RequestTimeoutError:
+            raise rc.ExternalError(f"{destination} did not respond to the '{event_name}' event in time.")
+        except rh.ConnectionClosedError:
+            raise rc.ExternalError(f"The Herald connection was closed while waiting for the '{event_name}' event.")
+        return self._herald_response_data(destination, event_name, response)
+
+    async def stream_herald_event(self, destination: str, event_name: str, **kwargs) -> AsyncIterator[Dict]:
+        """Send a streaming :class:`royalherald.Request` to a specific destination, and iterate over the chunks of its
+        response as they are received."""
+        if self.herald is None:
+            raise rc.UnsupportedError("`royalherald` is not enabled on this serf.")
+        request: rh.Request = rh.Request(handler=event_name, data=kwargs)
+        try:
+            async for chunk in self.herald.request_stream(destination=destination, request=request, priority=1):
+                yield chunk
+        except rh.RequestTimeoutError:
+            raise rc.ExternalError(f"{destination} did not stream the '{event_name}' event in time.")
+        except rh.ConnectionClosedError:
+            raise rc.ExternalError(f"The Herald connection was closed while streaming the '{event_name}' event.")
+        except rh.StreamFailedError as e:
+            self._herald_response_data(destination, event_name, e.response)
+
+    @staticmethod
+    def _herald_response_data(destination: str, event_name: str, response: rh.Response) -> Dict:
+        """Get the data of a :class:`royalherald.ResponseSuccess`, or raise the error described by a
+        :class:`royalherald.ResponseFailure`."""
         if isinstance(response, rh.ResponseFailure):
             if response.name == "no_event":
                 raise rc.ProgramError(f"There is no event named {event_name} in {destination}.")
@@ -198,26 +236,50 @@ class Constellation:
                                   f"[p]{response}[/p]")
 
     async def network_handler(self, message: Union[rh.Request, rh.Broadcast]) -> rh.Response:
+        if message.handler == rc.CACHE_INVALIDATION_HANDLER:
+            event: Optional[rc.HeraldEvent] = self.events.get(message.data["event"])
+            if event is not None:
+                event.forget(message.data["kwargs"])
+            return rh.ResponseSuccess()
         try:
             event: rc.HeraldEvent = self.events[message.handler]
         except KeyError:
             log.warning(f"No event for '{message.handler}'")
             return rh.ResponseFailure("no_event", f"This serf does not have any event for {message.handler}.")
         log.debug(f"Event called: {event.name}")
+        streaming = inspect.isasyncgenfunction(event.run)
         if isinstance(message, rh.Request):
+            if streaming:
+                return rh.ResponseStream(self._stream_event(event, message))
             try:
-                response_data = await event.run(**message.data)
+                response_data = await event.run_cached(**message.data)
                 return rh.ResponseSuccess(data=response_data)
             except Exception as e:
-                ru.sentry_exc(e)
-                return rh.ResponseFailure("exception_in_event",
-                                          f"An exception was raised in the event for '{message.handler}'.",
-                                          extra_info={
-                                              "type": e.__class__.__qualname__,
-                                              "message": str(e)
-                                          })
+                return self._event_failure(message, e)
         elif isinstance(message, rh.Broadcast):
-            await event.run(**message.data)
+            if streaming:
+                async for _ in event.run(**message.data):
+                    pass
+            else:
+                await event.run(**message.data)
+
+    async def _stream_event(self, event: rc.HeraldEvent, message: rh.Request) -> AsyncIterator:
+        """Run an event that yields its response in chunks, ending the stream with a failure if it raises an error."""
+        try:
+            async for chunk in event.run(**message.data):
+                yield chunk
+        except Exception as e:
+            yield self._event_failure(message, e)
+
+    @staticmethod
+    def _event_failure(message: rh.Request, e: Exception) -> rh.ResponseFailure:
+        ru.sentry_exc(e)
+        return rh.ResponseFailure("exception_in_event",
+                                  f"An exception was raised in the event for '{message.handler}'.",
+                                  extra_info={
+                                      "type": e.__class__.__qualname__,
+                                      "message": str(e)
+                                  })
 
     def register_events(self, events: List[Type[rc.HeraldEvent]], pack_cfg: Dict[str, Any]):
         for SelectedEvent in events:
@@ -251,6 +313,21 @@ class Constellation:
 
         return page_star.path, f, page_star.methods()
 
+    async def page_herald_metrics(self, request: starlette.requests.Request) -> starlette.responses.Response:
+        """Export the traffic metrics of the Herald Link of the Constellation and of the Herald Server, in the
+        Prometheus text format."""
+        self._first_page_check()
+        if self.herald is None:
+            return starlette.responses.PlainTextResponse("The Herald is not enabled on this Constellation.",
+                                                         status_code=404)
+        text = self.herald.registry.render()
+        try:
+            text += await self.herald.server_metrics()
+        except rh.LinkError as e:
+            # The metrics of the Link are still useful
+            log.warning(f"Could not get the Herald Server metrics: {e}")
+        return starlette.responses.PlainTextResponse(text, media_type="text/plain; version=0.0.4")
+
     def register_page_stars(self, page_stars: List[Type[PageStar]], pack_cfg: rc.ConfigDict):
         for SelectedPageStar in page_stars:
             log.debug(f"Registering: {SelectedPageStar.path} -> {SelectedPageStar.__qualname__}")
@@ -279,7 +356,8 @@ class Constellation:
                     sentry_cfg: Dict[str, Any],
                     packs_cfg: Dict[str, Any],
                     constellation_cfg: Dict[str, Any],
-                    logging_cfg: Dict[str, Any]):
+                    logging_cfg: Dict[str, Any],
+                    report_queue: Optional[multiprocessing.Queue] = None):
         """Blockingly create and run the Constellation.
 
         This should be used as the target of a :class:`multiprocessing.Process`."""
@@ -298,6 +376,9 @@ class Constellation:
                             packs_cfg=packs_cfg,
                             constellation_cfg=constellation_cfg,
                             logging_cfg=logging_cfg)
+        log.info(f"Startup: {constellation.startup.duration:.3f}s")
+        if report_queue is not None:
+            report_queue.put(("startup", multiprocessing.current_process().name, dict(constellation.startup.phases)))
 
         # Run the server
         constellation.run_blocking()
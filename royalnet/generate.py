@@ -1,8 +1,8 @@
-import importlib
-
 import click
 import toml
 
+import royalnet.utils as ru
+
 p = click.echo
 
 
@@ -14,34 +14,14 @@ def run(config_filename, file_format):
     with open(config_filename, "r") as t:
         config: dict = toml.load(t)
 
-    # Import packs
-    packs_cfg = config["Packs"]
-    pack_names = packs_cfg["active"]
-    packs = {}
-    for pack_name in pack_names:
-        try:
-            packs[pack_name] = {
-                "commands": importlib.import_module(f"{pack_name}.commands"),
-                "events": importlib.import_module(f"{pack_name}.events"),
-                "stars": importlib.import_module(f"{pack_name}.stars"),
-                "tables": importlib.import_module(f"{pack_name}.tables"),
-            }
-        except ImportError as e:
-            p(f"Skipping `{pack_name}`: {e}", err=True)
-            continue
+    # Import packs lazily, so that only the commands are imported
+    packs = ru.Pack.from_config(config["Packs"])
 
     if file_format == "botfather":
-        for pack_name in packs:
-            pack = packs[pack_name]
+        for pack in packs:
             lines = []
 
-            try:
-                # noinspection PyUnresolvedReferences
-                commands = pack["commands"].available_commands
-            except AttributeError:
-                p(f"Pack `{pack}` does not have the `available_commands` attribute.", err=True)
-                continue
-            for command in commands:
+            for command in pack.commands:
                 lines.append(f"{command.name} - {command.description}")
 
             lines.sort()
@@ -12,12 +12,14 @@ You can install it with: ::
 
 from .broadcast import Broadcast
 from .config import Config
+from .credit import StreamCredit
 from .errors import *
 from .link import Link
-from .package import Package
+from .package import Package, Envelope, Codec, JSONCodec, MsgpackCodec, available_codecs, pack_batch, unpack_batch
 from .request import Request
-from .response import Response, ResponseSuccess, ResponseFailure
+from .response import Response, ResponseSuccess, ResponseFailure, ResponseChunk, ResponseStream
 from .server import Server
+from .unix import UnixConnection
 
 __all__ = [
     "Config",
@@ -25,13 +27,26 @@ __all__ = [
     "ConnectionClosedError",
     "LinkError",
     "InvalidServerResponseError",
+    "RequestTimeoutError",
+    "StreamFailedError",
     "ServerError",
     "Link",
     "Package",
+    "Envelope",
+    "Codec",
+    "JSONCodec",
+    "MsgpackCodec",
+    "available_codecs",
+    "pack_batch",
+    "unpack_batch",
     "Request",
     "Response",
     "ResponseSuccess",
     "ResponseFailure",
+    "ResponseChunk",
+    "ResponseStream",
+    "StreamCredit",
     "Server",
+    "UnixConnection",
     "Broadcast",
 ]
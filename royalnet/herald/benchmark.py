@@ -0,0 +1,289 @@
+"""A load generator measuring the throughput and the latency of the :mod:`royalnet.herald`.
+
+It starts one or more clustered :class:`Server` in separate processes and connects multiple :class:`Link` to them,
+then prints the results as JSON, so that they can be compared between different versions.
+
+Run it with: ::
+
+    python -m royalnet.herald.benchmark --links 8 --messages 1000 --workload mixed
+
+"""
+
+import asyncio as aio
+import datetime
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+from typing import *
+
+import click
+
+import royalnet
+from .broadcast import Broadcast
+from .config import Config
+from .errors import RequestTimeoutError
+from .link import Link
+from .package import available_codecs
+from .request import Request
+from .response import ResponseSuccess
+from .server import Server
+
+LINK_TYPE = "benchmark"
+HANDLER = "benchmark"
+
+
+def process_usage(pid: int) -> Optional[Dict[str, float]]:
+    """Get the CPU seconds used by a process and its current RSS in bytes, reading them from ``/proc``.
+
+    Returns:
+        A :class:`dict` with the ``cpu_seconds`` and ``rss_bytes`` keys, or :const:`None` if ``/proc`` is not
+        available."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            # The process name may contain spaces, so skip it before splitting
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open(f"/proc/{pid}/status") as f:
+            rss_kb = next(int(line.split()[1]) for line in f if line.startswith("VmRSS:"))
+    except (OSError, StopIteration):
+        return None
+    ticks = os.sysconf("SC_CLK_TCK")
+    # utime and stime are the 14th and 15th fields of the whole line
+    return {
+        "cpu_seconds": (int(fields[11]) + int(fields[12])) / ticks,
+        "rss_bytes": rss_kb * 1024,
+    }
+
+
+def percentile(ordered: List[float], fraction: float) -> Optional[float]:
+    """Get a percentile of an already sorted list of values."""
+    if not ordered:
+        return None
+    return ordered[round(fraction * (len(ordered) - 1))]
+
+
+class Benchmark:
+    def __init__(self,
+                 configs: List[Config],
+                 *,
+                 links: int,
+                 messages: int,
+                 concurrency: int,
+                 payload_size: int,
+                 workload: str,
+                 codec: Optional[str] = None,
+                 loop: aio.AbstractEventLoop):
+        self.configs: List[Config] = configs
+        """The configurations of the servers; the links are spread evenly between them."""
+        self.config: Config = configs[0]
+        self.link_count: int = links
+        self.messages: int = messages
+        """The number of messages sent by each link."""
+        self.concurrency: int = concurrency
+        """The number of messages each link keeps in flight at the same time."""
+        self.payload: str = "x" * payload_size
+        self.workload: str = workload
+        self.codec: Optional[str] = codec
+        self.loop: aio.AbstractEventLoop = loop
+        self.links: List[Link] = []
+        self.link_tasks: List[aio.Task] = []
+        """The tasks running the :attr:`.links`, cancelled when the benchmark ends."""
+        self.latencies: List[float] = []
+        """The round-trip times of the requests and the delivery times of the broadcasts, in seconds."""
+        self.expected_broadcasts: int = 0
+        self.received_broadcasts: int = 0
+        self.broadcasts_done: aio.Event = aio.Event(loop=loop)
+
+    async def handler(self, message: Union[Request, Broadcast]):
+        if isinstance(message, Request):
+            return ResponseSuccess()
+        self.latencies.append(time.perf_counter() - message.data["sent"])
+        self.received_broadcasts += 1
+        if self.received_broadcasts >= self.expected_broadcasts:
+            self.broadcasts_done.set()
+
+    def is_broadcast(self, index: int) -> bool:
+        if self.workload == "broadcast":
+            return True
+        if self.workload == "mixed":
+            return index % 2 == 1
+        return False
+
+    async def send_one(self, link: Link, peer: Link, index: int):
+        data = {"sent": time.perf_counter(), "payload": self.payload}
+        if self.is_broadcast(index):
+            await link.broadcast(LINK_TYPE, Broadcast(handler=HANDLER, data=data))
+        else:
+            await link.request(peer.nid, Request(handler=HANDLER, data=data))
+            self.latencies.append(time.perf_counter() - data["sent"])
+
+    async def send_all(self, link: Link, peer: Link):
+        slots = aio.Semaphore(self.concurrency, loop=self.loop)
+
+        async def send(index: int):
+            async with slots:
+                await self.send_one(link, peer, index)
+
+        await aio.gather(*[send(index) for index in range(self.messages)], loop=self.loop)
+
+    async def connect(self):
+        for number in range(self.link_count):
+            config = self.configs[number % len(self.configs)]
+            link = Link(config.copy(name=LINK_TYPE), self.handler, loop=self.loop)
+            if self.codec is not None:
+                link.codecs = {self.codec: link.codecs[self.codec]}
+            self.links.append(link)
+            self.link_tasks.append(self.loop.create_task(link.run()))
+        for link in self.links:
+            await link.identify_event.wait()
+        # The servers of a cluster may need some time to learn about the links connected to the others
+        for link in self.links:
+            for peer in self.links:
+                while True:
+                    try:
+                        await link.request(peer.nid, Request(handler=HANDLER, data={}), timeout=1)
+                    except RequestTimeoutError:
+                        continue
+                    break
+
+    async def disconnect(self):
+        for task in self.link_tasks:
+            task.cancel()
+        await aio.gather(*self.link_tasks, loop=self.loop, return_exceptions=True)
+        for link in self.links:
+            if link.websocket is not None:
+                await link.websocket.close()
+
+    async def run(self, server_pids: List[int]) -> Dict[str, Any]:
+        try:
+            await self.connect()
+            return await self.measure(server_pids)
+        finally:
+            await self.disconnect()
+
+    async def measure(self, server_pids: List[int]) -> Dict[str, Any]:
+        broadcasts_per_link = sum(1 for index in range(self.messages) if self.is_broadcast(index))
+        # Every broadcast is received by every link, including the sender
+        self.expected_broadcasts = broadcasts_per_link * self.link_count * self.link_count
+        if self.expected_broadcasts == 0:
+            self.broadcasts_done.set()
+
+        usage_before = [process_usage(pid) for pid in server_pids]
+        start = time.perf_counter()
+        await aio.gather(*[self.send_all(link, self.links[(number + 1) % self.link_count])
+                           for number, link in enumerate(self.links)], loop=self.loop)
+        await self.broadcasts_done.wait()
+        elapsed = time.perf_counter() - start
+        usage_after = [process_usage(pid) for pid in server_pids]
+        measured = all(usage_before) and all(usage_after)
+
+        ordered = sorted(self.latencies)
+        delivered = len(ordered)
+        return {
+            "royalnet_version": royalnet.__version__,
+            "datetime": datetime.datetime.now().isoformat(),
+            "parameters": {
+                "servers": len(self.configs),
+                "links": self.link_count,
+                "messages": self.messages,
+                "concurrency": self.concurrency,
+                "payload_size": len(self.payload),
+                "workload": self.workload,
+                "codec": self.links[0].codec.name,
+                "compression_threshold": self.config.compression_threshold,
+                "websocket_compression": self.config.websocket_compression,
+                "batch_window": self.config.batch_window,
+                "local_socket": self.config.local_socket is not None,
+            },
+            "elapsed_seconds": elapsed,
+            "delivered_messages": delivered,
+            "messages_per_second": delivered / elapsed,
+            "latency_seconds": {
+                "p50": percentile(ordered, 0.50),
+                "p99": percentile(ordered, 0.99),
+                "p999": percentile(ordered, 0.999),
+                "max": ordered[-1] if ordered else None,
+            },
+            "server": {
+                "cpu_seconds": (sum(after["cpu_seconds"] - before["cpu_seconds"]
+                                    for before, after in zip(usage_before, usage_after))
+                                if measured else None),
+                "rss_bytes": sum(after["rss_bytes"] for after in usage_after) if measured else None,
+            },
+        }
+
+
+@click.command()
+@click.option("-a", "--address", default="127.0.0.1", help="The address the benchmark server should listen on.")
+@click.option("-p", "--port", default=44454, type=int,
+              help="The port the benchmark server should listen on; other servers use the following ones.")
+@click.option("-n", "--servers", default=1, type=int, help="The number of clustered servers to start.")
+@click.option("-l", "--links", default=8, type=int, help="The number of links to connect to the server.")
+@click.option("-m", "--messages", default=1000, type=int, help="The number of messages sent by each link.")
+@click.option("-c", "--concurrency", default=16, type=int,
+              help="The number of messages each link keeps in flight at the same time.")
+@click.option("-s", "--payload-size", default=256, type=int, help="The size in bytes of the payload of each message.")
+@click.option("-w", "--workload", default="request", type=click.Choice(["request", "broadcast", "mixed"]),
+              help="The kind of messages that should be sent.")
+@click.option("--codec", default=None, type=click.Choice(list(available_codecs())),
+              help="Force the links to use a specific codec.")
+@click.option("--compression-threshold", default=1024, type=int,
+              help="The minimum size in bytes of the data that should be compressed by the codec.")
+@click.option("--websocket-compression/--no-websocket-compression", default=True,
+              help="Use the permessage-deflate websocket extension.")
+@click.option("--batch-window", default=None, type=float,
+              help="The number of seconds to wait for more packages to join in a batch; if not set, don't batch.")
+@click.option("--local-socket/--no-local-socket", default=False,
+              help="Connect the links through an Unix domain socket instead of a websocket.")
+@click.option("-o", "--output", default=None, type=click.File("w", encoding="utf8"),
+              help="The file the JSON results should be written to, instead of the standard output.")
+def run(address, port, servers, links, messages, concurrency, payload_size, workload, codec, compression_threshold,
+        websocket_compression, batch_window, local_socket, output):
+    configs = [Config(name="<server>",
+                      address=address,
+                      port=port + number,
+                      secret="benchmark",
+                      compression_threshold=compression_threshold,
+                      websocket_compression=websocket_compression,
+                      batch_window=batch_window,
+                      local_socket=(os.path.join(tempfile.gettempdir(), f"royalnet-benchmark-{port + number}.sock")
+                                    if local_socket else None))
+               for number in range(servers)]
+    # Connect every server to all the others
+    for config in configs:
+        config.peers = [other.url for other in configs if other is not config]
+    server_processes = []
+    for number, config in enumerate(configs):
+        server_process = multiprocessing.Process(
+            name=f"Herald.Benchmark.{number}",
+            target=Server(config).run_blocking,
+            daemon=True,
+            kwargs={
+                "logging_cfg": {
+                    "log_format": "{asctime}\t| {processName}\t| {name}\t| {message}",
+                    "Loggers": {"root": "ERROR"},
+                }
+            }
+        )
+        server_process.start()
+        server_processes.append(server_process)
+    try:
+        loop = aio.get_event_loop()
+        benchmark = Benchmark(configs,
+                              links=links,
+                              messages=messages,
+                              concurrency=concurrency,
+                              payload_size=payload_size,
+                              workload=workload,
+                              codec=codec,
+                              loop=loop)
+        results = loop.run_until_complete(benchmark.run([process.pid for process in server_processes]))
+    finally:
+        for server_process in server_processes:
+            server_process.kill()
+    click.echo(json.dumps(results, indent=4), file=output)
+
+
+if __name__ == "__main__":
+    run()
@@ -1,4 +1,5 @@
-from typing import Optional
+import random
+from typing import Optional, List
 
 
 class Config:
@@ -8,10 +9,31 @@ class Config:
                  port: int,
                  secret: str,
                  secure: bool = False,
-                 path: str = "/"
+                 path: str = "/",
+                 request_timeout: Optional[float] = None,
+                 max_pending_requests: Optional[int] = None,
+                 max_running_handlers: int = 16,
+                 max_queued_handlers: int = 1024,
+                 max_running_per_handler: Optional[int] = None,
+                 max_queued_packages: int = 1024,
+                 reconnect_min_delay: float = 1.0,
+                 reconnect_max_delay: float = 60.0,
+                 compression_threshold: Optional[int] = 1024,
+                 websocket_compression: bool = True,
+                 batch_window: Optional[float] = None,
+                 batch_max_bytes: int = 65536,
+                 peers: Optional[List[str]] = None,
+                 heartbeat_interval: Optional[float] = 20.0,
+                 heartbeat_timeout: float = 20.0,
+                 local_socket: Optional[str] = None,
+                 metrics_path: Optional[str] = None,
+                 outbox_path: Optional[str] = None,
+                 outbox_max_bytes: int = 16 * 1024 * 1024,
                  ):
         if ":" in name:
             raise ValueError("Herald names cannot contain colons (:)")
+        if name.startswith("#"):
+            raise ValueError("Herald names cannot start with a hash (#), as it is used for topics")
         self.name = name
 
         self.address = address
@@ -30,24 +52,148 @@ class Config:
             raise ValueError("Herald paths must start with a slash (/)")
         self.path = path
 
+        if request_timeout is not None and request_timeout <= 0:
+            raise ValueError("Herald request timeouts must be positive")
+        self.request_timeout = request_timeout
+
+        if max_pending_requests is not None and max_pending_requests < 1:
+            raise ValueError("Herald links must allow at least one pending request")
+        self.max_pending_requests = max_pending_requests
+
+        if max_running_handlers < 1:
+            raise ValueError("Herald links must be able to run at least one handler")
+        self.max_running_handlers = max_running_handlers
+
+        if max_queued_handlers < max_running_handlers:
+            raise ValueError("Herald links must be able to queue at least as many handlers as they can run")
+        self.max_queued_handlers = max_queued_handlers
+
+        if max_running_per_handler is not None and max_running_per_handler < 1:
+            raise ValueError("Herald handlers must be able to run at least once at a time")
+        self.max_running_per_handler = max_running_per_handler
+
+        if max_queued_packages < 1:
+            raise ValueError("Herald links must be able to queue at least one package")
+        self.max_queued_packages = max_queued_packages
+
+        if reconnect_min_delay <= 0 or reconnect_max_delay < reconnect_min_delay:
+            raise ValueError("Herald reconnection delays must be positive, and the maximum can't be below the minimum")
+        self.reconnect_min_delay = reconnect_min_delay
+        self.reconnect_max_delay = reconnect_max_delay
+
+        if compression_threshold is not None and compression_threshold < 0:
+            raise ValueError("Herald compression thresholds can't be negative")
+        self.compression_threshold = compression_threshold
+
+        self.websocket_compression = websocket_compression
+
+        if batch_window is not None and batch_window < 0:
+            raise ValueError("Herald batch windows can't be negative")
+        self.batch_window = batch_window
+
+        if batch_max_bytes < 1:
+            raise ValueError("Herald batches must be able to contain at least one byte")
+        self.batch_max_bytes = batch_max_bytes
+
+        peers = peers or []
+        for peer in peers:
+            if not (peer.startswith("ws://") or peer.startswith("wss://")):
+                raise ValueError("Herald peers must be websocket urls (ws:// or wss://)")
+        self.peers = peers
+
+        if heartbeat_interval is not None and heartbeat_interval <= 0:
+            raise ValueError("Herald heartbeat intervals must be positive")
+        self.heartbeat_interval = heartbeat_interval
+
+        if heartbeat_timeout <= 0:
+            raise ValueError("Herald heartbeat timeouts must be positive")
+        self.heartbeat_timeout = heartbeat_timeout
+
+        self.local_socket = local_socket
+
+        if metrics_path is not None and not metrics_path.startswith("/"):
+            raise ValueError("Herald metrics paths must start with a slash")
+        self.metrics_path = metrics_path
+
+        self.outbox_path = outbox_path
+
+        if outbox_max_bytes < 1:
+            raise ValueError("Herald outboxes must be able to contain at least a byte")
+        self.outbox_max_bytes = outbox_max_bytes
+
     @property
     def url(self):
         return f"ws{'s' if self.secure else ''}://{self.address}:{self.port}{self.path}"
 
+    def reconnect_delay(self, attempt: int) -> float:
+        """Get the number of seconds to wait before the reconnection attempt number ``attempt``.
+
+        The delay grows exponentially with the number of failed attempts, and is randomized so that many links don't
+        all reconnect at the same time after a server restart."""
+        delay = min(self.reconnect_max_delay, self.reconnect_min_delay * 2 ** min(attempt, 32))
+        return random.uniform(delay / 2, delay)
+
     def copy(self,
              name: Optional[str] = None,
              address: Optional[str] = None,
              port: Optional[int] = None,
              secret: Optional[str] = None,
              secure: Optional[bool] = None,
-             path: Optional[str] = None):
+             path: Optional[str] = None,
+             request_timeout: Optional[float] = None,
+             max_pending_requests: Optional[int] = None,
+             max_running_handlers: Optional[int] = None,
+             max_queued_handlers: Optional[int] = None,
+             max_running_per_handler: Optional[int] = None,
+             max_queued_packages: Optional[int] = None,
+             reconnect_min_delay: Optional[float] = None,
+             reconnect_max_delay: Optional[float] = None,
+             compression_threshold: Optional[int] = None,
+             websocket_compression: Optional[bool] = None,
+             batch_window: Optional[float] = None,
+             batch_max_bytes: Optional[int] = None,
+             peers: Optional[List[str]] = None,
+             heartbeat_interval: Optional[float] = None,
+             heartbeat_timeout: Optional[float] = None,
+             local_socket: Optional[str] = None,
+             metrics_path: Optional[str] = None,
+             outbox_path: Optional[str] = None,
+             outbox_max_bytes: Optional[int] = None):
         """Create an exact copy of this configuration, but with different parameters."""
         return self.__class__(name=name if name else self.name,
                               address=address if address else self.address,
                               port=port if port else self.port,
                               secret=secret if secret else self.secret,
                               secure=secure if secure else self.secure,
-                              path=path if path else self.path)
+                              path=path if path else self.path,
+                              request_timeout=request_timeout if request_timeout else self.request_timeout,
+                              max_pending_requests=(max_pending_requests if max_pending_requests
+                                                    else self.max_pending_requests),
+                              max_running_handlers=(max_running_handlers if max_running_handlers
+                                                    else self.max_running_handlers),
+                              max_queued_handlers=(max_queued_handlers if max_queued_handlers
+                                                   else self.max_queued_handlers),
+                              max_running_per_handler=(max_running_per_handler if max_running_per_handler
+                                                       else self.max_running_per_handler),
+                              max_queued_packages=(max_queued_packages if max_queued_packages
+                                                   else self.max_queued_packages),
+                              reconnect_min_delay=(reconnect_min_delay if reconnect_min_delay
+                                                   else self.reconnect_min_delay),
+                              reconnect_max_delay=(reconnect_max_delay if reconnect_max_delay
+                                                   else self.reconnect_max_delay),
+                              compression_threshold=(compression_threshold if compression_threshold
+                                                     else self.compression_threshold),
+                              websocket_compression=(websocket_compression if websocket_compression is not None
+                                                     else self.websocket_compression),
+                              batch_window=batch_window if batch_window is not None else self.batch_window,
+                              batch_max_bytes=batch_max_bytes if batch_max_bytes else self.batch_max_bytes,
+                              peers=peers if peers is not None else self.peers,
+                              heartbeat_interval=heartbeat_interval if heartbeat_interval else self.heartbeat_interval,
+                              heartbeat_timeout=heartbeat_timeout if heartbeat_timeout else self.heartbeat_timeout,
+                              local_socket=local_socket if local_socket else self.local_socket,
+                              metrics_path=metrics_path if metrics_path else self.metrics_path,
+                              outbox_path=outbox_path if outbox_path else self.outbox_path,
+                              outbox_max_bytes=outbox_max_bytes if outbox_max_bytes else self.outbox_max_bytes)
 
     def __repr__(self):
         return f"<HeraldConfig for {self.url}>"
@@ -61,6 +207,25 @@ class Config:
             secret: str,
             secure: bool = False,
             path: str = "/",
+            request_timeout: Optional[float] = None,
+            max_pending_requests: Optional[int] = None,
+            max_running_handlers: int = 16,
+            max_queued_handlers: int = 1024,
+            max_running_per_handler: Optional[int] = None,
+            max_queued_packages: int = 1024,
+            reconnect_min_delay: float = 1.0,
+            reconnect_max_delay: float = 60.0,
+            compression_threshold: Optional[int] = 1024,
+            websocket_compression: bool = True,
+            batch_window: Optional[float] = None,
+            batch_max_bytes: int = 65536,
+            peers: Optional[List[str]] = None,
+            heartbeat_interval: Optional[float] = 20.0,
+            heartbeat_timeout: float = 20.0,
+            local_socket: Optional[str] = None,
+            metrics_path: Optional[str] = None,
+            outbox_path: Optional[str] = None,
+            outbox_max_bytes: int = 16 * 1024 * 1024,
             **_,
     ):
         return cls(
@@ -69,5 +234,24 @@ class Config:
             port=port,
             secret=secret,
             secure=secure,
-            path=path
+            path=path,
+            request_timeout=request_timeout,
+            max_pending_requests=max_pending_requests,
+            max_running_handlers=max_running_handlers,
+            max_queued_handlers=max_queued_handlers,
+            max_running_per_handler=max_running_per_handler,
+            max_queued_packages=max_queued_packages,
+            reconnect_min_delay=reconnect_min_delay,
+            reconnect_max_delay=reconnect_max_delay,
+            compression_threshold=compression_threshold,
+            websocket_compression=websocket_compression,
+            batch_window=batch_window,
+            batch_max_bytes=batch_max_bytes,
+            peers=peers,
+            heartbeat_interval=heartbeat_interval,
+            heartbeat_timeout=heartbeat_timeout,
+            local_socket=local_socket,
+            metrics_path=metrics_path,
+            outbox_path=outbox_path,
+            outbox_max_bytes=outbox_max_bytes,
         )
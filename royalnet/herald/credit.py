@@ -0,0 +1,26 @@
+from typing import *
+
+
+class StreamCredit:
+    """Sent by the :class:`Link` receiving a stream of :class:`ResponseChunk` to the one sending them, to allow it to
+    send more chunks, or to stop the stream."""
+
+    def __init__(self, credit: int = 0, cancel: bool = False, msg_type: Optional[str] = None):
+        super().__init__()
+        if msg_type is not None:
+            assert msg_type == self.__class__.__name__
+        self.msg_type = self.__class__.__name__
+        self.credit: int = credit
+        """The number of chunks that can be sent in addition to the ones already allowed."""
+        self.cancel: bool = cancel
+        """If :data:`True`, the stream should be stopped, as the chunks are not going to be read anymore."""
+
+    def to_dict(self):
+        return self.__dict__
+
+    @classmethod
+    def from_dict(cls, d: dict):
+        return cls(**d)
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(credit={self.credit}, cancel={self.cancel})"
@@ -11,8 +11,21 @@ class ServerError(HeraldError):
 
 
 class ConnectionClosedError(LinkError):
-    """The :py:class:`Link`'s connection was closed unexpectedly. The link can't be used anymore."""
+    """The :py:class:`Link`'s connection was closed unexpectedly. The link will try to reconnect by itself."""
 
 
 class InvalidServerResponseError(LinkError):
     """The :py:class:`Server` sent invalid data to the :class:`Link`."""
+
+
+class RequestTimeoutError(LinkError):
+    """A request sent by a :py:class:`Link` did not receive a response in time."""
+
+
+class StreamFailedError(LinkError):
+    """A streaming request sent by a :py:class:`Link` ended with a :py:class:`ResponseFailure`, available in the
+    :attr:`.response` attribute."""
+
+    def __init__(self, response):
+        super().__init__(response)
+        self.response = response
@@ -1,31 +1,47 @@
 import asyncio as aio
+import collections
 import functools
 import logging
+import os
+import time
 import uuid
 from typing import *
 
 import websockets
 
+import royalnet.utils as ru
 from .broadcast import Broadcast
 from .config import Config
-from .errors import ConnectionClosedError, InvalidServerResponseError
-from .package import Package
+from .credit import StreamCredit
+from .errors import LinkError, ConnectionClosedError, InvalidServerResponseError, RequestTimeoutError, \
+    StreamFailedError
+from .package import Package, Codec, JSONCodec, available_codecs, pack_batch, unpack_batch
 from .request import Request
-from .response import Response, ResponseSuccess, ResponseFailure
+from .unix import UnixConnection
+from .response import Response, ResponseSuccess, ResponseFailure, ResponseChunk, ResponseStream
 
 log = logging.getLogger(__name__)
 
 
 class PendingRequest:
-    def __init__(self, *, loop: aio.AbstractEventLoop = None):
+    def __init__(self, *, loop: aio.AbstractEventLoop = None, package: Optional[Package] = None, retry: bool = False):
         if loop is None:
             self.loop = aio.get_event_loop()
         else:
             self.loop = loop
         self.event: aio.Event = aio.Event(loop=loop)
         self.data: Optional[dict] = None
+        self.error: Optional[Exception] = None
+        self.package: Optional[Package] = package
+        """The package containing the request."""
+        self.retry: bool = retry
+        """Should the request be sent again if the connection is lost before a response is received?"""
+        self.sent: bool = False
+        """Was the request written to the current connection?"""
 
     def __repr__(self):
+        if self.error is not None:
+            return f"<{self.__class__.__qualname__}: {self.error.__class__.__name__}>"
         if self.event.is_set():
             return f"<{self.__class__.__qualname__}: {self.data.__class__.__name__}>"
         return f"<{self.__class__.__qualname__}>"
@@ -34,6 +50,43 @@ class PendingRequest:
         self.data = data
         self.event.set()
 
+    def fail(self, error: Exception):
+        """Wake up the request, making it raise ``error`` instead of returning a response."""
+        self.error = error
+        self.event.set()
+
+
+class OutgoingStream:
+    """The state of a stream of :class:`ResponseChunk` being sent by a :class:`Link`."""
+
+    def __init__(self, *, loop: aio.AbstractEventLoop, credit: int):
+        self.credit: int = credit
+        """The number of chunks that can be sent before waiting for a :class:`StreamCredit`."""
+        self.cancelled: bool = False
+        self.event: aio.Event = aio.Event(loop=loop)
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__}: {self.credit} credit>"
+
+    def grant(self, credit: StreamCredit):
+        if credit.cancel:
+            self.cancelled = True
+        self.credit += credit.credit
+        self.event.set()
+
+    async def wait(self, timeout: Optional[float]) -> bool:
+        """Wait until another chunk can be sent.
+
+        Returns:
+            :data:`False` if the stream was cancelled, or if no credit was granted in ``timeout`` seconds."""
+        while self.credit <= 0 and not self.cancelled:
+            self.event.clear()
+            try:
+                await aio.wait_for(self.event.wait(), timeout=timeout)
+            except aio.TimeoutError:
+                return False
+        return not self.cancelled
+
 
 def requires_connection(func):
     @functools.wraps(func)
@@ -55,13 +108,27 @@ def requires_identification(func):
 
 class Link:
     def __init__(self, config: Config, request_handler, *,
-                 loop: aio.AbstractEventLoop = None):
+                 loop: aio.AbstractEventLoop = None,
+                 handler_limits: Optional[Dict[str, int]] = None,
+                 subscriptions: Optional[Iterable[str]] = None):
         self.config: Config = config
         self.nid: str = str(uuid.uuid4())
-        self.websocket: Optional["websockets.WebSocketClientProtocol"] = None
+        self.websocket: Optional[Union["websockets.WebSocketClientProtocol", UnixConnection]] = None
         self.request_handler: Callable[[Union[Request, Broadcast]],
                                        Awaitable[Response]] = request_handler
         self._pending_requests: Dict[str, PendingRequest] = {}
+        self._pending_streams: Dict[str, "aio.Queue[Union[Package, Exception]]"] = {}
+        """The packages received in response to the streaming requests, indexed by the ``conv_id`` of the request."""
+        self._outgoing_streams: Dict[str, OutgoingStream] = {}
+        """The streams being sent in response to the requests of other links, indexed by the ``conv_id`` of the
+        request."""
+        self.codecs: Dict[str, Codec] = available_codecs(compression_threshold=self.config.compression_threshold)
+        """The :class:`Codec` that this Link can use, from the most to the least preferred."""
+        self._json_codec: Codec = self.codecs.get(JSONCodec.name) or JSONCodec()
+        self.codec: Codec = self._json_codec
+        """The :class:`Codec` agreed with the :class:`Server`; it is always JSON until the Link is identified."""
+        self.server_features: Set[str] = set()
+        """The optional protocol features supported by the :class:`Server`, such as ``batch``."""
         if loop is None:
             self._loop = aio.get_event_loop()
         else:
@@ -69,6 +136,62 @@ class Link:
         self.error_event: aio.Event = aio.Event(loop=self._loop)
         self.connect_event: aio.Event = aio.Event(loop=self._loop)
         self.identify_event: aio.Event = aio.Event(loop=self._loop)
+        self._pending_slots: Optional[aio.Semaphore] = None
+        if self.config.max_pending_requests is not None:
+            self._pending_slots = aio.Semaphore(self.config.max_pending_requests, loop=self._loop)
+        self.handler_limits: Dict[str, int] = handler_limits or {}
+        """The maximum number of times each handler can be running at the same time, overriding
+        :attr:`.config.max_running_per_handler`."""
+        self._handler_incoming: ru.LaneQueue = ru.LaneQueue(loop=self._loop)
+        """The received requests and broadcasts waiting for a slot in :attr:`._handler_jobs`, so that the receive loop
+        never stops reading the responses while the handlers are busy."""
+        self._handler_jobs: ru.LaneQueue = ru.LaneQueue(loop=self._loop)
+        """The received requests and broadcasts waiting to be handled, with the ones with a priority handled first."""
+        self._handler_slots: aio.Semaphore = aio.Semaphore(self.config.max_queued_handlers, loop=self._loop)
+        self._handler_running: Dict[str, int] = collections.Counter()
+        self._handler_deferred: Dict[str, Deque[Package]] = collections.defaultdict(collections.deque)
+        self._handler_workers: List[aio.Task] = []
+        self._handler_done: Dict[int, aio.Future] = {}
+        """A future for each received request and broadcast that wasn't handled yet, indexed by the ``id`` of its
+        package, resolved as soon as its handler returns."""
+        self._outbox: ru.LaneQueue = ru.LaneQueue(self.config.max_queued_packages, loop=self._loop)
+        """The ``(package, codec, raw, urgent)`` tuples waiting to be sent, with the ones with a priority sent first."""
+        self._urgent_queued: int = 0
+        """The number of urgent packages in the outbox, which shouldn't wait for the batch window to end."""
+        self._flush_event: aio.Event = aio.Event(loop=self._loop)
+        self._writer_task: Optional[aio.Task] = None
+        self._received: Deque[Package] = collections.deque()
+        """The packages received in a batch that weren't returned by :meth:`.receive` yet."""
+        self._resend: List[PendingRequest] = []
+        self.subscriptions: Set[str] = set(subscriptions or [])
+        """The topics this Link receives the published broadcasts of: handler names, or :mod:`fnmatch` patterns
+        matching them."""
+        self._delivered: ru.TTLCache = ru.TTLCache(maxsize=4096, ttl=3600)
+        """The ``conv_id`` of the last received broadcasts, to drop the ones the server sends again."""
+        self.registry: ru.MetricsRegistry = ru.MetricsRegistry("herald_link_")
+        """The traffic metrics of the Link, which can be exported in the Prometheus text format."""
+        self.sent_messages: ru.MetricCounter = self.registry.counter(
+            "sent_messages_total", "Packages sent to the server.", ["type"])
+        self.sent_bytes: ru.MetricCounter = self.registry.counter(
+            "sent_bytes_total", "Bytes of the packages sent to the server.", ["type"])
+        self.received_messages: ru.MetricCounter = self.registry.counter(
+            "received_messages_total", "Packages received from the server.", ["type"])
+        self.received_bytes: ru.MetricCounter = self.registry.counter(
+            "received_bytes_total", "Bytes of the packages received from the server.", ["type"])
+        self.requests: ru.MetricCounter = self.registry.counter(
+            "requests_total", "Requests sent to other links.", ["destination", "handler"])
+        self.request_duration: ru.MetricHistogram = self.registry.histogram(
+            "request_duration_seconds", "Time between sending a request and receiving its response.",
+            ["destination", "handler"])
+        self.request_errors: ru.MetricCounter = self.registry.counter(
+            "request_errors_total", "Requests that received a failure, timed out or lost their connection.",
+            ["destination", "handler", "error"])
+        self.handle_duration: ru.MetricHistogram = self.registry.histogram(
+            "handle_duration_seconds", "Time spent handling the requests and the broadcasts of other links.",
+            ["handler"])
+        self.handle_errors: ru.MetricCounter = self.registry.counter(
+            "handle_errors_total", "Requests and broadcasts of other links whose handling failed.",
+            ["handler", "error"])
 
     def __repr__(self):
         if self.identify_event.is_set():
@@ -81,28 +204,83 @@ class Link:
             return f"<{self.__class__.__qualname__} (disconnected)>"
 
     async def connect(self):
-        """Connect to the :class:`Server` at :attr:`.config.url`."""
-        log.debug(f"Connecting to Herald Server at {self.config.url}...")
-        self.websocket = await websockets.connect(self.config.url, loop=self._loop)
+        """Connect to the :class:`Server` at :attr:`.config.local_socket` if it exists on this host, or at
+        :attr:`.config.url` otherwise."""
+        if self.websocket is not None:
+            await self.websocket.close()
+            self.websocket = None
+        if self.config.local_socket is not None and os.path.exists(self.config.local_socket):
+            log.debug(f"Connecting to Herald Server at {self.config.local_socket}...")
+            try:
+                self.websocket = await UnixConnection.connect(self.config.local_socket, loop=self._loop)
+            except OSError as e:
+                log.warning(f"Could not connect to {self.config.local_socket} ({e}), using {self.config.url}")
+        if self.websocket is None:
+            log.debug(f"Connecting to Herald Server at {self.config.url}...")
+            self.websocket = await websockets.connect(self.config.url,
+                                                      loop=self._loop,
+                                                      compression=("deflate" if self.config.websocket_compression
+                                                                   else None),
+                                                      ping_interval=self.config.heartbeat_interval,
+                                                      ping_timeout=self.config.heartbeat_timeout)
         self.connect_event.set()
         log.debug(f"Connected!")
 
+    def connection_lost(self) -> None:
+        """Mark the Link as disconnected, failing the requests that were sent and are waiting for a response, or
+        preparing them to be sent again after reconnecting if they can be retried."""
+        if not self.connect_event.is_set():
+            return
+        self.error_event.set()
+        self.connect_event.clear()
+        self.identify_event.clear()
+        log.warning(f"Herald Server connection closed: {self.config.url}")
+        error = ConnectionClosedError("The Herald Server connection was closed.")
+        for pending in self._pending_requests.values():
+            # Requests that weren't sent yet are still in the outbox
+            if not pending.sent:
+                continue
+            pending.sent = False
+            if pending.retry:
+                self._resend.append(pending)
+            else:
+                pending.fail(error)
+        # Streams can't be resumed on a new connection
+        for queue in self._pending_streams.values():
+            queue.put_nowait(error)
+        for stream in self._outgoing_streams.values():
+            stream.grant(StreamCredit(cancel=True))
+
     @requires_connection
+    async def _receive_frame(self) -> None:
+        try:
+            raw: bytes = await self.websocket.recv()
+            for frame in unpack_batch(raw):
+                try:
+                    package = self.codec.loads(frame)
+                except Exception as e:
+                    # The identification can't go on without its response, but a single bad package can be skipped
+                    if not self.identify_event.is_set():
+                        raise InvalidServerResponseError(f"Could not decode the package: {e!r}")
+                    log.warning(f"Dropping a package that {self.codec} could not decode ({e!r}): {bytes(frame)[:64]!r}")
+                    continue
+                msg_type = self._message_type(package)
+                self.received_messages.inc(msg_type)
+                self.received_bytes.inc(msg_type, amount=len(frame))
+                self._received.append(package)
+        except websockets.ConnectionClosed:
+            self.connection_lost()
+            raise ConnectionClosedError()
+
     async def receive(self) -> Package:
         """Recieve a :py:class:`Package` from the :py:class:`Server`.
 
         Raises:
             :exc:`ConnectionClosedError` if the connection is closed."""
-        try:
-            jbytes: bytes = await self.websocket.recv()
-            package: Package = Package.from_json_bytes(jbytes)
-        except websockets.ConnectionClosed:
-            self.error_event.set()
-            self.connect_event.clear()
-            self.identify_event.clear()
-            log.warning(f"Herald Server connection closed: {self.config.url}")
-            # What to do now? Let's just reraise.
-            raise ConnectionClosedError()
+        # The other packages of the last received batch come first
+        while not self._received:
+            await self._receive_frame()
+        package: Package = self._received.popleft()
         if self.identify_event.is_set() and package.destination != self.nid:
             raise InvalidServerResponseError("Package is not addressed to this NetworkLink.")
         log.debug(f"Received package: {package}")
@@ -111,79 +289,506 @@ class Link:
     @requires_connection
     async def identify(self) -> None:
         log.debug(f"Identifying...")
-        await self.websocket.send(f"Identify {self.nid}:{self.config.name}:{self.config.secret}")
+        self.codec = self._json_codec
+        # This Link can always receive batches, even if it doesn't send them
+        await self.websocket.send(f"Identify {self.nid}:{self.config.name}:{self.config.secret}"
+                                  f" {','.join(self.codecs)} batch,ack")
         response: Package = await self.receive()
         if not response.source == "<server>":
             raise InvalidServerResponseError("Received a non-service package before identification.")
         if "type" not in response.data:
             raise InvalidServerResponseError("Missing 'type' in response data")
         if response.data["type"] == "error":
-            raise ConnectionClosedError(f"Identification error: {response.data['type']}")
+            raise ConnectionClosedError(f"Identification error: {response.data['service']}")
         assert response.data["type"] == "success"
+        # Servers that don't know about codecs only understand JSON
+        self.codec = self.codecs.get(response.data.get("codec"), self._json_codec)
+        self.server_features = set(response.data.get("features", []))
+        # The server forgets the subscriptions of the previous connection
+        if self.subscriptions:
+            await self.websocket.send(self.codec.dumps(self._service_package("subscribe", self.subscriptions)))
+        self.error_event.clear()
         self.identify_event.set()
-        log.debug(f"Identified successfully!")
+        log.debug(f"Identified successfully, using {self.codec}!")
+        # Send again the requests that were lost with the previous connection
+        resend, self._resend = self._resend, []
+        for pending in resend:
+            if pending.package.source_conv_id in self._pending_requests:
+                log.debug(f"Retrying request: {pending.package}")
+                await self._outbox.put((pending.package.priority,
+                                        (pending.package, self.codec, self.codec.dumps(pending.package), False)))
+
+    async def send(self, package: Package, *, urgent: bool = False):
+        """Queue a package to be sent to the :class:`Server`.
 
-    @requires_identification
-    async def send(self, package: Package):
-        """Send a package to the :class:`Server`."""
+        If the Link is not identified, the package will be sent as soon as it is; if :attr:`.config.max_queued_packages`
+        packages are already waiting to be sent, wait until there's space for another.
+
+        Parameters:
+            package: The package to send.
+            urgent: Send the package immediately, without waiting for the :attr:`.config.batch_window` to end; packages
+                    with a priority are always urgent."""
         log.debug(f"Trying to send package: {package}")
+        urgent = urgent or package.priority > 0
         try:
-            jbytes = package.to_json_bytes()
+            raw = self.codec.dumps(package)
         except TypeError as e:
             log.fatal(f"Could not send package: {' '.join(e.args)}")
             raise
-        await self.websocket.send(jbytes)
-        log.debug(f"Sent package: {package}")
+        await self._outbox.put((package.priority, (package, self.codec, raw, urgent)))
+        if urgent:
+            self._urgent_queued += 1
+            self._flush_event.set()
+        log.debug(f"Queued package: {package}")
+
+    def _next_queued(self) -> Tuple[Package, Codec, bytes, bool]:
+        item = self._outbox.get_nowait()
+        if item[3]:
+            self._urgent_queued -= 1
+        return item
+
+    async def _fill_batch(self, batch: List[Tuple[Package, Codec, bytes, bool]]) -> None:
+        """Add to the batch the packages queued before the end of the :attr:`.config.batch_window`, until it reaches
+        :attr:`.config.batch_max_bytes`.
+
+        The window ends immediately if the batch starts with an urgent package, or if an urgent package is queued;
+        the packages that are already queued are still added to the batch."""
+        if self.config.batch_window and not batch[0][3] and not self._urgent_queued:
+            self._flush_event.clear()
+            try:
+                await aio.wait_for(self._flush_event.wait(), timeout=self.config.batch_window)
+            except aio.TimeoutError:
+                pass
+        size = sum(len(raw) for _, _, raw, _ in batch)
+        while size < self.config.batch_max_bytes and not self._outbox.empty():
+            item = self._next_queued()
+            batch.append(item)
+            size += len(item[2])
+
+    async def _writer(self) -> None:
+        """Write the queued packages to the websocket, waiting for the Link to be identified when necessary.
+
+        If :attr:`.config.batch_window` is set and the :class:`Server` supports it, packages queued in quick succession
+        are joined and sent with a single websocket message."""
+        while True:
+            item = await self._outbox.get()
+            if item[3]:
+                self._urgent_queued -= 1
+            batch = [item]
+            await self.identify_event.wait()
+            if self.config.batch_window is not None and "batch" in self.server_features:
+                await self._fill_batch(batch)
+            while batch:
+                await self.identify_event.wait()
+                # The codec may have changed after a reconnection
+                batch = [(package, codec, raw, urgent) if codec is self.codec
+                         else (package, self.codec, self.codec.dumps(package), urgent)
+                         for package, codec, raw, urgent in batch]
+                # The server may not support batches anymore after a reconnection
+                if len(batch) > 1 and "batch" in self.server_features:
+                    sending = batch
+                    raw = pack_batch([raw for _, _, raw, _ in batch])
+                else:
+                    sending = batch[:1]
+                    raw = batch[0][2]
+                try:
+                    await self.websocket.send(raw)
+                except websockets.ConnectionClosed:
+                    self.connection_lost()
+                    continue
+                batch = batch[len(sending):]
+                for package, _, sent_raw, _ in sending:
+                    pending = self._pending_requests.get(package.source_conv_id)
+                    if pending is not None:
+                        pending.sent = True
+                    msg_type = self._message_type(package)
+                    self.sent_messages.inc(msg_type)
+                    self.sent_bytes.inc(msg_type, amount=len(sent_raw))
+                    log.debug(f"Sent package: {package}")
+
+    @staticmethod
+    def _message_type(package: Package) -> str:
+        # Responses and service messages have a type instead of a msg_type
+        return package.data.get("msg_type") or package.data.get("type") or "unknown"
+
+    def _service_package(self, msg_type: str, topics: Iterable[str]) -> Package:
+        return Package({"type": msg_type, "topics": sorted(topics)}, source=self.nid, destination="<server>")
+
+    async def subscribe(self, *topics: str) -> None:
+        """Start receiving the broadcasts published to the topics.
+
+        Parameters:
+            topics: The names of the handlers of the broadcasts, or :mod:`fnmatch` patterns matching them."""
+        self.subscriptions.update(topics)
+        await self.send(self._service_package("subscribe", topics))
+        log.debug(f"Subscribed to: {topics}")
+
+    async def unsubscribe(self, *topics: str) -> None:
+        """Stop receiving the broadcasts published to the topics, subscribed with :meth:`.subscribe`."""
+        self.subscriptions.difference_update(topics)
+        await self.send(self._service_package("unsubscribe", topics))
+        log.debug(f"Unsubscribed from: {topics}")
 
-    @requires_identification
-    async def broadcast(self, destination: str, broadcast: Broadcast) -> None:
-        package = Package(broadcast.to_dict(), source=self.nid, destination=destination)
+    async def publish(self, broadcast: Broadcast, *, priority: int = 0) -> None:
+        """Send a :class:`Broadcast` only to the links subscribed to its handler.
+
+        The :class:`Server` must support the ``topics`` feature."""
+        package = Package(broadcast.to_dict(), source=self.nid, destination=f"#{broadcast.handler}", priority=priority)
+        await self.send(package)
+        log.debug(f"Published broadcast: {broadcast}")
+
+    async def broadcast(self, destination: str, broadcast: Broadcast, *, priority: int = 0) -> None:
+        package = Package(broadcast.to_dict(), source=self.nid, destination=destination, priority=priority)
         await self.send(package)
         log.debug(f"Sent broadcast to {destination}: {broadcast}")
 
-    @requires_identification
-    async def request(self, destination: str, request: Request) -> Response:
+    async def request(self,
+                      destination: str,
+                      request: Request,
+                      *,
+                      timeout: Optional[float] = None,
+                      retry: bool = False,
+                      urgent: bool = False,
+                      priority: int = 0) -> Response:
+        """Send a :class:`Request` to a destination, and wait for its :class:`Response`.
+
+        If :attr:`.config.max_pending_requests` requests are already waiting for a response, wait for one of them to
+        complete before sending this one.
+
+        Parameters:
+            destination: The ``nid`` or the ``link_type`` of the destination.
+            request: The request to send.
+            timeout: The maximum number of seconds to wait for the response; if :const:`None`, use
+                     :attr:`.config.request_timeout`.
+            retry: Send the request again if the connection is lost before the response is received; it should only
+                   be used for requests that can be safely handled multiple times.
+            urgent: Send the request immediately, without waiting for the :attr:`.config.batch_window` to end.
+            priority: The :attr:`.Package.priority` of the request and of its response.
+
+        Raises:
+            :exc:`RequestTimeoutError` if the response was not received in time.
+            :exc:`ConnectionClosedError` if the connection was closed before the response was received."""
         if destination.startswith("*"):
             raise ValueError("requests cannot have multiple destinations")
-        package = Package(request.to_dict(), source=self.nid, destination=destination)
-        request = PendingRequest(loop=self._loop)
-        self._pending_requests[package.source_conv_id] = request
-        await self.send(package)
-        log.debug(f"Sent request to {destination}: {request}")
-        await request.event.wait()
-        if request.data["type"] == "ResponseSuccess":
-            response: Response = ResponseSuccess.from_dict(request.data)
-        elif request.data["type"] == "ResponseFailure":
-            response: Response = ResponseFailure.from_dict(request.data)
+        if timeout is None:
+            timeout = self.config.request_timeout
+        if self._pending_slots is not None:
+            await self._pending_slots.acquire()
+        if urgent:
+            # Ask for the response to be urgent too
+            request = Request(request.handler, request.data, stream=request.stream, urgent=True)
+        package = Package(request.to_dict(), source=self.nid, destination=destination, priority=priority)
+        pending = PendingRequest(loop=self._loop, package=package, retry=retry)
+        self._pending_requests[package.source_conv_id] = pending
+        self.requests.inc(destination, request.handler)
+        start = time.perf_counter()
+        try:
+            try:
+                await aio.wait_for(self._round_trip(package, pending, urgent), timeout=timeout)
+            except aio.TimeoutError:
+                self.request_errors.inc(destination, request.handler, "timeout")
+                raise RequestTimeoutError(f"{destination} did not respond to {request} in {timeout} seconds.")
+        finally:
+            # Whatever happens, the request is not pending anymore
+            del self._pending_requests[package.source_conv_id]
+            if self._pending_slots is not None:
+                self._pending_slots.release()
+        if pending.error is not None:
+            self.request_errors.inc(destination, request.handler, pending.error.__class__.__name__)
+            raise pending.error
+        self.request_duration.observe(destination, request.handler, value=time.perf_counter() - start)
+        if pending.data["type"] == "ResponseSuccess":
+            response: Response = ResponseSuccess.from_dict(pending.data)
+        elif pending.data["type"] == "ResponseFailure":
+            response: Response = ResponseFailure.from_dict(pending.data)
+            self.request_errors.inc(destination, request.handler, response.name)
         else:
             raise TypeError("Unknown response type")
-        log.debug(f"Received from {destination}: {request} -> {response}")
+        log.debug(f"Received from {destination}: {pending} -> {response}")
         return response
 
+    async def server_metrics(self, *, timeout: Optional[float] = None) -> str:
+        """Get the traffic metrics of the :class:`Server`, in the Prometheus text format.
+
+        The :class:`Server` must support the ``metrics`` feature."""
+        if "metrics" not in self.server_features:
+            raise LinkError("The Herald Server does not export its metrics.")
+        response = await self.request("<server>", Request(handler="metrics", data={}), timeout=timeout)
+        if isinstance(response, ResponseFailure):
+            raise LinkError(f"The Herald Server could not export its metrics: {response.description}")
+        return response.data["text"]
+
+    async def _round_trip(self, package: Package, pending: PendingRequest, urgent: bool) -> None:
+        await self.send(package, urgent=urgent)
+        log.debug(f"Sent request to {package.destination}: {package}")
+        await pending.event.wait()
+
+    async def request_stream(self,
+                             destination: str,
+                             request: Request,
+                             *,
+                             timeout: Optional[float] = None,
+                             window: int = 16,
+                             priority: int = 0) -> AsyncIterator[dict]:
+        """Send a :class:`Request` to a destination, and iterate over the data of the :class:`ResponseChunk` it
+        responds with.
+
+        At most ``window`` chunks are sent by the destination before they are read, so that a slow reader doesn't make
+        the destination buffer the whole response; handlers that respond with a single :class:`ResponseSuccess` work
+        too, and yield their data once.
+
+        Parameters:
+            destination: The ``nid`` or the ``link_type`` of the destination.
+            request: The request to send.
+            timeout: The maximum number of seconds to wait for each chunk; if :const:`None`, use
+                     :attr:`.config.request_timeout`.
+            window: The maximum number of chunks that can be waiting to be read.
+            priority: The :attr:`.Package.priority` of the request and of its chunks.
+
+        Raises:
+            :exc:`RequestTimeoutError` if a chunk was not received in time.
+            :exc:`ConnectionClosedError` if the connection was closed before the stream ended.
+            :exc:`StreamFailedError` if the stream ended with a :class:`ResponseFailure`."""
+        if destination.startswith("*"):
+            raise ValueError("requests cannot have multiple destinations")
+        if window < 1:
+            raise ValueError("the stream window must contain at least one chunk")
+        if timeout is None:
+            timeout = self.config.request_timeout
+        if self._pending_slots is not None:
+            await self._pending_slots.acquire()
+        # The request belongs to the caller, so the window is set only in the package
+        package = Package({**request.to_dict(), "stream": window}, source=self.nid, destination=destination,
+                          priority=priority)
+        queue: "aio.Queue[Union[Package, Exception]]" = aio.Queue(loop=self._loop)
+        self._pending_streams[package.source_conv_id] = queue
+        source: Optional[str] = None
+        ended = False
+        try:
+            await self.send(package)
+            log.debug(f"Sent streaming request to {destination}: {package}")
+            read = 0
+            while True:
+                try:
+                    chunk = await aio.wait_for(queue.get(), timeout=timeout)
+                except aio.TimeoutError:
+                    raise RequestTimeoutError(f"{destination} did not send a chunk of {request} in {timeout} seconds.")
+                if isinstance(chunk, Exception):
+                    ended = True
+                    raise chunk
+                source = chunk.source
+                if chunk.data["type"] == "ResponseChunk":
+                    yield ResponseChunk.from_dict(chunk.data).data
+                    # Grant credit in bulk, instead of sending a package for every chunk
+                    read += 1
+                    if read >= (window + 1) // 2:
+                        await self.send(self._credit_package(package, source, StreamCredit(credit=read)), urgent=True)
+                        read = 0
+                    continue
+                ended = True
+                if chunk.data["type"] == "ResponseSuccess":
+                    response = ResponseSuccess.from_dict(chunk.data)
+                    if response.data:
+                        yield response.data
+                    return
+                elif chunk.data["type"] == "ResponseFailure":
+                    raise StreamFailedError(ResponseFailure.from_dict(chunk.data))
+                else:
+                    raise TypeError("Unknown response type")
+        finally:
+            del self._pending_streams[package.source_conv_id]
+            if self._pending_slots is not None:
+                self._pending_slots.release()
+            # Tell the destination to stop sending chunks nobody is going to read
+            if not ended and source is not None:
+                await self.send(self._credit_package(package, source, StreamCredit(cancel=True)), urgent=True)
+
+    def _credit_package(self, request: Package, destination: str, credit: StreamCredit) -> Package:
+        # The stream is identified by the conv_id of the request, not of the last chunk
+        return Package(credit.to_dict(), source=self.nid, destination=destination,
+                       destination_conv_id=request.source_conv_id, priority=request.priority)
+
+    async def _send_stream(self, package: Package, response: ResponseStream, credit: int, *,
+                           urgent: bool = False) -> None:
+        """Send a :class:`ResponseChunk` for every chunk of the stream, waiting for the requester to grant credit."""
+        stream = OutgoingStream(loop=self._loop, credit=credit)
+        self._outgoing_streams[package.source_conv_id] = stream
+        final: Optional[Response] = ResponseSuccess()
+        try:
+            async for chunk in response.chunks:
+                if isinstance(chunk, Response):
+                    final = chunk
+                    break
+                if not await stream.wait(self.config.request_timeout):
+                    log.debug(f"Stopping stream {package.source_conv_id}: {stream}")
+                    final = None
+                    break
+                stream.credit -= 1
+                await self.send(package.reply(ResponseChunk(chunk).to_dict()), urgent=urgent)
+        except Exception as e:
+            ru.sentry_exc(e)
+            final = ResponseFailure("exception_in_stream",
+                                    f"An exception was raised while streaming the response to '{package.source}'.",
+                                    extra_info={
+                                        "type": e.__class__.__qualname__,
+                                        "message": str(e)
+                                    })
+        finally:
+            del self._outgoing_streams[package.source_conv_id]
+            if hasattr(response.chunks, "aclose"):
+                await response.chunks.aclose()
+        if final is not None:
+            await self.send(package.reply(final.to_dict()), urgent=urgent)
+        log.debug(f"Streamed response to request {package.source_conv_id}: {final}")
+
+    def _handler_limit(self, handler: str) -> Optional[int]:
+        return self.handler_limits.get(handler, self.config.max_running_per_handler)
+
+    async def _handle(self, package: Package) -> None:
+        """Pass a received :class:`Request` or :class:`Broadcast` to the :attr:`.request_handler`."""
+        # Package is a request
+        if package.data["msg_type"] == "Request":
+            log.debug(f"Handling request {package.source_conv_id}: {package}")
+            request: Request = Request.from_dict(package.data)
+            try:
+                response: Union[Response, ResponseStream] = await self.request_handler(request)
+            except Exception as e:
+                ru.sentry_exc(e)
+                # The requester would wait forever for a response otherwise
+                response = ResponseFailure("exception_in_handler",
+                                           f"An exception was raised while handling '{request.handler}'.",
+                                           extra_info={
+                                               "type": e.__class__.__qualname__,
+                                               "message": str(e)
+                                           })
+            if isinstance(response, ResponseStream):
+                if request.stream is not None:
+                    await self._send_stream(package, response, request.stream, urgent=request.urgent)
+                    return
+                if hasattr(response.chunks, "aclose"):
+                    await response.chunks.aclose()
+                response = ResponseFailure("stream_required",
+                                           f"The response to '{request.handler}' can only be streamed.")
+            if isinstance(response, ResponseFailure):
+                self.handle_errors.inc(request.handler, response.name)
+            response_package: Package = package.reply(response.to_dict())
+            # Replies inherit the priority of the request through the package, and its urgency through the request
+            await self.send(response_package, urgent=request.urgent)
+            log.debug(f"Replied to request {response_package.source_conv_id}: {response_package}")
+        # Package is a broadcast
+        elif package.data["msg_type"] == "Broadcast":
+            log.debug(f"Handling broadcast {package.source_conv_id}: {package}")
+            await self.request_handler(Broadcast.from_dict(package.data))
+
+    async def _handler_dispatcher(self) -> None:
+        """Move the received packages to the :attr:`._handler_jobs` as soon as there is a slot for them."""
+        while True:
+            package: Package = await self._handler_incoming.get()
+            await self._handler_slots.acquire()
+            self._handler_jobs.put_nowait((package.priority, package))
+
+    async def _handler_worker(self) -> None:
+        """Handle the queued packages, skipping the ones whose handler is already running too many times."""
+        while True:
+            package: Optional[Package] = await self._handler_jobs.get()
+            handler: Optional[str] = package.data.get("handler")
+            while package is not None:
+                limit = self._handler_limit(handler)
+                if limit is not None and self._handler_running[handler] >= limit:
+                    # Let the worker that is running the same handler pick this package up when it is done
+                    self._handler_deferred[handler].append(package)
+                    break
+                self._handler_running[handler] += 1
+                start = time.perf_counter()
+                try:
+                    await self._handle(package)
+                except Exception as e:
+                    self.handle_errors.inc(handler, e.__class__.__name__)
+                    ru.sentry_exc(e)
+                finally:
+                    self.handle_duration.observe(handler, value=time.perf_counter() - start)
+                    self._handler_running[handler] -= 1
+                    self._handler_slots.release()
+                    self._handler_done.pop(id(package)).set_result(None)
+                deferred = self._handler_deferred.get(handler)
+                package = deferred.popleft() if deferred else None
+
+    async def _ack_replay(self, handling: List[aio.Future], websocket) -> None:
+        """Tell the :class:`Server` that the packages it replayed were handled, once the handlers of all the packages
+        received before the end of the replay are done."""
+        await aio.gather(*handling)
+        # The server replays the packages again after a reconnection, and expects to be told about those instead
+        if self.websocket is not websocket:
+            return
+        await self.send(Package({"type": "ack"}, source=self.nid, destination="<server>"))
+
     async def run(self):
-        """Blockingly run the Link."""
+        """Blockingly run the Link, reconnecting to the :class:`Server` every time the connection is lost."""
         log.debug(f"Running link: {self.config.name}")
-        if self.error_event.is_set():
-            raise ConnectionClosedError("RoyalnetLinks can't be rerun after an error.")
+        if not self._handler_workers:
+            self._handler_workers = [self._loop.create_task(self._handler_worker())
+                                     for _ in range(self.config.max_running_handlers)]
+            self._handler_workers.append(self._loop.create_task(self._handler_dispatcher()))
+        if self._writer_task is None:
+            self._writer_task = self._loop.create_task(self._writer())
+        try:
+            await self._receive_loop()
+        finally:
+            # Stopping the Link stops the tasks it started too
+            for task in [*self._handler_workers, self._writer_task]:
+                task.cancel()
+            self._handler_workers = []
+            self._writer_task = None
+
+    async def _receive_loop(self):
+        attempt = 0
         while True:
-            if not self.connect_event.is_set():
-                await self.connect()
-            if not self.identify_event.is_set():
-                await self.identify()
-            package: Package = await self.receive()
-            # Package is a response
+            try:
+                # Packages received before the connection was lost can still be handled
+                if not self._received:
+                    if not self.connect_event.is_set():
+                        await self.connect()
+                    if not self.identify_event.is_set():
+                        await self.identify()
+                        attempt = 0
+                package: Package = await self.receive()
+            except (OSError, websockets.WebSocketException, LinkError) as e:
+                # A single misaddressed package is not a reason to drop the connection
+                if isinstance(e, InvalidServerResponseError) and self.identify_event.is_set():
+                    log.warning(f"Ignoring invalid package: {e}")
+                    continue
+                self.connection_lost()
+                delay = self.config.reconnect_delay(attempt)
+                attempt += 1
+                log.warning(f"Herald connection failed ({e.__class__.__qualname__}), retrying in {delay:.1f}s...")
+                await aio.sleep(delay)
+                continue
+            # Package is a response, deliver it immediately
             if package.destination_conv_id in self._pending_requests:
                 request = self._pending_requests[package.destination_conv_id]
                 request.set(package.data)
-                continue
-            # Package is a request
-            elif package.data["msg_type"] == "Request":
-                log.debug(f"Received request {package.source_conv_id}: {package}")
-                response: Response = await self.request_handler(Request.from_dict(package.data))
-                response_package: Package = package.reply(response.to_dict())
-                await self.send(response_package)
-                log.debug(f"Replied to request {response_package.source_conv_id}: {response_package}")
-            # Package is a broadcast
-            elif package.data["msg_type"] == "Broadcast":
-                log.debug(f"Received broadcast {package.source_conv_id}: {package}")
-                await self.request_handler(Broadcast.from_dict(package.data))
+            # Package is a part of a streaming response
+            elif package.destination_conv_id in self._pending_streams:
+                self._pending_streams[package.destination_conv_id].put_nowait(package)
+            # Package controls a stream sent by this link, which is waiting for it and can't be queued
+            elif package.data.get("msg_type") == "StreamCredit":
+                stream = self._outgoing_streams.get(package.destination_conv_id)
+                if stream is not None:
+                    stream.grant(StreamCredit.from_dict(package.data))
+            # Package is a broadcast that was already received, sent again from the outbox of the server
+            elif package.data.get("msg_type") == "Broadcast" and package.source_conv_id in self._delivered:
+                log.debug(f"Dropping duplicate broadcast {package.source_conv_id}: {package}")
+            # Package is a request or a broadcast, queue it for the handler workers
+            elif package.data.get("msg_type") in ("Request", "Broadcast"):
+                if package.data["msg_type"] == "Broadcast":
+                    self._delivered[package.source_conv_id] = True
+                self._handler_done[id(package)] = self._loop.create_future()
+                # Only the dispatch waits for a free slot, so that the responses are still received
+                self._handler_incoming.put_nowait((package.priority, package))
+            # Package is the last one sent from the outbox of the server, which can forget them once they are handled
+            elif package.source == "<server>" and package.data.get("type") == "replayed":
+                log.debug(f"Received {package.data.get('count')} stored packages")
+                self._loop.create_task(self._ack_replay(list(self._handler_done.values()), self.websocket))
+            # Package is a response to a request that timed out or was cancelled
+            else:
+                log.debug(f"Dropping unexpected package {package.source_conv_id}: {package}")
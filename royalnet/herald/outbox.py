@@ -0,0 +1,94 @@
+import logging
+import os
+import struct
+import urllib.parse
+from typing import *
+
+log = logging.getLogger(__name__)
+
+_RECORD_LENGTH = struct.Struct("!I")
+
+
+class DurableOutbox:
+    """The encoded packages addressed to a ``link_type`` while none of its links was connected, kept in an append-only
+    file so that they survive the restarts of the :class:`Server` too.
+
+    The file is kept even when it's empty, so that the ``link_type`` is still known after a restart."""
+
+    extension = ".outbox"
+
+    def __init__(self, directory: str, link_type: str, max_bytes: int):
+        self.link_type: str = link_type
+        self.path: str = os.path.join(directory, urllib.parse.quote(link_type, safe="") + self.extension)
+        self.max_bytes: int = max_bytes
+        """The maximum size of the file; packages that would make it larger are dropped."""
+        try:
+            self.size: int = os.path.getsize(self.path)
+        except FileNotFoundError:
+            self.size: int = 0
+        if self.size != sum(_RECORD_LENGTH.size + len(raw) for raw in self.read()):
+            # Packages appended after a truncated one couldn't be read anymore
+            self.discard(0)
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.link_type}: {self.size}/{self.max_bytes} bytes>"
+
+    @classmethod
+    def load_all(cls, directory: str, max_bytes: int) -> Dict[str, "DurableOutbox"]:
+        """Open all the outboxes stored in a directory, creating it if it doesn't exist."""
+        os.makedirs(directory, exist_ok=True)
+        outboxes = {}
+        for filename in os.listdir(directory):
+            if filename.endswith(cls.extension):
+                link_type = urllib.parse.unquote(filename[:-len(cls.extension)])
+                outboxes[link_type] = cls(directory, link_type, max_bytes)
+        return outboxes
+
+    def create(self) -> None:
+        """Create the file of the outbox, if it doesn't exist yet."""
+        with open(self.path, "ab"):
+            pass
+
+    def append(self, raw: bytes) -> bool:
+        """Store an encoded package at the end of the outbox.
+
+        Returns:
+            :data:`False` if the package was dropped because the outbox is full."""
+        record = _RECORD_LENGTH.pack(len(raw)) + raw
+        if self.size + len(record) > self.max_bytes:
+            return False
+        with open(self.path, "ab") as file:
+            file.write(record)
+        self.size += len(record)
+        return True
+
+    def read(self) -> List[bytes]:
+        """Get all the stored packages, from the oldest to the newest."""
+        try:
+            with open(self.path, "rb") as file:
+                content = file.read()
+        except FileNotFoundError:
+            return []
+        records = []
+        offset = 0
+        while offset + _RECORD_LENGTH.size <= len(content):
+            (length,) = _RECORD_LENGTH.unpack_from(content, offset)
+            offset += _RECORD_LENGTH.size
+            if offset + length > len(content):
+                break
+            records.append(content[offset:offset + length])
+            offset += length
+        if offset != len(content):
+            # The server stopped while writing the last package
+            log.warning(f"Ignoring truncated package at the end of {self.path}")
+        return records
+
+    def discard(self, count: int) -> None:
+        """Remove the oldest ``count`` packages, after they were delivered."""
+        remaining = self.read()[count:]
+        temporary = f"{self.path}.tmp"
+        with open(temporary, "wb") as file:
+            for raw in remaining:
+                file.write(_RECORD_LENGTH.pack(len(raw)) + raw)
+        os.replace(temporary, self.path)
+        self.size = os.path.getsize(self.path)
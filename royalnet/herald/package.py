@@ -1,7 +1,14 @@
 import json
+import struct
 import uuid
+import zlib
 from typing import *
 
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
 
 class Package:
     """A data type with which a :py:class:`Link` communicates with a :py:class:`Server` or
@@ -15,7 +22,8 @@ class Package:
                  source: str,
                  destination: str,
                  source_conv_id: Optional[str] = None,
-                 destination_conv_id: Optional[str] = None):
+                 destination_conv_id: Optional[str] = None,
+                 priority: int = 0):
         """Create a Package.
 
         Parameters:
@@ -25,12 +33,15 @@ class Package:
                          Can also be the ``NULL`` value to send the message to nobody.
             source_conv_id: The conversation id of the node that created this package.
                             Akin to the sequence number on IP packets.
-            destination_conv_id: The conversation id of the node that this Package is a reply to."""
+            destination_conv_id: The conversation id of the node that this Package is a reply to.
+            priority: From 0 to 255; packages with a positive priority are sent and handled before the others, such
+                      as the ones a user is waiting for."""
         self.data: dict = data
         self.source: str = source
         self.source_conv_id: str = source_conv_id or str(uuid.uuid4())
         self.destination: str = destination
         self.destination_conv_id: Optional[str] = destination_conv_id
+        self.priority: int = _check_priority(priority)
 
     def __repr__(self):
         return f"<{self.__class__.__qualname__} {self.source} » {self.destination}>"
@@ -41,11 +52,12 @@ class Package:
                    (self.source == other.source) and \
                    (self.destination == other.destination) and \
                    (self.source_conv_id == other.source_conv_id) and \
-                   (self.destination_conv_id == other.destination_conv_id)
+                   (self.destination_conv_id == other.destination_conv_id) and \
+                   (self.priority == other.priority)
         return False
 
     def reply(self, data) -> "Package":
-        """Reply to this :class:`Package` with another :class:`Package`.
+        """Reply to this :class:`Package` with another :class:`Package` with the same priority.
 
         Parameters:
             data: The data that should be sent. Usually a :class:`Request`.
@@ -56,7 +68,8 @@ class Package:
                        source=self.destination,
                        destination=self.source,
                        source_conv_id=self.destination_conv_id or str(uuid.uuid4()),
-                       destination_conv_id=self.source_conv_id)
+                       destination_conv_id=self.source_conv_id,
+                       priority=self.priority)
 
     @staticmethod
     def from_dict(d) -> "Package":
@@ -79,11 +92,12 @@ class Package:
                        source=d["source"]["nid"],
                        destination=d["destination"]["nid"],
                        source_conv_id=d["source"]["conv_id"],
-                       destination_conv_id=d["destination"]["conv_id"])
+                       destination_conv_id=d["destination"]["conv_id"],
+                       priority=d.get("priority", 0))
 
     def to_dict(self) -> dict:
         """Convert the :class:`Package` into a dictionary."""
-        return {
+        d = {
             "source": {
                 "nid": self.source,
                 "conv_id": self.source_conv_id
@@ -94,6 +108,10 @@ class Package:
             },
             "data": self.data
         }
+        # Links that don't know about priorities don't expect the key
+        if self.priority:
+            d["priority"] = self.priority
+        return d
 
     @staticmethod
     def from_json_string(string: str) -> "Package":
@@ -112,3 +130,380 @@ class Package:
     def to_json_bytes(self) -> bytes:
         """Convert the :class:`Package` into UTF-8-encoded JSON bytes."""
         return bytes(self.to_json_string(), encoding="utf8")
+
+
+def _check_priority(priority: int) -> int:
+    if not 0 <= priority <= 255:
+        raise ValueError("Package priorities must be between 0 and 255")
+    return priority
+
+
+class Envelope:
+    """The routing information of a :class:`Package`, with its data kept encoded for as long as possible.
+
+    It allows a :class:`Server` to forward a package without ever decoding its data, if the sender and the receiver
+    use the same :class:`Codec`."""
+
+    def __init__(self,
+                 *,
+                 source: str,
+                 destination: str,
+                 source_conv_id: Optional[str],
+                 destination_conv_id: Optional[str],
+                 data: Optional[dict] = None,
+                 codec: Optional["Codec"] = None,
+                 encoded_data: Optional[bytes] = None,
+                 priority: int = 0):
+        """Create an Envelope.
+
+        Parameters:
+            source: The ``nid`` of the node that created the package.
+            destination: The destination of the package.
+            source_conv_id: The conversation id of the node that created the package.
+            destination_conv_id: The conversation id of the node that the package is a reply to.
+            data: The decoded data of the package; required if ``encoded_data`` is not specified.
+            codec: The :class:`Codec` that encoded ``encoded_data``.
+            encoded_data: The data of the package, as encoded by ``codec``.
+            priority: The priority of the package."""
+        if data is None and encoded_data is None:
+            raise ValueError("Either data or encoded_data must be specified")
+        self.source: str = source
+        self.destination: str = destination
+        self.source_conv_id: Optional[str] = source_conv_id
+        self.destination_conv_id: Optional[str] = destination_conv_id
+        self.priority: int = priority
+        self._data: Optional[dict] = data
+        self._codec: Optional["Codec"] = codec
+        self._encoded_data: Dict[str, bytes] = {}
+        if encoded_data is not None:
+            self._encoded_data[codec.name] = encoded_data
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.source} » {self.destination}>"
+
+    @property
+    def data(self) -> dict:
+        """The data of the package, decoded only when it is accessed for the first time."""
+        if self._data is None:
+            self._data = self._codec.loads_data(self._encoded_data[self._codec.name])
+        return self._data
+
+    @property
+    def codec(self) -> Optional["Codec"]:
+        """The :class:`Codec` the data was received encoded with, or :const:`None` if it was created decoded."""
+        return self._codec
+
+    @property
+    def is_broadcast(self) -> bool:
+        """Check if the package contains a :class:`Broadcast`, without decoding the data if the codec allows it."""
+        if self._data is not None:
+            return self._data.get("msg_type") == "Broadcast"
+        return self._codec.is_broadcast(self._encoded_data[self._codec.name])
+
+    def encoded_data(self, codec: "Codec") -> bytes:
+        """Get the data of the package encoded with a specific :class:`Codec`, encoding it only if it wasn't already."""
+        encoded = self._encoded_data.get(codec.name)
+        if encoded is None:
+            encoded = self._encoded_data[codec.name] = codec.dumps_data(self.data)
+        return encoded
+
+    def to_package(self) -> Package:
+        """Decode the data and create a :class:`Package`."""
+        return Package(self.data,
+                       source=self.source,
+                       destination=self.destination,
+                       source_conv_id=self.source_conv_id,
+                       destination_conv_id=self.destination_conv_id,
+                       priority=self.priority)
+
+    @classmethod
+    def from_package(cls, package: Package) -> "Envelope":
+        """Create an Envelope from an already decoded :class:`Package`."""
+        return cls(data=package.data,
+                   source=package.source,
+                   destination=package.destination,
+                   source_conv_id=package.source_conv_id,
+                   destination_conv_id=package.destination_conv_id,
+                   priority=package.priority)
+
+
+class Codec:
+    """A way to convert a :class:`Package` into bytes and back.
+
+    The :attr:`.Package.data` is encoded separately from the rest of the package, so that it can be encoded once and
+    then sent to multiple destinations."""
+
+    name: str = NotImplemented
+    """The name of the codec, used to agree on a codec during the identification of a :class:`Link`."""
+
+    def dumps_data(self, data: dict) -> bytes:
+        """Encode only the data of a :class:`Package`."""
+        raise NotImplementedError()
+
+    def loads_data(self, b: bytes) -> dict:
+        """Decode the data of a :class:`Package` encoded with :meth:`.dumps_data`."""
+        raise NotImplementedError()
+
+    def is_broadcast(self, b: bytes) -> bool:
+        """Check if data encoded with :meth:`.dumps_data` is a :class:`Broadcast`; by default, it is decoded."""
+        return self.loads_data(b).get("msg_type") == "Broadcast"
+
+    def pack(self,
+             *,
+             source: str,
+             destination: str,
+             source_conv_id: Optional[str],
+             destination_conv_id: Optional[str],
+             data: bytes,
+             priority: int = 0) -> bytes:
+        """Encode a package from its routing information and its data, already encoded with :meth:`.dumps_data`."""
+        raise NotImplementedError()
+
+    def unpack(self, b: bytes) -> Envelope:
+        """Decode the routing information of a package encoded with :meth:`.pack`, decoding its data only if the codec
+        is unable to find its boundaries otherwise."""
+        raise NotImplementedError()
+
+    def dumps(self,
+              package: Union[Package, Envelope],
+              *,
+              destination: Optional[str] = None,
+              data: Optional[bytes] = None) -> bytes:
+        """Encode a :class:`Package` or an :class:`Envelope`.
+
+        Parameters:
+            package: The package to encode.
+            destination: If specified, use it instead of the destination of the package.
+            data: If specified, use it instead of encoding the data of the package; it must have been created by
+                  :meth:`.dumps_data` of the same codec."""
+        if data is None:
+            if isinstance(package, Envelope):
+                data = package.encoded_data(self)
+            else:
+                data = self.dumps_data(package.data)
+        return self.pack(source=package.source,
+                         destination=destination if destination is not None else package.destination,
+                         source_conv_id=package.source_conv_id,
+                         destination_conv_id=package.destination_conv_id,
+                         data=data,
+                         priority=package.priority)
+
+    def loads(self, b: bytes) -> Package:
+        """Decode a :class:`Package` encoded with :meth:`.dumps`."""
+        return self.unpack(b).to_package()
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__}>"
+
+
+class JSONCodec(Codec):
+    """The default :class:`Codec`, encoding packages as UTF-8 JSON objects.
+
+    It is understood by all links, including the ones that don't support any other codec."""
+
+    name = "json"
+
+    def dumps_data(self, data: dict) -> bytes:
+        return bytes(json.dumps(data), encoding="utf8")
+
+    def loads_data(self, b: bytes) -> dict:
+        return json.loads(str(b, encoding="utf8"))
+
+    def pack(self,
+             *,
+             source: str,
+             destination: str,
+             source_conv_id: Optional[str],
+             destination_conv_id: Optional[str],
+             data: bytes,
+             priority: int = 0) -> bytes:
+        routing = {
+            "source": {
+                "nid": source,
+                "conv_id": source_conv_id
+            },
+            "destination": {
+                "nid": destination,
+                "conv_id": destination_conv_id
+            },
+        }
+        if priority:
+            routing["priority"] = priority
+        envelope = json.dumps(routing)
+        return b"".join((bytes(envelope[:-1], encoding="utf8"), b', "data": ', data, b"}"))
+
+    def unpack(self, b: bytes) -> Envelope:
+        # The data is inside the JSON object, so the whole package has to be decoded
+        return Envelope.from_package(Package.from_json_bytes(b))
+
+
+_FRAME_HEADER = struct.Struct("!BB")
+_DATA_HEADER = struct.Struct("!B")
+_DATA_ZLIB = 0b00000001
+_DATA_BROADCAST = 0b00000010
+_ID_NONE = 0
+_ID_UUID = 1
+_ID_STR = 2
+_ID_STR_LENGTH = struct.Struct("!H")
+
+
+def _pack_id(value: Optional[str]) -> bytes:
+    """Pack a nid, a conv_id or a destination, using 16 bytes for the ones that are UUIDs."""
+    if value is None:
+        return bytes((_ID_NONE,))
+    if len(value) == 36:
+        try:
+            as_uuid = uuid.UUID(value)
+        except ValueError:
+            pass
+        else:
+            # Only use the raw form if it can be converted back to the very same string
+            if str(as_uuid) == value:
+                return bytes((_ID_UUID,)) + as_uuid.bytes
+    encoded = bytes(value, encoding="utf8")
+    return bytes((_ID_STR,)) + _ID_STR_LENGTH.pack(len(encoded)) + encoded
+
+
+def _unpack_id(b: bytes, offset: int) -> Tuple[Optional[str], int]:
+    """Unpack a value packed with :func:`_pack_id`, returning it and the offset of the first byte after it."""
+    kind = b[offset]
+    offset += 1
+    if kind == _ID_NONE:
+        return None, offset
+    if kind == _ID_UUID:
+        return str(uuid.UUID(bytes=bytes(b[offset:offset + 16]))), offset + 16
+    if kind == _ID_STR:
+        (length,) = _ID_STR_LENGTH.unpack_from(b, offset)
+        offset += _ID_STR_LENGTH.size
+        return str(b[offset:offset + length], encoding="utf8"), offset + length
+    raise ValueError(f"Unknown id kind: {kind}")
+
+
+class MsgpackCodec(Codec):
+    """A compact binary :class:`Codec`.
+
+    Packages are encoded as a small binary header, containing the priority, and the nids and the conv_ids as 16 raw
+    bytes, followed by the data encoded with :mod:`msgpack`.
+
+    The encoded data starts with a byte of flags, telling if the rest of it was compressed with :mod:`zlib`, and if
+    it is a :class:`Broadcast`.
+
+    As the header is separate from the data, :meth:`.unpack` never decodes the data, allowing a :class:`Server` to
+    forward the data bytes untouched, even if they are compressed.
+
+    It requires the ``msgpack`` package to be installed."""
+
+    name = "msgpack"
+    version = 2
+    """The version of the binary header, stored in its first byte."""
+
+    def __init__(self, compression_threshold: Optional[int] = None):
+        """Create a MsgpackCodec.
+
+        Parameters:
+            compression_threshold: The minimum size in bytes the encoded data must have to be compressed; if
+                                   :const:`None`, never compress the data."""
+        if msgpack is None:
+            raise ImportError("'msgpack' is not installed")
+        self.compression_threshold: Optional[int] = compression_threshold
+
+    def dumps_data(self, data: dict) -> bytes:
+        packed = msgpack.packb(data, use_bin_type=True)
+        flags = _DATA_BROADCAST if data.get("msg_type") == "Broadcast" else 0
+        if self.compression_threshold is not None and len(packed) >= self.compression_threshold:
+            # The fastest level is used, as most of the data is repetitive JSON-like structures anyways
+            return _DATA_HEADER.pack(flags | _DATA_ZLIB) + zlib.compress(packed, 1)
+        return _DATA_HEADER.pack(flags) + packed
+
+    def loads_data(self, b: bytes) -> dict:
+        (flags,) = _DATA_HEADER.unpack_from(b, 0)
+        packed = b[_DATA_HEADER.size:]
+        if flags & _DATA_ZLIB:
+            packed = zlib.decompress(packed)
+        return msgpack.unpackb(packed, raw=False, strict_map_key=False)
+
+    def is_broadcast(self, b: bytes) -> bool:
+        (flags,) = _DATA_HEADER.unpack_from(b, 0)
+        return bool(flags & _DATA_BROADCAST)
+
+    def pack(self,
+             *,
+             source: str,
+             destination: str,
+             source_conv_id: Optional[str],
+             destination_conv_id: Optional[str],
+             data: bytes,
+             priority: int = 0) -> bytes:
+        return b"".join((
+            _FRAME_HEADER.pack(self.version, priority),
+            _pack_id(source),
+            _pack_id(source_conv_id),
+            _pack_id(destination),
+            _pack_id(destination_conv_id),
+            data,
+        ))
+
+    def unpack(self, b: bytes) -> Envelope:
+        version, priority = _FRAME_HEADER.unpack_from(b, 0)
+        if version != self.version:
+            raise ValueError(f"Unsupported header version: {version}")
+        offset = _FRAME_HEADER.size
+        source, offset = _unpack_id(b, offset)
+        source_conv_id, offset = _unpack_id(b, offset)
+        destination, offset = _unpack_id(b, offset)
+        destination_conv_id, offset = _unpack_id(b, offset)
+        return Envelope(source=source,
+                        destination=destination,
+                        source_conv_id=source_conv_id,
+                        destination_conv_id=destination_conv_id,
+                        codec=self,
+                        encoded_data=memoryview(b)[offset:],
+                        priority=priority)
+
+
+def available_codecs(compression_threshold: Optional[int] = None) -> Dict[str, Codec]:
+    """Get all the :class:`Codec` that can be used in this environment, from the most to the least preferred.
+
+    Parameters:
+        compression_threshold: The minimum size in bytes of the data that the codecs supporting compression should
+                               compress."""
+    codecs = {}
+    if msgpack is not None:
+        codecs[MsgpackCodec.name] = MsgpackCodec(compression_threshold=compression_threshold)
+    codecs[JSONCodec.name] = JSONCodec()
+    return codecs
+
+
+_BATCH_MARKER = b"\x00"
+_BATCH_LENGTH = struct.Struct("!I")
+
+
+def pack_batch(frames: Sequence[bytes]) -> bytes:
+    """Join multiple encoded packages in a single frame, so that they can be sent with a single websocket message.
+
+    Batches start with a null byte, which never appears at the start of a package encoded by a :class:`Codec`.
+
+    Parameters:
+        frames: The encoded packages to join."""
+    parts = [_BATCH_MARKER]
+    for frame in frames:
+        parts.append(_BATCH_LENGTH.pack(len(frame)))
+        parts.append(frame)
+    return b"".join(parts)
+
+
+def unpack_batch(b: bytes) -> List[bytes]:
+    """Split a frame created with :func:`pack_batch` in the encoded packages it contains.
+
+    Frames that aren't batches contain a single package, and are returned as they are."""
+    if not b or b[0] != _BATCH_MARKER[0]:
+        return [b]
+    view = memoryview(b)
+    frames = []
+    offset = len(_BATCH_MARKER)
+    while offset < len(view):
+        (length,) = _BATCH_LENGTH.unpack_from(view, offset)
+        offset += _BATCH_LENGTH.size
+        frames.append(view[offset:offset + length])
+        offset += length
+    return frames
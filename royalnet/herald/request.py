@@ -6,16 +6,28 @@ class Request:
 
      It contains the name of the requested handler, in addition to the data."""
 
-    def __init__(self, handler: str, data: dict, msg_type: Optional[str] = None):
+    def __init__(self,
+                 handler: str,
+                 data: dict,
+                 msg_type: Optional[str] = None,
+                 stream: Optional[int] = None,
+                 urgent: bool = False):
         super().__init__()
         if msg_type is not None:
             assert msg_type == self.__class__.__name__
         self.msg_type = self.__class__.__name__
         self.handler: str = handler
         self.data: dict = data
+        self.stream: Optional[int] = stream
+        """If set, the response can be sent in multiple :class:`ResponseChunk`, and this is the number of chunks that
+        can be sent before waiting for a :class:`StreamCredit`."""
+        self.urgent: bool = urgent
+        """If set, the response is sent without waiting for the batch window to end, like the request was."""
 
     def to_dict(self):
-        return self.__dict__
+        # Links that don't support streaming or urgent requests don't know about their keys
+        return {key: value for key, value in self.__dict__.items()
+                if not (key == "stream" and self.stream is None or key == "urgent" and not self.urgent)}
 
     @classmethod
     def from_dict(cls, d: dict):
@@ -52,3 +52,30 @@ class ResponseFailure(Response):
                f"description={self.description}, " \
                f"extra_info={self.extra_info}" \
                f")"
+
+
+class ResponseChunk(Response):
+    """A part of the response to a streaming :py:class:`Request`.
+
+    The stream of chunks always ends with a :py:class:`ResponseSuccess` or a :py:class:`ResponseFailure`."""
+
+    def __init__(self, data: dict):
+        self.data: dict = data
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}(data={self.data})"
+
+
+class ResponseStream:
+    """Returned by a request handler instead of a :py:class:`Response` to send the response in multiple
+    :py:class:`ResponseChunk`, as they are produced.
+
+    It is never sent as it is: the :py:class:`Link` sends a :py:class:`ResponseChunk` for every :class:`dict` yielded
+    by the iterator, waiting for the requester to be ready to receive more of them.
+    The iterator can also yield a :py:class:`Response` to end the stream with it."""
+
+    def __init__(self, chunks: AsyncIterator[Union[dict, Response]]):
+        self.chunks: AsyncIterator[Union[dict, Response]] = chunks
+
+    def __repr__(self):
+        return f"{self.__class__.__qualname__}()"
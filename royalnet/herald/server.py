@@ -1,6 +1,10 @@
 import asyncio as aio
+import collections
 import datetime
+import fnmatch
+import http
 import logging
+import os
 import re
 import uuid
 from typing import *
@@ -9,19 +13,43 @@ import websockets
 
 import royalnet.utils as ru
 from .config import Config
-from .package import Package
+from .outbox import DurableOutbox
+from .unix import UnixConnection
+from .package import Package, Envelope, Codec, JSONCodec, MsgpackCodec, available_codecs, pack_batch, unpack_batch
+from .response import Response, ResponseSuccess, ResponseFailure
 
 log = logging.getLogger(__name__)
 
 
+def is_pattern(topic: str) -> bool:
+    """Check if a topic is a :mod:`fnmatch` pattern, instead of the name of a single topic."""
+    return any(char in topic for char in "*?[")
+
+
 class ConnectedClient:
     """The :py:class:`Server`-side representation of a connected :py:class:`Link`."""
 
-    def __init__(self, socket: "websockets.WebSocketServerProtocol"):
+    def __init__(self, socket: "websockets.WebSocketServerProtocol", *, queue_size: int = 256):
         self.socket: "websockets.WebSocketServerProtocol" = socket
         self.nid: Optional[str] = None
         self.link_type: Optional[str] = None
         self.connection_datetime: datetime.datetime = datetime.datetime.now()
+        self.codec: Codec = JSONCodec()
+        """The :class:`Codec` agreed with the :py:class:`Link` during the identification."""
+        self.outbox: ru.LaneQueue = ru.LaneQueue(maxsize=queue_size)
+        """The encoded packages waiting to be written to the socket by :meth:`.writer`, with the ones with a priority
+        written first."""
+        self.dropped: int = 0
+        """The number of packages that were dropped because the :attr:`.outbox` was full."""
+        self.subscriptions: Set[str] = set()
+        """The topics the :py:class:`Link` is subscribed to."""
+        self.batch_max_bytes: Optional[int] = None
+        """If set, the packages waiting together in the :attr:`.outbox` are joined in batches up to this size."""
+        self.features: Set[str] = set()
+        """The optional protocol features supported by the :py:class:`Link`, such as ``ack``."""
+        self.replayed: int = 0
+        """The number of packages of the :class:`DurableOutbox` sent to the :py:class:`Link` and not acknowledged
+        yet."""
 
     def __repr__(self):
         return f"<{self.__class__.__qualname__} {self.nid}>"
@@ -38,39 +66,421 @@ class ConnectedClient:
 
     async def send(self, package: Package):
         """Send a :py:class:`Package` to the :py:class:`Link`."""
-        await self.socket.send(package.to_json_bytes())
+        await self.socket.send(self.codec.dumps(package))
+
+    def enqueue(self, raw: bytes, priority: int = 0) -> bool:
+        """Queue already encoded bytes to be sent to the :py:class:`Link` by :meth:`.writer`.
+
+        If the :attr:`.outbox` is full, the bytes are dropped instead, so that a slow :py:class:`Link` cannot delay the
+        routing of packages to the others.
+
+        Parameters:
+            raw: The encoded package.
+            priority: The :attr:`.Package.priority` of the package.
+
+        Returns:
+            :data:`True` if the bytes were queued, :data:`False` if they were dropped."""
+        try:
+            self.outbox.put_nowait((priority, raw))
+        except aio.QueueFull:
+            self.dropped += 1
+            log.warning(f"Dropping package for slow client {self}: {self.dropped} dropped so far")
+            return False
+        return True
+
+    async def writer(self):
+        """Write the contents of the :attr:`.outbox` to the socket, until the connection is closed."""
+        while True:
+            frames = [await self.outbox.get()]
+            if self.batch_max_bytes is not None:
+                # Never wait for more packages: a backlog is the only thing worth batching here
+                size = len(frames[0])
+                while size < self.batch_max_bytes and not self.outbox.empty():
+                    frame = self.outbox.get_nowait()
+                    frames.append(frame)
+                    size += len(frame)
+            raw = frames[0] if len(frames) == 1 else pack_batch(frames)
+            try:
+                await self.socket.send(raw)
+            except websockets.ConnectionClosed:
+                return
+
+
+class PeerNode:
+    """Another :py:class:`Server` of the same cluster, and the clients connected to it."""
+
+    def __init__(self, server_id: str):
+        self.server_id: str = server_id
+        self.connections: List[ConnectedClient] = []
+        """The open connections with the server; packages are always sent through the first one."""
+        self.clients: Dict[str, str] = {}
+        """The ``link_type`` of the clients connected to the server, indexed by their ``nid``."""
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.server_id}>"
+
+    @property
+    def codec(self) -> Codec:
+        return self.connections[0].codec
+
+    def enqueue(self, raw: bytes, priority: int = 0) -> bool:
+        """Queue already encoded bytes to be sent to the server, like :meth:`ConnectedClient.enqueue`."""
+        return self.connections[0].enqueue(raw, priority)
 
 
 class Server:
-    def __init__(self, config: Config, *, loop: aio.AbstractEventLoop = None):
+    def __init__(self,
+                 config: Config,
+                 *,
+                 loop: aio.AbstractEventLoop = None,
+                 client_queue_size: int = 256,
+                 peer_queue_size: int = 4096):
         self.config: Config = config
-        self.identified_clients: List[ConnectedClient] = []
+        self.client_queue_size: int = client_queue_size
+        """The maximum number of packages that can be waiting to be sent to a single client."""
+        self.peer_queue_size: int = peer_queue_size
+        """The maximum number of packages that can be waiting to be sent to a single :class:`PeerNode`."""
+        self.server_id: str = str(uuid.uuid4())
+        """The identifier of this server in the cluster."""
+        self.codecs: Dict[str, Codec] = available_codecs(compression_threshold=config.compression_threshold)
+        """The :class:`Codec` that can be agreed with the clients."""
+        self.identified_clients: Dict[str, ConnectedClient] = {}
+        """The identified clients, indexed by their ``nid``."""
+        self.link_types: Dict[str, Set[ConnectedClient]] = {}
+        """The identified clients, grouped by their ``link_type``."""
+        self.peers: Dict[str, PeerNode] = {}
+        """The other servers of the cluster connected to this one, indexed by their ``server_id``."""
+        self.remote_clients: Dict[str, PeerNode] = {}
+        """The servers the clients of the other servers are connected to, indexed by the client ``nid``."""
+        self.remote_link_types: Dict[str, Dict[PeerNode, int]] = {}
+        """The number of clients of each ``link_type`` connected to the other servers."""
+        self.subscribers: Dict[str, Set[ConnectedClient]] = {}
+        """The clients subscribed to each topic."""
+        self.pattern_subscribers: Dict[str, Set[ConnectedClient]] = {}
+        """The clients subscribed to each :mod:`fnmatch` pattern of topics."""
+        self.outboxes: Dict[str, DurableOutbox] = {}
+        """The outboxes of the link types that connected at least once, if :attr:`.config.outbox_path` is set."""
+        self.topic_link_types: Dict[str, Set[str]] = {}
+        """The link types that subscribed to each topic or pattern, whose outboxes store the broadcasts published to
+        it while none of their clients is connected."""
+        self.replaying: Dict[str, ConnectedClient] = {}
+        """The clients that are being sent the outbox of their link type, indexed by link type."""
+        self.metrics: Dict[str, int] = collections.Counter()
+        """The number of clients that ``joined``, ``left`` or were ``evicted``, and of the packages that were
+        ``routed`` or ``dropped`` since the server started."""
+        self.registry: ru.MetricsRegistry = ru.MetricsRegistry("herald_server_")
+        """The traffic metrics of the server, exported by :meth:`.render_metrics`.
+
+        Clients are labelled with their ``link_type``, so that the number of values doesn't grow with reconnections;
+        the handlers are not known, as the server doesn't decode the data of the packages it forwards."""
+        self.received_messages: ru.MetricCounter = self.registry.counter(
+            "received_messages_total", "Packages received from the clients and the other servers.", ["source"])
+        self.received_bytes: ru.MetricCounter = self.registry.counter(
+            "received_bytes_total", "Bytes received from the clients and the other servers.", ["source"])
+        self.routed_messages: ru.MetricCounter = self.registry.counter(
+            "routed_messages_total", "Packages routed to at least a client or another server.",
+            ["source", "destination"])
+        self.sent_messages: ru.MetricCounter = self.registry.counter(
+            "sent_messages_total", "Packages queued to be sent to the clients and the other servers.", ["destination"])
+        self.sent_bytes: ru.MetricCounter = self.registry.counter(
+            "sent_bytes_total", "Bytes queued to be sent to the clients and the other servers.", ["destination"])
+        self.errors: ru.MetricCounter = self.registry.counter(
+            "errors_total",
+            "Packages not delivered, because they were undecodable or their destination was unknown or too slow.",
+            ["source", "destination", "reason"])
+        self.stored_messages: ru.MetricCounter = self.registry.counter(
+            "stored_messages_total", "Broadcasts stored in the outbox of a link type without connected clients.",
+            ["destination"])
+        self.events: ru.MetricCounter = self.registry.counter(
+            "events_total", "Clients that joined, left or were evicted, and packages that were routed or dropped.",
+            ["event"])
+        self.connected: ru.MetricGauge = self.registry.gauge(
+            "connected", "Clients and other servers currently connected.", ["kind"])
         self.loop = loop
 
     def __repr__(self):
         return f"<{self.__class__.__qualname__}>"
 
+    def add_client(self, client: ConnectedClient) -> None:
+        """Add an identified client to the routing indexes, replacing any other client with the same ``nid``."""
+        previous = self.identified_clients.get(client.nid)
+        if previous is not None:
+            log.warning(f"Replacing client with duplicate nid: {previous}")
+            self.remove_client(previous)
+            # The listener of the replaced client stops as soon as its connection is closed
+            if previous.socket is not None:
+                self.loop.create_task(previous.socket.close())
+        self.identified_clients[client.nid] = client
+        self.link_types.setdefault(client.link_type, set()).add(client)
+        if self.config.outbox_path is not None and client.link_type not in self.outboxes:
+            outbox = DurableOutbox(self.config.outbox_path, client.link_type, self.config.outbox_max_bytes)
+            outbox.create()
+            self.outboxes[client.link_type] = outbox
+        self.metrics["joined"] += 1
+        self.announce({"type": "join", "nid": client.nid, "link_type": client.link_type})
+
+    def remove_client(self, client: ConnectedClient) -> None:
+        """Remove a client from the routing indexes, if it is still present."""
+        if self.identified_clients.get(client.nid) is client:
+            del self.identified_clients[client.nid]
+            self.metrics["left"] += 1
+            self.announce({"type": "leave", "nid": client.nid})
+        if self.replaying.get(client.link_type) is client:
+            del self.replaying[client.link_type]
+        same_type = self.link_types.get(client.link_type)
+        if same_type is not None:
+            same_type.discard(client)
+            if not same_type:
+                del self.link_types[client.link_type]
+        self.unsubscribe(client, list(client.subscriptions))
+
+    def subscribe(self, client: ConnectedClient, topics: Iterable[str]) -> None:
+        """Start sending to a client the broadcasts published to the topics."""
+        for topic in topics:
+            client.subscriptions.add(topic)
+            index = self.pattern_subscribers if is_pattern(topic) else self.subscribers
+            index.setdefault(topic, set()).add(client)
+            if self.config.outbox_path is not None:
+                self.topic_link_types.setdefault(topic, set()).add(client.link_type)
+
+    def unsubscribe(self, client: ConnectedClient, topics: Iterable[str]) -> None:
+        """Stop sending to a client the broadcasts published to the topics."""
+        for topic in topics:
+            client.subscriptions.discard(topic)
+            index = self.pattern_subscribers if is_pattern(topic) else self.subscribers
+            clients = index.get(topic)
+            if clients is not None:
+                clients.discard(client)
+                if not clients:
+                    del index[topic]
+
+    def handle_service(self, client: ConnectedClient, data: dict) -> None:
+        """Handle a service message received from a client."""
+        if data.get("type") == "subscribe":
+            self.subscribe(client, data["topics"])
+        elif data.get("type") == "unsubscribe":
+            self.unsubscribe(client, data["topics"])
+            # Disconnections don't count, as the link type will probably subscribe again when it reconnects
+            for topic in data["topics"]:
+                link_types = self.topic_link_types.get(topic)
+                if link_types is None:
+                    continue
+                if not any(topic in other.subscriptions for other in self.link_types.get(client.link_type, [])):
+                    link_types.discard(client.link_type)
+                if not link_types:
+                    del self.topic_link_types[topic]
+        elif data.get("type") == "ack":
+            # Only the packages sent before the acknowledgement can be discarded
+            if self.replaying.get(client.link_type) is client:
+                self.outboxes[client.link_type].discard(client.replayed)
+                log.info(f"{client} acknowledged {client.replayed} stored packages")
+                client.replayed = 0
+                del self.replaying[client.link_type]
+        else:
+            log.warning(f"Unknown service message from {client}: {data}")
+
+    def add_remote_client(self, peer: PeerNode, nid: str, link_type: str) -> None:
+        """Add a client of another server to the routing indexes."""
+        self.remove_remote_client(peer, nid)
+        peer.clients[nid] = link_type
+        self.remote_clients[nid] = peer
+        counts = self.remote_link_types.setdefault(link_type, {})
+        counts[peer] = counts.get(peer, 0) + 1
+
+    def remove_remote_client(self, peer: PeerNode, nid: str) -> None:
+        """Remove a client of another server from the routing indexes, if it is still present."""
+        link_type = peer.clients.pop(nid, None)
+        if link_type is None:
+            return
+        # The client may have moved to another server in the meantime
+        if self.remote_clients.get(nid) is peer:
+            del self.remote_clients[nid]
+        counts = self.remote_link_types[link_type]
+        counts[peer] -= 1
+        if not counts[peer]:
+            del counts[peer]
+            if not counts:
+                del self.remote_link_types[link_type]
+
+    def add_peer_connection(self, connection: ConnectedClient) -> PeerNode:
+        """Add a connection with another server of the cluster, and send it the clients connected to this one."""
+        peer = self.peers.get(connection.nid)
+        if peer is None:
+            peer = PeerNode(connection.nid)
+            self.peers[peer.server_id] = peer
+            log.info(f"Joined the cluster: {peer}")
+        peer.connections.append(connection)
+        self.send_peer_service(connection, {
+            "type": "sync",
+            "clients": {nid: client.link_type for nid, client in self.identified_clients.items()},
+        })
+        return peer
+
+    def remove_peer_connection(self, peer: PeerNode, connection: ConnectedClient) -> None:
+        """Remove a connection with another server of the cluster, forgetting its clients if it was the last one."""
+        if connection in peer.connections:
+            peer.connections.remove(connection)
+        if peer.connections or self.peers.get(peer.server_id) is not peer:
+            return
+        log.info(f"Left the cluster: {peer}")
+        del self.peers[peer.server_id]
+        for nid in list(peer.clients):
+            self.remove_remote_client(peer, nid)
+
+    @staticmethod
+    def send_peer_service(connection: ConnectedClient, data: dict) -> None:
+        connection.enqueue(connection.codec.dumps(Package(data, source="<server>", destination="<server>")))
+
+    def announce(self, data: dict) -> None:
+        """Send a service message to all the other servers of the cluster."""
+        for peer in self.peers.values():
+            self.send_peer_service(peer.connections[0], data)
+
+    def handle_peer_service(self, peer: PeerNode, data: dict) -> None:
+        """Update the routing indexes with a service message received from another server of the cluster."""
+        if data.get("type") == "sync":
+            for nid in list(peer.clients):
+                self.remove_remote_client(peer, nid)
+            for nid, link_type in data["clients"].items():
+                self.add_remote_client(peer, nid, link_type)
+        elif data.get("type") == "join":
+            self.add_remote_client(peer, data["nid"], data["link_type"])
+        elif data.get("type") == "leave":
+            self.remove_remote_client(peer, data["nid"])
+        else:
+            log.warning(f"Unknown service message from {peer}: {data}")
+
+    def label(self, nid: str) -> str:
+        """Get the label of a source or a destination in the :attr:`.registry`: the ``link_type`` of the clients
+        connected to the cluster, or the destination itself for the known link types and topics.
+
+        Anything else is reported as ``unknown``, so that the clients can't create new series at will."""
+        client = self.identified_clients.get(nid)
+        if client is not None:
+            return client.link_type
+        peer = self.remote_clients.get(nid)
+        if peer is not None:
+            return peer.clients[nid]
+        if nid in ("*", "<server>"):
+            return nid
+        if nid.startswith("#"):
+            return nid if self.is_known_topic(nid[1:]) else "unknown"
+        if nid in self.link_types or nid in self.remote_link_types or nid in self.outboxes:
+            return nid
+        return "unknown"
+
+    def is_known_topic(self, topic: str) -> bool:
+        """Check if a topic has subscribers, either directly or through a pattern, or had some when the outboxes are
+        enabled."""
+        if topic in self.subscribers or topic in self.topic_link_types:
+            return True
+        return any(fnmatch.fnmatchcase(topic, pattern) for pattern in self.pattern_subscribers)
+
+    def render_metrics(self) -> str:
+        """Export the :attr:`.registry` and the :meth:`.stats` in the Prometheus text format."""
+        self.connected.set("clients", value=len(self.identified_clients))
+        self.connected.set("peers", value=len(self.peers))
+        for event, count in self.metrics.items():
+            self.events.values[(event,)] = count
+        return self.registry.render()
+
+    async def process_request(self, path: str, request_headers) -> Optional[Tuple[http.HTTPStatus, list, bytes]]:
+        """Answer plain HTTP requests to :attr:`.config.metrics_path` with :meth:`.render_metrics`, instead of
+        opening a websocket."""
+        if self.config.metrics_path is None or path != self.config.metrics_path:
+            return None
+        return (http.HTTPStatus.OK,
+                [("Content-Type", "text/plain; version=0.0.4; charset=utf-8")],
+                self.render_metrics().encode("utf8"))
+
+    def handle_request(self, client: ConnectedClient, package: Envelope) -> None:
+        """Answer a :class:`Request` sent by a client to the server itself."""
+        handler = package.data.get("handler")
+        if handler == "metrics":
+            response: Response = ResponseSuccess({"text": self.render_metrics()})
+        else:
+            response: Response = ResponseFailure("no_such_handler", f"The server has no handler named '{handler}'.")
+        client.enqueue(client.codec.dumps(Package(response.to_dict(),
+                                                  source="<server>",
+                                                  destination=client.nid,
+                                                  destination_conv_id=package.source_conv_id,
+                                                  priority=package.priority)), package.priority)
+
+    def stats(self) -> Dict[str, int]:
+        """Get the current :attr:`.metrics`, together with the number of ``connected`` clients and ``peers``."""
+        return {
+            "connected": len(self.identified_clients),
+            "peers": len(self.peers),
+            **self.metrics,
+        }
+
+    def connections(self) -> List[ConnectedClient]:
+        """Get all the identified connections, including the ones with the other servers of the cluster."""
+        return [
+            *self.identified_clients.values(),
+            *(connection for peer in self.peers.values() for connection in peer.connections),
+        ]
+
+    def evict(self, connection: ConnectedClient) -> None:
+        """Remove a connection that stopped responding from the routing indexes, then close it."""
+        log.warning(f"Evicting unresponsive connection: {connection}")
+        self.metrics["evicted"] += 1
+        peer = self.peers.get(connection.nid)
+        if peer is not None and connection in peer.connections:
+            self.remove_peer_connection(peer, connection)
+        else:
+            self.remove_client(connection)
+        # Closing a half-open connection waits for the close timeout, so don't wait for it
+        self.loop.create_task(connection.socket.close())
+
+    async def check_connection(self, connection: ConnectedClient) -> None:
+        """Ping a connection, evicting it if it doesn't answer in :attr:`.config.heartbeat_timeout` seconds."""
+        try:
+            # Sending the ping may block too, if the socket buffers are full
+            await aio.wait_for(self._ping(connection), timeout=self.config.heartbeat_timeout)
+        except aio.TimeoutError:
+            self.evict(connection)
+        except websockets.ConnectionClosed:
+            # The listener will notice it too, and remove the client
+            pass
+
+    @staticmethod
+    async def _ping(connection: ConnectedClient) -> None:
+        pong_waiter = await connection.socket.ping()
+        await pong_waiter
+
+    async def heartbeat(self) -> None:
+        """Check every :attr:`.config.heartbeat_interval` seconds that all the connections are still alive."""
+        while True:
+            await aio.sleep(self.config.heartbeat_interval)
+            await aio.gather(*[self.check_connection(connection) for connection in self.connections()],
+                             loop=self.loop)
+            log.debug(f"Herald stats: {self.stats()}")
+
     def find_client(self, *, nid: str = None, link_type: str = None) -> List[ConnectedClient]:
         assert not (nid and link_type)
         if nid:
-            matching = [client for client in self.identified_clients if client.nid == nid]
-            assert len(matching) <= 1
-            return matching
+            client = self.identified_clients.get(nid)
+            return [client] if client is not None else []
         if link_type:
-            matching = [client for client in self.identified_clients if client.link_type == link_type]
-            return matching or []
+            return list(self.link_types.get(link_type, []))
+        return []
 
     # noinspection PyUnusedLocal
-    async def listener(self, websocket: "websockets.server.WebSocketServerProtocol", path):
-        connected_client = ConnectedClient(websocket)
+    async def listener(self, websocket: Union["websockets.server.WebSocketServerProtocol", UnixConnection], path):
+        connected_client = ConnectedClient(websocket, queue_size=self.client_queue_size)
         # Wait for identification
-        identify_msg = await websocket.recv()
+        try:
+            identify_msg = await aio.wait_for(websocket.recv(), timeout=self.config.heartbeat_timeout)
+        except aio.TimeoutError:
+            log.warning(f"Herald identification timed out: {websocket.remote_address[0]}:{websocket.remote_address[1]}")
+            return
         log.debug(f"{websocket.remote_address} identified itself with: {identify_msg}.")
         if not isinstance(identify_msg, str):
             log.warning(f"Failed Herald identification: {websocket.remote_address[0]}:{websocket.remote_address[1]}")
             await connected_client.send_service("error", "Invalid identification message (not a str)")
             return
-        identification = re.match(r"Identify ([^:\s]+):([^:\s]+):([^:\s]+)", identify_msg)
+        identification = re.match(r"Identify ([^:\s]+):([^:\s]+):([^:\s]+)(?: (\S+))?(?: (\S+))?", identify_msg)
         if identification is None:
             log.warning(f"Failed Herald identification: {websocket.remote_address[0]}:{websocket.remote_address[1]}")
             await connected_client.send_service("error", "Invalid identification message (regex failed)")
@@ -83,26 +493,186 @@ class Server:
         # Identification successful
         connected_client.nid = identification.group(1)
         connected_client.link_type = identification.group(2)
+        # Links that don't list their codecs only understand JSON
+        codec = self.choose_codec(identification.group(4).split(",") if identification.group(4) else [])
+        features = identification.group(5).split(",") if identification.group(5) else []
+        connected_client.features = set(features)
+        if "peer" in features:
+            await self.peer_listener(connected_client, codec, features)
+            return
         log.info(f"Joined the Herald: {websocket.remote_address[0]}:{websocket.remote_address[1]}"
                  f" ({connected_client.link_type})")
-        self.identified_clients.append(connected_client)
-        await connected_client.send_service("success", "Identification successful!")
-        log.debug(f"{connected_client.nid}'s identification confirmed.")
-        # Main loop
+        writer_task = None
+        replay_task = None
+        try:
+            await self.confirm_identification(connected_client, codec, features)
+            # The packages can be routed to the client only after it starts using the agreed codec
+            self.add_client(connected_client)
+            writer_task = self.loop.create_task(connected_client.writer())
+            # Replaying may wait for the outbox to have space, so it can't block the main loop
+            replay_task = self.loop.create_task(self.replay(connected_client))
+            # Main loop
+            while True:
+                # Receive packages
+                raw_bytes = await websocket.recv()
+                # Only the routing information is decoded: the data is forwarded as it is whenever possible
+                for frame, package in self.decode_frames(connected_client, raw_bytes):
+                    log.debug(f"Received package: {package}")
+                    self.received_messages.inc(connected_client.link_type)
+                    self.received_bytes.inc(connected_client.link_type, amount=len(frame))
+                    # Check if the package destination is the server itself.
+                    if package.destination == "<server>":
+                        if package.data.get("msg_type") == "Request":
+                            self.handle_request(connected_client, package)
+                        else:
+                            self.handle_service(connected_client, package.data)
+                    # Otherwise, route the package to its destination
+                    # Routing only queues the package, so it can be awaited without blocking the other clients
+                    else:
+                        await self.route_package(package)
+        except websockets.ConnectionClosed:
+            log.info(f"Left the Herald: {websocket.remote_address[0]}:{websocket.remote_address[1]}"
+                     f" ({connected_client.link_type})")
+        finally:
+            self.remove_client(connected_client)
+            if writer_task is not None:
+                writer_task.cancel()
+            if replay_task is not None:
+                replay_task.cancel()
+
+    async def confirm_identification(self, connected_client: ConnectedClient, codec: Codec, features: List[str]):
+        """Tell a client its identification was successful, and start using the agreed codec and features."""
+        # The confirmation is the last package encoded with JSON, but the codec is switched before sending it, so that
+        # nothing encoded with JSON can be queued for the client after it
+        confirmation = connected_client.codec.dumps(Package({"type": "success",
+                                                             "service": "Identification successful!",
+                                                             "codec": codec.name,
+                                                             "features": ["batch", "peer", "topics", "metrics"],
+                                                             "server_id": self.server_id},
+                                                            source="<server>",
+                                                            destination=connected_client.nid))
+        connected_client.codec = codec
+        if "batch" in features and self.config.batch_window is not None:
+            connected_client.batch_max_bytes = self.config.batch_max_bytes
+        await connected_client.socket.send(confirmation)
+        log.debug(f"{connected_client.nid}'s identification confirmed, using {codec}.")
+
+    def decode_frames(self, connection: ConnectedClient, raw_bytes: bytes) -> Iterator[Tuple[bytes, Envelope]]:
+        """Split a frame received from a connection in its packages, and decode their routing information, and their
+        data too if they are addressed to the server itself.
+
+        The packages that cannot be decoded are counted and skipped, without closing the connection.
+
+        Yields:
+            The encoded packages, together with their decoded :class:`Envelope`."""
+        try:
+            frames = unpack_batch(raw_bytes)
+        except Exception as e:
+            self.reject_frame(connection, raw_bytes, e)
+            return
+        for frame in frames:
+            try:
+                package: Envelope = connection.codec.unpack(frame)
+                # The packages for the server are handled right away, so their data is decoded here too
+                if package.destination == "<server>":
+                    _ = package.data
+            except Exception as e:
+                self.reject_frame(connection, frame, e)
+                continue
+            yield frame, package
+
+    def reject_frame(self, connection: ConnectedClient, frame: bytes, error: Exception) -> None:
+        """Log and count a frame that could not be decoded."""
+        log.warning(f"Dropping a frame from {connection} that {connection.codec} could not decode ({error!r}):"
+                    f" {bytes(frame[:64])!r}")
+        self.errors.inc(connection.link_type or "<server>", "unknown", "undecodable")
+
+    async def peer_listener(self, connection: ConnectedClient, codec: Codec, features: List[str]):
+        """Handle a connection opened by another server of the cluster."""
+        if connection.nid == self.server_id:
+            await connection.send_service("error", "Servers cannot be peers of themselves")
+            return
+        connection.outbox = ru.LaneQueue(maxsize=self.peer_queue_size)
+        await self.confirm_identification(connection, codec, features)
+        await self.serve_peer(connection)
+
+    async def serve_peer(self, connection: ConnectedClient):
+        """Route the packages received from another server of the cluster, until the connection is closed.
+
+        Packages coming from other servers are only delivered to the clients of this one, so every server must be
+        connected to all the others."""
+        peer = self.add_peer_connection(connection)
+        writer_task = self.loop.create_task(connection.writer())
+        try:
+            while True:
+                raw_bytes = await connection.socket.recv()
+                for frame, package in self.decode_frames(connection, raw_bytes):
+                    log.debug(f"Received package from {peer}: {package}")
+                    self.received_messages.inc("<server>")
+                    self.received_bytes.inc("<server>", amount=len(frame))
+                    if package.destination == "<server>":
+                        self.handle_peer_service(peer, package.data)
+                    else:
+                        await self.route_package(package, forward=False)
+        except websockets.ConnectionClosed:
+            log.info(f"Connection closed with {peer}")
+        finally:
+            self.remove_peer_connection(peer, connection)
+            writer_task.cancel()
+
+    async def dial_peer(self, url: str):
+        """Connect to another server of the cluster, reconnecting every time the connection is lost."""
+        attempt = 0
         while True:
-            # Receive packages
-            raw_bytes = await websocket.recv()
-            package: Package = Package.from_json_bytes(raw_bytes)
-            log.debug(f"Received package: {package}")
-            # Check if the package destination is the server itself.
-            if package.destination == "<server>":
-                # Do... nothing for now?
-                pass
-            # Otherwise, route the package to its destination
-            # noinspection PyAsyncCall
-            self.loop.create_task(self.route_package(package))
-
-    def find_destination(self, package: Package) -> List[ConnectedClient]:
+            try:
+                log.debug(f"Connecting to Herald peer at {url}...")
+                websocket = await websockets.connect(url,
+                                                     loop=self.loop,
+                                                     compression="deflate" if self.config.websocket_compression
+                                                     else None,
+                                                     # The connection is checked by the heartbeat instead
+                                                     ping_interval=None)
+                try:
+                    await websocket.send(f"Identify {self.server_id}:<server>:{self.config.secret}"
+                                         f" {','.join(self.codecs)} batch,peer")
+                    response: Package = self.codecs[JSONCodec.name].loads(await websocket.recv())
+                    if response.data.get("type") != "success" or "server_id" not in response.data:
+                        # Retrying can't fix a wrong secret or address
+                        log.error(f"Herald peer {url} refused the connection: {response.data.get('service')}")
+                        return
+                    connection = ConnectedClient(websocket, queue_size=self.peer_queue_size)
+                    connection.nid = response.data["server_id"]
+                    connection.link_type = "<server>"
+                    connection.codec = self.codecs.get(response.data.get("codec"), self.codecs[JSONCodec.name])
+                    if "batch" in response.data.get("features", []) and self.config.batch_window is not None:
+                        connection.batch_max_bytes = self.config.batch_max_bytes
+                    attempt = 0
+                    await self.serve_peer(connection)
+                finally:
+                    await websocket.close()
+            except (OSError, websockets.WebSocketException) as e:
+                log.warning(f"Herald peer connection failed ({e.__class__.__qualname__}): {url}")
+            delay = self.config.reconnect_delay(attempt)
+            attempt += 1
+            await aio.sleep(delay)
+
+    async def unix_listener(self, reader: aio.StreamReader, writer: aio.StreamWriter):
+        """Handle a connection to the :attr:`.config.local_socket` like a websocket connection."""
+        connection = UnixConnection(reader, writer, path=self.config.local_socket)
+        try:
+            await self.listener(connection, self.config.local_socket)
+        finally:
+            await connection.close()
+
+    def choose_codec(self, offered: List[str]) -> Codec:
+        """Choose the first codec offered by a client that is also available on the server, falling back to JSON."""
+        for name in offered:
+            codec = self.codecs.get(name)
+            if codec is not None:
+                return codec
+        return self.codecs[JSONCodec.name]
+
+    def find_destination(self, package: Union[Package, Envelope]) -> List[ConnectedClient]:
         """Find a list of destinations for the package.
 
         Parameters:
@@ -116,29 +686,163 @@ class Server:
             return []
         # Is it all possible destinations?
         if package.destination == "*":
-            return self.identified_clients
-        # Is it a valid nid?
-        try:
-            destination = str(uuid.UUID(package.destination))
-        except ValueError:
-            pass
-        else:
-            return self.find_client(nid=destination)
+            return list(self.identified_clients.values())
+        # Is it a topic?
+        if package.destination.startswith("#"):
+            topic = package.destination[1:]
+            clients = set(self.subscribers.get(topic, []))
+            for pattern, subscribers in self.pattern_subscribers.items():
+                if fnmatch.fnmatchcase(topic, pattern):
+                    clients.update(subscribers)
+            return list(clients)
+        # Is it a connected nid?
+        client = self.identified_clients.get(package.destination)
+        if client is not None:
+            return [client]
         # Is it a link_type?
-        return self.find_client(link_type=package.destination)
+        return list(self.link_types.get(package.destination, []))
 
-    async def route_package(self, package: Package) -> None:
-        """Executed every time a :class:`Package` is received and must be routed somewhere."""
+    def find_peers(self, package: Union[Package, Envelope]) -> List[PeerNode]:
+        """Find the other servers of the cluster the package should be forwarded to.
+
+        Parameters:
+            package: The package to find the destination of.
+
+        Returns:
+            A :class:`list` of :class:`PeerNode` to forward the package to."""
+        if not self.peers or package.destination == "<none>":
+            return []
+        # The subscriptions are only known by the server the subscribers are connected to
+        if package.destination == "*" or package.destination.startswith("#"):
+            return list(self.peers.values())
+        # Clients connected to this server are preferred
+        if package.destination in self.identified_clients:
+            return []
+        peer = self.remote_clients.get(package.destination)
+        if peer is not None:
+            return [peer]
+        return list(self.remote_link_types.get(package.destination, {}))
+
+    async def route_package(self, package: Union[Package, Envelope], *, forward: bool = True) -> None:
+        """Executed every time a :class:`Package` is received and must be routed somewhere.
+
+        Parameters:
+            package: The package to route.
+            forward: Forward the package to the other servers of the cluster, if some of its destinations are
+                     connected to them."""
         destinations = self.find_destination(package)
-        log.debug(f"Routing package: {package} -> {destinations}")
+        peers = self.find_peers(package) if forward else []
+        log.debug(f"Routing package: {package} -> {destinations} {peers}")
+        source = self.label(package.source)
+        stored = self.store(package) if forward and self.outboxes else False
+        if not destinations and not peers:
+            if not stored:
+                self.errors.inc(source, self.label(package.destination), "undeliverable")
+            return
+        self.metrics["routed"] += 1
+        self.routed_messages.inc(source, self.label(package.destination))
+        if isinstance(package, Package):
+            package = Envelope.from_package(package)
+        # The envelope encodes the data at most once per codec, and not at all for the codec it was received with
         for destination in destinations:
-            # This may have some consequences
-            specific_package = Package(package.data,
-                                       source=package.source,
-                                       destination=destination.nid,
-                                       source_conv_id=package.source_conv_id,
-                                       destination_conv_id=package.destination_conv_id)
-            await destination.send(specific_package)
+            self.send_metered(destination, destination.link_type,
+                              destination.codec.dumps(package, destination=destination.nid), source, package.priority)
+        # The other servers need the original destination to route the package to their clients
+        for peer in peers:
+            self.send_metered(peer, "<server>", peer.codec.dumps(package), source, package.priority)
+
+    def durable_outboxes(self, destination: str) -> List[DurableOutbox]:
+        """Find the outboxes of the link types a package should be delivered to, but that have no client connected to
+        the cluster."""
+        if destination == "*":
+            link_types = set(self.outboxes)
+        elif destination.startswith("#"):
+            topic = destination[1:]
+            link_types = set()
+            for subscribed, subscribers in self.topic_link_types.items():
+                if subscribed == topic or (is_pattern(subscribed) and fnmatch.fnmatchcase(topic, subscribed)):
+                    link_types.update(subscribers)
+        elif destination in self.outboxes:
+            link_types = {destination}
+        else:
+            return []
+        return [self.outboxes[link_type] for link_type in link_types
+                if link_type in self.outboxes
+                and link_type not in self.link_types
+                and link_type not in self.remote_link_types]
+
+    def store(self, package: Union[Package, Envelope]) -> bool:
+        """Store a :class:`Broadcast` in the outboxes of the link types it should be delivered to, but that have no
+        client connected to the cluster.
+
+        Returns:
+            :data:`True` if the package was stored in at least an outbox."""
+        outboxes = self.durable_outboxes(package.destination)
+        if not outboxes:
+            return False
+        if isinstance(package, Package):
+            package = Envelope.from_package(package)
+        # Nobody would be waiting for the response to a request anymore
+        if not package.is_broadcast:
+            return False
+        # The package is stored as it was received, so that its data never has to be decoded
+        raw = (package.codec or self.storage_codec).dumps(package)
+        stored = False
+        for outbox in outboxes:
+            if outbox.append(raw):
+                self.stored_messages.inc(outbox.link_type)
+                stored = True
+            else:
+                log.warning(f"Dropping package for full {outbox}")
+                self.errors.inc(self.label(package.source), outbox.link_type, "outbox_full")
+        return stored
+
+    @property
+    def storage_codec(self) -> Codec:
+        """The :class:`Codec` used to store the packages that weren't received encoded, such as the ones created by the
+        server: the most compact one that is available."""
+        return next(iter(self.codecs.values()))
+
+    def stored_codec(self, raw: bytes) -> Codec:
+        """Find the :class:`Codec` a package was stored with, as the codec may have changed after a restart."""
+        # JSON packages are objects, while msgpack packages start with the version of their header
+        return self.codecs[JSONCodec.name] if raw[:1] == b"{" else self.codecs[MsgpackCodec.name]
+
+    async def replay(self, client: ConnectedClient) -> None:
+        """Send the packages stored in the outbox of the link type of a client, if it can acknowledge them."""
+        outbox = self.outboxes.get(client.link_type)
+        if outbox is None or "ack" not in client.features or client.link_type in self.replaying:
+            return
+        records = outbox.read()
+        if not records:
+            return
+        log.info(f"Replaying {len(records)} stored packages to {client}")
+        self.replaying[client.link_type] = client
+        client.replayed = len(records)
+        packages = [self.stored_codec(raw).unpack(raw) for raw in records]
+        # All the stored packages are queued in the same lane, which is sent in order, so that the marker is the last
+        # one to arrive
+        lane = max(package.priority for package in packages)
+        for package in packages:
+            await client.outbox.put((lane, client.codec.dumps(package, destination=client.nid)))
+        await client.outbox.put((lane, client.codec.dumps(Package({"type": "replayed", "count": len(records)},
+                                                                  source="<server>",
+                                                                  destination=client.nid,
+                                                                  priority=lane))))
+
+    def send_metered(self,
+                     destination: Union[ConnectedClient, PeerNode],
+                     label: str,
+                     raw: bytes,
+                     source: str,
+                     priority: int = 0) -> None:
+        """Queue encoded bytes to be sent to a client or another server, counting them in the :attr:`.registry`."""
+        if destination.enqueue(raw, priority):
+            self.sent_messages.inc(label)
+            self.sent_bytes.inc(label, amount=len(raw))
+        else:
+            self.metrics["dropped"] += 1
+            self.errors.inc(source, label, "dropped")
 
     def serve(self):
         if self.config.secure:
@@ -151,10 +855,26 @@ class Server:
         self.loop.run_forever()
 
     async def run(self):
+        if self.config.outbox_path is not None:
+            self.outboxes = DurableOutbox.load_all(self.config.outbox_path, self.config.outbox_max_bytes)
         await websockets.serve(self.listener,
                                host=self.config.address,
                                port=self.config.port,
-                               loop=self.loop)
+                               loop=self.loop,
+                               compression="deflate" if self.config.websocket_compression else None,
+                               # The connections are checked by the heartbeat instead
+                               ping_interval=None,
+                               process_request=self.process_request)
+        if self.config.local_socket is not None:
+            # The socket file of a previous server is never removed automatically
+            if os.path.exists(self.config.local_socket):
+                os.unlink(self.config.local_socket)
+            await aio.start_unix_server(self.unix_listener, path=self.config.local_socket, loop=self.loop)
+            log.debug(f"Serving on {self.config.local_socket}")
+        for url in self.config.peers:
+            self.loop.create_task(self.dial_peer(url))
+        if self.config.heartbeat_interval is not None:
+            self.loop.create_task(self.heartbeat())
 
     def run_blocking(self, logging_cfg: Dict[str, Any]):
         ru.init_logging(logging_cfg)
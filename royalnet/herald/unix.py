@@ -0,0 +1,116 @@
+import asyncio as aio
+import logging
+import struct
+from typing import *
+
+from websockets.exceptions import ConnectionClosedOK, ConnectionClosedError
+
+log = logging.getLogger(__name__)
+
+_HEADER = struct.Struct("!IB")
+# The same opcodes used by websockets
+_TEXT = 0x1
+_BINARY = 0x2
+_CLOSE = 0x8
+_PING = 0x9
+_PONG = 0xA
+
+
+class UnixConnection:
+    """A connection over a Unix domain socket, offering the same interface of the websockets used by the Herald.
+
+    Every message is sent as a single frame, prefixed by its length and by its kind: this avoids the framing, the
+    masking and the loopback TCP stack of the websockets, when the :class:`Link` and the :class:`Server` are on the
+    same host."""
+
+    def __init__(self, reader: aio.StreamReader, writer: aio.StreamWriter, *, path: str):
+        self.path: str = path
+        self._reader: aio.StreamReader = reader
+        self._writer: aio.StreamWriter = writer
+        self._write_lock: aio.Lock = aio.Lock()
+        self._pings: Dict[bytes, aio.Future] = {}
+        self._ping_count: int = 0
+        self.closed: bool = False
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.path}{' (closed)' if self.closed else ''}>"
+
+    @classmethod
+    async def connect(cls, path: str, *, loop: aio.AbstractEventLoop = None) -> "UnixConnection":
+        """Connect to a :class:`Server` listening on the Unix domain socket at ``path``."""
+        reader, writer = await aio.open_unix_connection(path, loop=loop)
+        return cls(reader, writer, path=path)
+
+    @property
+    def remote_address(self) -> Tuple[str, str]:
+        return "unix", self.path
+
+    async def _write(self, kind: int, payload: bytes) -> None:
+        if self.closed:
+            raise ConnectionClosedError(1006, "")
+        try:
+            async with self._write_lock:
+                self._writer.writelines((_HEADER.pack(len(payload), kind), payload))
+                await self._writer.drain()
+        except ConnectionError:
+            self.closed = True
+            raise ConnectionClosedError(1006, "")
+
+    async def send(self, message: Union[str, bytes]) -> None:
+        """Send a message, as text if it is a :class:`str` or as binary data otherwise."""
+        if isinstance(message, str):
+            await self._write(_TEXT, bytes(message, encoding="utf8"))
+        else:
+            await self._write(_BINARY, message)
+
+    async def recv(self) -> Union[str, bytes]:
+        """Receive the next message, answering the pings received in the meantime.
+
+        Raises:
+            :exc:`websockets.ConnectionClosed` if the connection is closed."""
+        while True:
+            try:
+                length, kind = _HEADER.unpack(await self._reader.readexactly(_HEADER.size))
+                payload = await self._reader.readexactly(length)
+            except (aio.IncompleteReadError, ConnectionError):
+                self.closed = True
+                raise ConnectionClosedError(1006, "")
+            if kind == _BINARY:
+                return payload
+            elif kind == _TEXT:
+                return str(payload, encoding="utf8")
+            elif kind == _PING:
+                await self._write(_PONG, payload)
+            elif kind == _PONG:
+                waiter = self._pings.pop(payload, None)
+                if waiter is not None and not waiter.done():
+                    waiter.set_result(None)
+            elif kind == _CLOSE:
+                self.closed = True
+                self._writer.close()
+                raise ConnectionClosedOK(1000, "")
+            else:
+                log.warning(f"Ignoring unknown frame kind {kind} from {self}")
+
+    async def ping(self) -> aio.Future:
+        """Send a ping.
+
+        Returns:
+            A future that is resolved when the pong is received, while receiving messages with :meth:`.recv`."""
+        self._ping_count += 1
+        payload = self._ping_count.to_bytes(8, "big")
+        waiter = aio.get_event_loop().create_future()
+        self._pings[payload] = waiter
+        await self._write(_PING, payload)
+        return waiter
+
+    async def close(self) -> None:
+        """Close the connection, telling the other side about it."""
+        if self.closed:
+            return
+        try:
+            await self._write(_CLOSE, b"")
+        except ConnectionClosedError:
+            pass
+        self.closed = True
+        self._writer.close()
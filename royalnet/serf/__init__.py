@@ -1,9 +1,13 @@
 """The subpackage providing all Serf implementations."""
 
+from .dispatcher import CommandDispatcher
 from .errors import SerfError
+from .scheduler import CommandScheduler
 from .serf import Serf
 
 __all__ = [
     "Serf",
     "SerfError",
+    "CommandDispatcher",
+    "CommandScheduler",
 ]
@@ -9,7 +9,7 @@ import discord
 import royalnet.backpack.tables as rbt
 import royalnet.commands as rc
 from royalnet.serf import Serf
-from royalnet.utils import asyncify, sentry_exc
+from royalnet.utils import asyncify, sentry_exc, trace_phase
 from .escape import escape
 
 log = logging.getLogger(__name__)
@@ -59,10 +59,12 @@ class DiscordSerf(Serf):
                 data.message: "discord.Message" = message
 
             async def reply(data, text: str):
-                await data.message.channel.send(escape(text))
+                with trace_phase("api"):
+                    await data.message.channel.send(escape(text))
 
             async def reply_image(data, image: io.IOBase, caption: Optional[str] = None) -> None:
-                await data.message.channel.send(caption, file=discord.File(image, 'image'))
+                with trace_phase("api"):
+                    await data.message.channel.send(caption, file=discord.File(image, 'image'))
 
             async def find_author(data,
                                   *,
@@ -89,27 +91,17 @@ class DiscordSerf(Serf):
         if not text:
             log.debug("Skipping message as it had no text")
             return
-        # Skip non-command updates
-        if not text.startswith(self.prefix):
-            log.debug(f"Skipping message as it didn't start with {self.prefix}")
+        # Find the command and its parameters
+        parsed = self.dispatcher.parse(text)
+        if parsed is None:
+            log.debug("Skipping message as it didn't call any command")
             return
         # Skip bot messages
         author: Union["discord.User", "discord.Member"] = message.author
         if author.bot:
             log.debug(f"Skipping message as it was from another bot")
             return
-        # Find and clean parameters
-        command_text, *parameters = text.split(" ")
-        # Don't use a case-sensitive command name
-        command_name = command_text.lstrip(self.prefix).lower()
-        log.debug(f"Parsed '{command_name}' as command name")
-        # Find the command
-        try:
-            command = self.commands[command_name]
-        except KeyError:
-            # Skip the message
-            log.debug(f"Skipping message as I could not find the command {command_name}")
-            return
+        command, parameters = parsed
         # Call the command
         log.debug(f"Sending typing notification")
         with message.channel.typing():
@@ -128,7 +120,7 @@ class DiscordSerf(Serf):
             # noinspection PyMethodMayBeStatic
             async def on_message(cli, message: "discord.Message") -> None:
                 """Handle messages received by passing them to the handle_message method of the bot."""
-                self.tasks.add(self.handle_message(message))
+                self.scheduler.submit(message.channel.id, self.handle_message(message))
 
             async def on_ready(cli) -> None:
                 """Change the bot presence to ``online`` when the bot is ready."""
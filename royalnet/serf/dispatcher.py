@@ -0,0 +1,57 @@
+import logging
+from typing import *
+
+import royalnet.commands as rc
+
+log = logging.getLogger(__name__)
+
+
+class CommandDispatcher:
+    """Find the :class:`~royalnet.commands.Command` called by a message, if any.
+
+    The lookup table is built once when the commands are registered, so that parsing a message only needs one
+    :meth:`str.startswith` check, one :meth:`str.partition` and one :class:`dict` lookup."""
+
+    def __init__(self, prefix: str, suffix: Optional[str] = None):
+        self.prefix: str = prefix
+        """The string the messages calling a command start with, such as ``/`` on Telegram."""
+
+        self.suffix: Optional[str] = suffix
+        """A string that may follow the command name and should be ignored, such as ``@botname`` on Telegram."""
+
+        self.table: Dict[str, rc.Command] = {}
+        """The :class:`dict` connecting each lowercase command name and alias to its :class:`Command` object."""
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.prefix} ({len(self.table)} commands)>"
+
+    @property
+    def suffix(self) -> Optional[str]:
+        return self._suffix
+
+    @suffix.setter
+    def suffix(self, value: Optional[str]) -> None:
+        # Command names are case-insensitive, so the suffix is too
+        self._suffix = value.lower() if value else None
+
+    def build(self, commands: Dict[str, rc.Command]) -> None:
+        """Rebuild the lookup table from a :class:`dict` of commands, including their aliases."""
+        self.table = {name.lower(): command for name, command in commands.items()}
+        log.debug(f"Built {self}")
+
+    def parse(self, text: str) -> Optional[Tuple[rc.Command, List[str]]]:
+        """Find the command called by a message and split its parameters.
+
+        Returns:
+            A :class:`tuple` with the :class:`Command` and the :class:`list` of its parameters, or :const:`None` if
+            the message doesn't call any known command."""
+        if not text.startswith(self.prefix):
+            return None
+        command_text, separator, parameters = text.partition(" ")
+        command_name = command_text[len(self.prefix):].lower()
+        if self._suffix is not None and command_name.endswith(self._suffix):
+            command_name = command_name[:-len(self._suffix)]
+        command = self.table.get(command_name)
+        if command is None:
+            return None
+        return command, parameters.split(" ") if separator else []
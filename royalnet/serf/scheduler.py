@@ -0,0 +1,87 @@
+import asyncio as aio
+import collections
+import logging
+from typing import *
+
+import royalnet.utils as ru
+
+log = logging.getLogger(__name__)
+
+
+class CommandScheduler:
+    """Run the coroutines handling the incoming messages with a global concurrency limit.
+
+    The coroutines waiting for a free slot are queued separately for each chat, and the chats are served round-robin,
+    so that a busy chat can't delay the commands called in the others.
+
+    When the queue of a chat or the total number of waiting coroutines is full, new coroutines are dropped."""
+
+    def __init__(self,
+                 tasks: ru.TaskList,
+                 *,
+                 max_concurrency: int = 32,
+                 chat_queue_size: int = 16,
+                 max_queued: int = 1024):
+        if max_concurrency < 1:
+            raise ValueError("max_concurrency must be at least 1")
+        self.tasks: ru.TaskList = tasks
+        """The :class:`TaskList` the coroutines are started in."""
+
+        self.max_concurrency: int = max_concurrency
+        """The maximum number of coroutines running at the same time."""
+
+        self.chat_queue_size: int = chat_queue_size
+        """The maximum number of coroutines waiting in the queue of a single chat."""
+
+        self.max_queued: int = max_queued
+        """The maximum number of coroutines waiting in all the queues."""
+
+        self.running: int = 0
+        self.queued: int = 0
+        self.shed: int = 0
+        """The number of coroutines dropped because the queues were full."""
+
+        self._queues: Dict[Hashable, Deque[Awaitable[Any]]] = {}
+        self._ready: Deque[Hashable] = collections.deque()
+        """The chats with waiting coroutines, in the order they will be served."""
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.running}/{self.max_concurrency} running, {self.queued} queued>"
+
+    def submit(self, chat: Hashable, coroutine: Awaitable[Any]) -> bool:
+        """Run a coroutine as soon as a slot is free and its chat's turn comes.
+
+        Returns:
+            :data:`False` if the coroutine was dropped because the queues were full."""
+        queue = self._queues.get(chat)
+        if self.queued >= self.max_queued or (queue is not None and len(queue) >= self.chat_queue_size):
+            log.warning(f"Dropping {coroutine} from {chat}, as {self} is full")
+            # Avoid the "coroutine was never awaited" warning
+            coroutine.close()
+            self.shed += 1
+            return False
+        if queue is None:
+            queue = self._queues[chat] = collections.deque()
+            self._ready.append(chat)
+        queue.append(coroutine)
+        self.queued += 1
+        self._dispatch()
+        return True
+
+    def _dispatch(self) -> None:
+        while self.running < self.max_concurrency and self._ready:
+            chat = self._ready.popleft()
+            queue = self._queues[chat]
+            coroutine = queue.popleft()
+            if queue:
+                self._ready.append(chat)
+            else:
+                del self._queues[chat]
+            self.queued -= 1
+            self.running += 1
+            # A done callback frees the slot even if the task is cancelled before it starts running
+            self.tasks.add(coroutine).add_done_callback(self._done)
+
+    def _done(self, task: aio.Task) -> None:
+        self.running -= 1
+        self._dispatch()
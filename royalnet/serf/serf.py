@@ -1,9 +1,12 @@
 import abc
 import asyncio as aio
-import importlib
+import collections
+import contextlib
+import inspect
+import json
 import logging
-import sys
-import traceback
+import multiprocessing
+import queue
 from typing import *
 
 from sqlalchemy.schema import Table
@@ -12,6 +15,8 @@ import royalnet.alchemy as ra
 import royalnet.backpack.tables as rbt
 import royalnet.commands as rc
 import royalnet.utils as ru
+from .dispatcher import CommandDispatcher
+from .scheduler import CommandScheduler
 
 try:
     import royalnet.herald as rh
@@ -37,29 +42,55 @@ class Serf(abc.ABC):
                  alchemy_cfg: rc.ConfigDict,
                  herald_cfg: rc.ConfigDict,
                  packs_cfg: rc.ConfigDict,
+                 serf_cfg: rc.ConfigDict,
                  **_):
+        self.startup: ru.Trace = ru.Trace("startup", self.interface_name)
+        """The time spent in each phase of the startup of the serf."""
+
         self.loop: Optional[aio.AbstractEventLoop] = loop
         """The event loop this Serf is running on."""
 
         self.tasks: Optional[ru.TaskList] = ru.TaskList(self.loop)
         """A list of all running tasks of the serf. Initialized at the serf start."""
 
-        # Import packs
-        pack_names = packs_cfg["active"]
-        packs = {}
-        for pack_name in pack_names:
-            log.debug(f"Importing pack: {pack_name}")
-            try:
-                packs[pack_name] = {
-                    "commands": importlib.import_module(f".commands", pack_name),
-                    "events": importlib.import_module(f".events", pack_name),
-                    "stars": importlib.import_module(f".stars", pack_name),
-                    "tables": importlib.import_module(f".tables", pack_name),
-                }
-            except ImportError as e:
-                log.error(f"{e.__class__.__name__} during the import of {pack_name}:\n"
-                          f"{''.join(traceback.format_exception(*sys.exc_info()))}")
-        log.info(f"Packs: {len(packs)} imported")
+        self.scheduler: CommandScheduler = CommandScheduler(self.tasks,
+                                                            max_concurrency=serf_cfg.get("max_concurrency", 32),
+                                                            chat_queue_size=serf_cfg.get("chat_queue_size", 16),
+                                                            max_queued=serf_cfg.get("max_queued", 1024))
+        """The :class:`CommandScheduler` limiting the number of messages handled at the same time."""
+
+        self.slow_threshold: float = serf_cfg.get("slow_threshold", 5.0)
+        """The number of seconds after which an invocation is considered slow, and its trace is logged."""
+
+        self.slow_traces: Deque[Dict[str, Any]] = collections.deque(maxlen=32)
+        """The traces of the most recent slow invocations."""
+
+        self.registry: ru.MetricsRegistry = ru.MetricsRegistry(f"serf_{self.interface_name}_")
+        """The metrics of the commands, keyboard keys and Herald events, exported by :meth:`.render_metrics`."""
+        self.invocation_duration: ru.MetricHistogram = self.registry.histogram(
+            "invocation_duration_seconds", "Time taken by the commands, keyboard keys and Herald events.",
+            ["kind", "name"])
+        self.invocation_phases: ru.MetricCounter = self.registry.counter(
+            "invocation_phase_seconds_total", "Time spent by the invocations in executor jobs, database sessions or "
+            "API calls.", ["kind", "name", "phase"])
+        self.invocation_errors: ru.MetricCounter = self.registry.counter(
+            "invocation_errors_total", "Invocations that raised an exception.", ["kind", "name", "error"])
+        self.invocations_in_flight: ru.MetricGauge = self.registry.gauge(
+            "invocations_in_flight", "Invocations currently running.", ["kind", "name"])
+        self.running_tasks: ru.MetricGauge = self.registry.gauge(
+            "running_tasks", "Tasks currently running in the serf.")
+        self.oldest_task_age: ru.MetricGauge = self.registry.gauge(
+            "oldest_task_age_seconds", "Time the longest running task of the serf has been running for.")
+        self.ended_tasks: ru.MetricCounter = self.registry.counter(
+            "ended_tasks_total", "Tasks of the serf that ended, by outcome.", ["outcome"])
+        self.queued_messages: ru.MetricGauge = self.registry.gauge(
+            "queued_messages", "Messages waiting for a free slot in the scheduler.")
+        self.shed_messages: ru.MetricCounter = self.registry.counter(
+            "shed_messages_total", "Messages dropped because the scheduler queues were full.")
+
+        # Import packs lazily
+        packs: List[ru.Pack] = ru.Pack.from_config(packs_cfg)
+        log.info(f"Packs: {len(packs)} active")
 
         self.alchemy: Optional[ra.Alchemy] = None
         """The :class:`Alchemy` object connecting this :class:`Serf` to a database."""
@@ -82,16 +113,12 @@ class Serf(abc.ABC):
         else:
             # Find all tables
             tables = set()
-            for pack in packs.values():
-                try:
-                    # noinspection PyUnresolvedReferences
-                    tables = tables.union(pack["tables"].available_tables)
-                except AttributeError:
-                    log.warning(f"Pack `{pack}` does not have the `available_tables` attribute.")
-                    continue
+            for pack in packs:
+                tables = tables.union(pack.tables)
             # Create the Alchemy
             self.init_alchemy(alchemy_cfg, tables)
             log.info(f"Alchemy: {self.alchemy}")
+        self.startup.mark("alchemy")
 
         self.herald: Optional["rh.Link"] = None
         """The :class:`Link` object connecting the :class:`Serf` to the rest of the Herald network."""
@@ -102,28 +129,26 @@ class Serf(abc.ABC):
         self.events: Dict[str, rc.HeraldEvent] = {}
         """A dictionary containing all :class:`Event` that can be handled by this :class:`Serf`."""
 
+        self.herald_calls: ru.SingleFlight = ru.SingleFlight()
+        """The calls to :meth:`.call_herald_event` for idempotent events that are waiting for a response."""
+
         self.commands: Dict[str, rc.Command] = {}
         """The :class:`dict` connecting each command name to its :class:`Command` object."""
 
-        for pack_name in packs:
-            pack = packs[pack_name]
-            pack_cfg = packs_cfg.get(pack_name, {})
-            try:
-                # noinspection PyUnresolvedReferences
-                events = pack["events"].available_events
-            except AttributeError:
-                log.warning(f"Pack `{pack}` does not have the `available_events` attribute.")
-            else:
-                self.register_events(events, pack_cfg)
-            try:
-                # noinspection PyUnresolvedReferences
-                commands = pack["commands"].available_commands
-            except AttributeError:
-                log.warning(f"Pack `{pack}` does not have the `available_commands` attribute.")
-            else:
-                self.register_commands(commands, pack_cfg)
+        self.dispatcher: CommandDispatcher = CommandDispatcher(self.prefix)
+        """The :class:`CommandDispatcher` finding the :class:`Command` called by each message."""
+
+        for pack in packs:
+            self.register_events(pack.events, packs_cfg.get(pack.name, {}))
         log.info(f"Events: {len(self.events)} events")
+        self.startup.mark("events")
+
+        for pack in packs:
+            self.register_commands(pack.commands, packs_cfg.get(pack.name, {}))
+        # Build the lookup table only once for all the commands of all the packs
+        self.dispatcher.build(self.commands)
         log.info(f"Commands: {len(self.commands)} commands")
+        self.startup.mark("commands")
 
         if rh is None:
             log.info("Herald: not installed")
@@ -132,6 +157,7 @@ class Serf(abc.ABC):
         else:
             self.init_herald(herald_cfg)
             log.info(f"Herald: enabled")
+        self.startup.mark("herald")
 
     def init_alchemy(self, alchemy_cfg: Dict[str, Any], tables: Set[type]) -> None:
         """Create and initialize the :class:`Alchemy` with the required tables, and find the link between the master
@@ -143,13 +169,61 @@ class Serf(abc.ABC):
         """Find a relationship path starting from the master table and ending at the identity table, and return it."""
         return ra.table_dfs(self.master_table, self.identity_table)
 
+    async def publish_herald_event(self, event_name: str, **kwargs) -> None:
+        """Send a :class:`royalherald.Broadcast` to all the links with an event named ``event_name``, without waiting
+        for them to run it."""
+        if self.herald is None:
+            raise rc.UnsupportedError("`royalherald` is not enabled on this serf.")
+        broadcast: "rh.Broadcast" = rh.Broadcast(handler=event_name, data=kwargs)
+        await self.herald.publish(broadcast)
+
     async def call_herald_event(self, destination: str, event_name: str, **kwargs) -> Dict:
         """Send a :class:`royalherald.Request` to a specific destination, and wait for a
-        :class:`royalherald.Response`."""
+        :class:`royalherald.Response`.
+
+        If the event is :attr:`~rc.HeraldEvent.idempotent`, identical calls made while waiting for the response share
+        it, instead of sending another request."""
         if self.herald is None:
             raise rc.UnsupportedError("`royalherald` is not enabled on this serf.")
+        # Only the events known by this process can be checked
+        event: Optional[rc.HeraldEvent] = self.events.get(event_name)
+        if event is not None and event.idempotent:
+            key = ru.SingleFlight.key(destination, event_name, kwargs)
+            if key is not None:
+                return await self.herald_calls.run(key, self._call_herald_event, destination, event_name, kwargs)
+        return await self._call_herald_event(destination, event_name, kwargs)
+
+    async def _call_herald_event(self, destination: str, event_name: str, kwargs: Dict) -> Dict:
         request: "rh.Request" = rh.Request(handler=event_name, data=kwargs)
-        response: "rh.Response" = await self.herald.request(destination=destination, request=request)
+        try:
+            # Someone is usually waiting for the result, so it shouldn't wait for the broadcasts
+            response: "rh.Response" = await self.herald.request(destination=destination, request=request, priority=1)
+        except rh.RequestTimeoutError:
+            raise rc.ExternalError(f"{destination} did not respond to the '{event_name}' event in time.")
+        except rh.ConnectionClosedError:
+            raise rc.ExternalError(f"The Herald connection was closed while waiting for the '{event_name}' event.")
+        return self._herald_response_data(destination, event_name, response)
+
+    async def stream_herald_event(self, destination: str, event_name: str, **kwargs) -> AsyncIterator[Dict]:
+        """Send a streaming :class:`royalherald.Request` to a specific destination, and iterate over the chunks of its
+        response as they are received."""
+        if self.herald is None:
+            raise rc.UnsupportedError("`royalherald` is not enabled on this serf.")
+        request: "rh.Request" = rh.Request(handler=event_name, data=kwargs)
+        try:
+            async for chunk in self.herald.request_stream(destination=destination, request=request, priority=1):
+                yield chunk
+        except rh.RequestTimeoutError:
+            raise rc.ExternalError(f"{destination} did not stream the '{event_name}' event in time.")
+        except rh.ConnectionClosedError:
+            raise rc.ExternalError(f"The Herald connection was closed while streaming the '{event_name}' event.")
+        except rh.StreamFailedError as e:
+            self._herald_response_data(destination, event_name, e.response)
+
+    @staticmethod
+    def _herald_response_data(destination: str, event_name: str, response: "rh.Response") -> Dict:
+        """Get the data of a :class:`royalherald.ResponseSuccess`, or raise the error described by a
+        :class:`royalherald.ResponseFailure`."""
         if isinstance(response, rh.ResponseFailure):
             if response.name == "no_event":
                 raise rc.ProgramError(f"There is no event named {event_name} in {destination}.")
@@ -185,7 +259,9 @@ class Serf(abc.ABC):
                                   f"[p]{response}[/p]")
 
     def register_commands(self, commands: List[Type[rc.Command]], pack_cfg: rc.ConfigDict) -> None:
-        """Initialize and register all commands passed as argument."""
+        """Initialize and register all commands passed as argument.
+
+        The :attr:`.dispatcher` has to be rebuilt afterwards for the commands to be called."""
         # Instantiate the Commands
         for SelectedCommand in commands:
             # Try to instantiate the command
@@ -216,7 +292,12 @@ class Serf(abc.ABC):
     def init_herald(self, herald_cfg: rc.ConfigDict):
         """Create a :class:`Link` and bind :class:`Event`."""
         herald_cfg["name"] = self.interface_name
-        self.herald: "rh.Link" = rh.Link(rh.Config.from_config(**herald_cfg), self.network_handler)
+        handler_limits = {name: event.max_concurrency
+                          for name, event in self.events.items()
+                          if event.max_concurrency is not None}
+        self.herald: "rh.Link" = rh.Link(rh.Config.from_config(**herald_cfg), self.network_handler,
+                                         handler_limits=handler_limits,
+                                         subscriptions=[*self.events, rc.CACHE_INVALIDATION_HANDLER])
 
     def register_events(self, events: List[Type[rc.HeraldEvent]], pack_cfg: rc.ConfigDict):
         for SelectedEvent in events:
@@ -236,40 +317,109 @@ class Serf(abc.ABC):
             self.events[SelectedEvent.name] = event
 
     async def network_handler(self, message: Union["rh.Request", "rh.Broadcast"]) -> "rh.Response":
+        if message.handler == rc.CACHE_INVALIDATION_HANDLER:
+            event: Optional[rc.HeraldEvent] = self.events.get(message.data["event"])
+            if event is not None:
+                event.forget(message.data["kwargs"])
+            return rh.ResponseSuccess()
         try:
             event: rc.HeraldEvent = self.events[message.handler]
         except KeyError:
             log.warning(f"No event for '{message.handler}'")
             return rh.ResponseFailure("no_event", f"This serf does not have any event for {message.handler}.")
         log.debug(f"Event called: {event.name}")
+        streaming = inspect.isasyncgenfunction(event.run)
         if isinstance(message, rh.Request):
+            if streaming:
+                return rh.ResponseStream(self._stream_event(event, message))
             try:
-                response_data = await event.run(**message.data)
+                with self.instrument("event", event.name):
+                    response_data = await event.run_cached(**message.data)
                 return rh.ResponseSuccess(data=response_data)
-            except rc.CommandError as e:
-                return rh.ResponseFailure("error_in_event",
-                                          f"The event '{message.handler}' raised a {e.__class__.__qualname__}.",
-                                          extra_info={
-                                              "type": e.__class__.__qualname__,
-                                              "message": str(e)
-                                          })
             except Exception as e:
-                ru.sentry_exc(e)
-                return rh.ResponseFailure("unhandled_exception_in_event",
-                                          f"The event '{message.handler}' raised an unhandled"
-                                          f" {e.__class__.__qualname__}.",
-                                          extra_info={
-                                              "type": e.__class__.__qualname__,
-                                              "message": str(e)
-                                          })
+                return self._event_failure(message, e)
         elif isinstance(message, rh.Broadcast):
-            await event.run(**message.data)
+            with self.instrument("event", event.name):
+                if streaming:
+                    async for _ in event.run(**message.data):
+                        pass
+                else:
+                    await event.run(**message.data)
+
+    async def _stream_event(self, event: rc.HeraldEvent, message: "rh.Request") -> AsyncIterator:
+        """Run an event that yields its response in chunks, ending the stream with a failure if it raises an error."""
+        try:
+            with self.instrument("event", event.name):
+                async for chunk in event.run(**message.data):
+                    yield chunk
+        except Exception as e:
+            yield self._event_failure(message, e)
+
+    @staticmethod
+    def _event_failure(message: "rh.Request", e: Exception) -> "rh.ResponseFailure":
+        if isinstance(e, rc.CommandError):
+            return rh.ResponseFailure("error_in_event",
+                                      f"The event '{message.handler}' raised a {e.__class__.__qualname__}.",
+                                      extra_info={
+                                          "type": e.__class__.__qualname__,
+                                          "message": str(e)
+                                      })
+        ru.sentry_exc(e)
+        return rh.ResponseFailure("unhandled_exception_in_event",
+                                  f"The event '{message.handler}' raised an unhandled"
+                                  f" {e.__class__.__qualname__}.",
+                                  extra_info={
+                                      "type": e.__class__.__qualname__,
+                                      "message": str(e)
+                                  })
+
+    @contextlib.contextmanager
+    def instrument(self, kind: str, name: str) -> Iterator[ru.Trace]:
+        """Measure an invocation of a command, a keyboard key or a Herald event, recording it in the
+        :attr:`.registry` and logging its trace if it's slower than :attr:`.slow_threshold`."""
+        trace = ru.Trace(kind, name)
+        self.invocations_in_flight.inc(kind, name)
+        try:
+            with trace.activate():
+                yield trace
+        finally:
+            self.invocations_in_flight.dec(kind, name)
+            self.invocation_duration.observe(kind, name, value=trace.duration)
+            for phase, duration in trace.phases.items():
+                self.invocation_phases.inc(kind, name, phase, amount=duration)
+            if trace.error is not None:
+                self.invocation_errors.inc(kind, name, trace.error)
+            if trace.duration >= self.slow_threshold:
+                self.slow_traces.append(trace.to_dict())
+                log.warning(f"Slow {kind}: {json.dumps(trace.to_dict())}")
+
+    def render_metrics(self) -> str:
+        """Export the :attr:`.registry` in the Prometheus text format."""
+        stats = self.tasks.stats()
+        self.running_tasks.set(value=stats["running"])
+        self.oldest_task_age.set(value=stats["oldest_age"])
+        for outcome in ("completed", "failed", "cancelled"):
+            self.ended_tasks.values[(outcome,)] = stats[outcome]
+        self.queued_messages.set(value=self.scheduler.queued)
+        self.shed_messages.values[()] = self.scheduler.shed
+        return self.registry.render()
+
+    async def export_metrics(self, report_queue: multiprocessing.Queue, interval: float) -> None:
+        """Periodically send :meth:`.render_metrics` to the launcher, through its :class:`multiprocessing.Queue` of
+        ``(kind, process_name, payload)`` reports."""
+        while True:
+            await aio.sleep(interval)
+            try:
+                report_queue.put_nowait(("metrics", multiprocessing.current_process().name, self.render_metrics()))
+            except queue.Full:
+                log.debug("Skipping metrics export, as the launcher isn't reading them")
 
     async def call(self, command: rc.Command, data: rc.CommandData, parameters: List[str]):
         log.info(f"Calling command: {command.name}")
         try:
             # Run the command
-            await command.run(rc.CommandArgs(parameters), data)
+            with self.instrument("command", command.name):
+                await command.run(rc.CommandArgs(parameters), data)
         except rc.InvalidInputError as e:
             await data.reply(f"⚠️ {e.message}\n"
                              f"Syntax: [c]{self.prefix}{command.name} {command.syntax}[/c]")
@@ -289,11 +439,11 @@ class Serf(abc.ABC):
             ru.sentry_exc(e)
             await data.reply(f"⛔️ [b]{e.__class__.__name__}[/b]\n" + '\n'.join(map(lambda a: repr(a), e.args)))
 
-    @staticmethod
-    async def press(key: rc.KeyboardKey, data: rc.CommandData):
+    async def press(self, key: rc.KeyboardKey, data: rc.CommandData):
         log.info(f"Calling key_callback: {repr(key)}")
         try:
-            await key.press(data)
+            with self.instrument("key", data.command.name):
+                await key.press(data)
         except rc.InvalidInputError as e:
             await data.reply(f"⚠️ {e.message}")
         except rc.UserError as e:
@@ -336,6 +486,15 @@ class Serf(abc.ABC):
         loop = aio.get_event_loop()
 
         serf = cls(loop=loop, **kwargs)
+        serf.startup.mark("interface")
+        log.info(f"Startup: {serf.startup.duration:.3f}s")
+
+        report_queue = kwargs.get("report_queue")
+        if report_queue is not None:
+            report_queue.put(("startup", multiprocessing.current_process().name, dict(serf.startup.phases)))
+            metrics_cfg = kwargs.get("metrics_cfg")
+            if metrics_cfg is not None and metrics_cfg["enabled"]:
+                serf.tasks.add(serf.export_metrics(report_queue, metrics_cfg.get("interval", 15)))
 
         try:
             serf.loop.run_until_complete(serf.run())
@@ -72,7 +72,8 @@ class TelegramSerf(Serf):
         The method may return None if it was decided that the call should be skipped."""
         while True:
             try:
-                return await ru.asyncify(f, *args, **kwargs)
+                with ru.trace_phase("api"):
+                    return await ru.asyncify(f, *args, **kwargs)
             except telegram.error.TimedOut as error:
                 log.debug(f"Timed out during {f.__qualname__} (retrying immediatly): {error}")
                 continue
@@ -202,6 +203,15 @@ class TelegramSerf(Serf):
     async def answer_cbq(self, cbq, text, alert=False):
         await self.api_call(cbq.answer, text=text, show_alert=alert)
 
+    @staticmethod
+    def update_chat(update: telegram.Update) -> Optional[int]:
+        """Find the id of the chat (or of the user, for inline queries) an update comes from."""
+        if update.effective_chat is not None:
+            return update.effective_chat.id
+        if update.effective_user is not None:
+            return update.effective_user.id
+        return None
+
     async def handle_update(self, update: telegram.Update):
         """Delegate :class:`telegram.Update` handling to the correct message type submethod."""
         if update.message is not None:
@@ -239,21 +249,12 @@ class TelegramSerf(Serf):
         if text is None:
             log.debug("Skipping message as it had no text or caption")
             return
-        # Skip non-command updates
-        if not text.startswith(self.prefix):
-            log.debug(f"Skipping message as it didn't start with {self.prefix}")
-            return
-        # Find and clean parameters
-        command_text, *parameters = text.split(" ")
-        command_name = command_text.replace(f"@{self.client.username}", "").lstrip(self.prefix).lower()
-        log.debug(f"Parsed '{command_name}' as command name")
-        # Find the command
-        try:
-            command = self.commands[command_name]
-        except KeyError:
-            # Skip the message
-            log.debug(f"Skipping message as I could not find the command {command_name}")
+        # Find the command and its parameters
+        parsed = self.dispatcher.parse(text)
+        if parsed is None:
+            log.debug("Skipping message as it didn't call any command")
             return
+        command, parameters = parsed
         # Send a typing notification
         log.debug(f"Sending typing notification")
         await self.api_call(message.chat.send_action, telegram.ChatAction.TYPING)
@@ -276,9 +277,11 @@ class TelegramSerf(Serf):
 
     async def run(self):
         await super().run()
+        # Commands may be followed by the username of the bot they are directed to
+        me: Optional[telegram.User] = await self.api_call(self.client.get_me)
+        if me is not None:
+            self.dispatcher.suffix = f"@{me.username}"
         while True:
-            # Collect ended tasks
-            self.tasks.collect()
             # Get the latest 100 updates
             log.debug("Getting updates...")
             last_updates: Optional[List[telegram.Update]] = await self.api_call(
@@ -295,7 +298,7 @@ class TelegramSerf(Serf):
             # Handle updates
             log.debug("Handling updates...")
             for update in last_updates:
-                self.tasks.add(self.handle_update(update))
+                self.scheduler.submit(self.update_chat(update), self.handle_update(update))
             # Recalculate offset
             try:
                 self.update_offset = last_updates[-1].update_id + 1
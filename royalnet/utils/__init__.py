@@ -1,13 +1,19 @@
 from .asyncify import asyncify
 from .formatters import andformat, underscorize, ytdldateformat, numberemojiformat, ordinalformat
+from .lanequeue import LaneQueue
 from .log import init_logging
+from .metrics import MetricsRegistry, MetricCounter, MetricGauge, MetricHistogram
 from .multilock import MultiLock
+from .pack import Pack
 from .royalnetprocess import RoyalnetProcess
 from .royaltyping import JSON
 from .sentry import init_sentry, sentry_exc, sentry_wrap, sentry_async_wrap
+from .singleflight import SingleFlight
 from .sleep_until import sleep_until
 from .strip_tabs import strip_tabs
 from .taskslist import TaskList
+from .tracing import Trace, current_trace, trace_phase
+from .ttlcache import TTLCache
 from .urluuid import to_urluuid, from_urluuid
 
 __all__ = [
@@ -30,4 +36,15 @@ __all__ = [
     "strip_tabs",
     "TaskList",
     "RoyalnetProcess",
+    "SingleFlight",
+    "TTLCache",
+    "MetricsRegistry",
+    "MetricCounter",
+    "MetricGauge",
+    "MetricHistogram",
+    "LaneQueue",
+    "Trace",
+    "current_trace",
+    "trace_phase",
+    "Pack",
 ]
@@ -2,6 +2,8 @@ import asyncio
 import functools
 import typing
 
+from .tracing import trace_phase
+
 
 async def asyncify(function: typing.Callable, *args, loop: typing.Optional[asyncio.AbstractEventLoop] = None, **kwargs):
     """Asyncronously run the function in a executor, allowing it to run asyncronously.
@@ -19,4 +21,5 @@ async def asyncify(function: typing.Callable, *args, loop: typing.Optional[async
         Calling a function this way might be significantly slower than calling its blocking counterpart!"""
     if not loop:
         loop = asyncio.get_event_loop()
-    return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
+    with trace_phase("executor"):
+        return await loop.run_in_executor(None, functools.partial(function, *args, **kwargs))
@@ -0,0 +1,52 @@
+import asyncio as aio
+import collections
+from typing import *
+
+
+class LaneQueue(aio.Queue):
+    """An :class:`asyncio.Queue` with two lanes: the items put with a positive priority are got before the others.
+
+    Items are put as ``(priority, item)`` tuples, but only the items are got.
+
+    To keep the items without priority from being starved, one of them is got every ``weight`` consecutive items with
+    priority, if any is waiting."""
+
+    def __init__(self, maxsize: int = 0, *, weight: int = 4, loop: Optional[aio.AbstractEventLoop] = None):
+        if weight < 1:
+            raise ValueError("weight must be at least 1")
+        self.weight: int = weight
+        if loop is None:
+            super().__init__(maxsize)
+        else:
+            super().__init__(maxsize, loop=loop)
+
+    def _init(self, maxsize: int) -> None:
+        self._bulk: Deque[Any] = collections.deque()
+        self._priority: Deque[Any] = collections.deque()
+        self._streak: int = 0
+        """The number of items with priority got since the last item without priority."""
+
+    # The base class reads its own storage directly, which is never used
+    def qsize(self) -> int:
+        return len(self._bulk) + len(self._priority)
+
+    def empty(self) -> bool:
+        return not self._bulk and not self._priority
+
+    def _put(self, item: Tuple[int, Any]) -> None:
+        priority, value = item
+        if priority > 0:
+            self._priority.append(value)
+        else:
+            self._bulk.append(value)
+
+    def _get(self) -> Any:
+        if self._priority and (self._streak < self.weight or not self._bulk):
+            self._streak += 1
+            return self._priority.popleft()
+        self._streak = 0
+        return self._bulk.popleft()
+
+    def lengths(self) -> Tuple[int, int]:
+        """Get the number of waiting items with and without priority."""
+        return len(self._priority), len(self._bulk)
@@ -0,0 +1,173 @@
+import bisect
+import collections
+import math
+from typing import *
+
+DEFAULT_BUCKETS: Tuple[float, ...] = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                                      10.0, 30.0)
+"""The default upper bounds of the :class:`MetricHistogram` buckets, in seconds."""
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """A family of values with the same name, one for each combination of the values of its labels."""
+
+    kind: str = NotImplemented
+    """The type of the metric in the Prometheus text format."""
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        self.name: str = name
+        self.documentation: str = documentation
+        self.labels: Tuple[str, ...] = tuple(labels)
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.name}>"
+
+    def _check(self, values: Tuple[str, ...]) -> None:
+        if len(values) != len(self.labels):
+            raise ValueError(f"{self.name} has the labels {self.labels}, but {len(values)} values were passed")
+
+    def _format_labels(self, values: Tuple[str, ...], extra: str = "") -> str:
+        pairs = [f'{label}="{_escape(str(value))}"' for label, value in zip(self.labels, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def samples(self) -> Iterable[str]:
+        """Get the lines of the Prometheus text format with the current values, excluding the comments."""
+        raise NotImplementedError()
+
+    def render(self) -> str:
+        return "\n".join([
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+            *self.samples(),
+        ])
+
+
+class MetricCounter(Metric):
+    """A value that can only increase, such as the number of sent messages."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = ()):
+        super().__init__(name, documentation, labels)
+        self.values: Dict[Tuple[str, ...], float] = collections.defaultdict(float)
+
+    def inc(self, *values: str, amount: float = 1) -> None:
+        """Increase the value with the passed label values by ``amount``."""
+        self._check(values)
+        self.values[values] += amount
+
+    def get(self, *values: str) -> float:
+        return self.values.get(values, 0)
+
+    def samples(self) -> Iterable[str]:
+        for values, value in self.values.items():
+            yield f"{self.name}{self._format_labels(values)} {_format_value(value)}"
+
+
+class MetricGauge(MetricCounter):
+    """A value that can go up and down, such as the number of connected clients."""
+
+    kind = "gauge"
+
+    def set(self, *values: str, value: float) -> None:
+        self._check(values)
+        self.values[values] = value
+
+    def dec(self, *values: str, amount: float = 1) -> None:
+        self.inc(*values, amount=-amount)
+
+
+class MetricHistogram(Metric):
+    """The distribution of a value, such as the duration of a request, counted in buckets."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets: List[float] = sorted(buckets)
+        """The upper bounds of the buckets, excluding the implicit ``+Inf`` one."""
+        self.counts: Dict[Tuple[str, ...], List[int]] = {}
+        """The number of observations in each bucket (not cumulative), with the ``+Inf`` bucket last."""
+        self.sums: Dict[Tuple[str, ...], float] = collections.defaultdict(float)
+
+    def observe(self, *values: str, value: float) -> None:
+        """Add an observation to the distribution with the passed label values."""
+        self._check(values)
+        counts = self.counts.get(values)
+        if counts is None:
+            counts = self.counts[values] = [0] * (len(self.buckets) + 1)
+        counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sums[values] += value
+
+    def count(self, *values: str) -> int:
+        return sum(self.counts.get(values, []))
+
+    def quantile(self, fraction: float, *values: str) -> Optional[float]:
+        """Estimate a quantile of the distribution, returning the upper bound of the bucket it falls into."""
+        counts = self.counts.get(values)
+        if not counts:
+            return None
+        rank = fraction * sum(counts)
+        cumulative = 0
+        for bound, count in zip([*self.buckets, math.inf], counts):
+            cumulative += count
+            if cumulative >= rank:
+                return bound
+        return math.inf
+
+    def samples(self) -> Iterable[str]:
+        for values, counts in self.counts.items():
+            cumulative = 0
+            for bound, count in zip([*self.buckets, math.inf], counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{self._format_labels(values, le)} {cumulative}"
+            yield f"{self.name}_sum{self._format_labels(values)} {_format_value(self.sums[values])}"
+            yield f"{self.name}_count{self._format_labels(values)} {cumulative}"
+
+
+class MetricsRegistry:
+    """A collection of :class:`Metric` that can be exported together in the Prometheus text format."""
+
+    def __init__(self, prefix: str = ""):
+        self.prefix: str = prefix
+        """A string prepended to the names of all the metrics created through the registry."""
+        self.metrics: Dict[str, Metric] = {}
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {len(self.metrics)} metrics>"
+
+    def _register(self, metric: Metric) -> Metric:
+        if metric.name in self.metrics:
+            raise ValueError(f"A metric named {metric.name} already exists")
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labels: Sequence[str] = ()) -> MetricCounter:
+        return self._register(MetricCounter(f"{self.prefix}{name}", documentation, labels))
+
+    def gauge(self, name: str, documentation: str, labels: Sequence[str] = ()) -> MetricGauge:
+        return self._register(MetricGauge(f"{self.prefix}{name}", documentation, labels))
+
+    def histogram(self, name: str, documentation: str, labels: Sequence[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> MetricHistogram:
+        return self._register(MetricHistogram(f"{self.prefix}{name}", documentation, labels, buckets))
+
+    def render(self) -> str:
+        """Export all the metrics in the Prometheus text format."""
+        return "".join(f"{metric.render()}\n" for metric in self.metrics.values())
@@ -0,0 +1,70 @@
+import importlib
+import logging
+import sys
+import traceback
+from types import ModuleType
+from typing import *
+
+log = logging.getLogger(__name__)
+
+
+class Pack:
+    """The manifest of a pack, listing its commands, events, stars and tables.
+
+    Each part of the pack is imported only when it's first needed, so that a process doesn't pay for the parts it
+    never uses, such as the stars in a serf."""
+
+    def __init__(self, name: str):
+        self.name: str = name
+        """The name of the package of the pack."""
+
+        self._modules: Dict[str, Optional[ModuleType]] = {}
+        """The parts of the pack imported so far, or :const:`None` if their import failed."""
+
+    def __repr__(self):
+        imported = [part for part, module in self._modules.items() if module is not None]
+        return f"<{self.__class__.__qualname__} {self.name}: {', '.join(imported) or 'nothing'} imported>"
+
+    @classmethod
+    def from_config(cls, packs_cfg: Dict[str, Any]) -> List["Pack"]:
+        """Get the manifests of the active packs, without importing anything."""
+        return [cls(pack_name) for pack_name in packs_cfg["active"]]
+
+    def module(self, part: str) -> Optional[ModuleType]:
+        """Import a part of the pack, such as ``commands``, if it wasn't imported yet."""
+        if part not in self._modules:
+            log.debug(f"Importing pack part: {self.name}.{part}")
+            try:
+                self._modules[part] = importlib.import_module(f".{part}", self.name)
+            except ImportError as e:
+                log.error(f"{e.__class__.__name__} during the import of {self.name}.{part}:\n"
+                          f"{''.join(traceback.format_exception(*sys.exc_info()))}")
+                self._modules[part] = None
+        return self._modules[part]
+
+    def available(self, part: str, attribute: str) -> List[type]:
+        """Get the list of classes a part of the pack makes available, importing it if needed."""
+        module = self.module(part)
+        if module is None:
+            return []
+        try:
+            return getattr(module, attribute)
+        except AttributeError:
+            log.warning(f"Pack `{self.name}` does not have the `{attribute}` attribute.")
+            return []
+
+    @property
+    def commands(self) -> List[type]:
+        return self.available("commands", "available_commands")
+
+    @property
+    def events(self) -> List[type]:
+        return self.available("events", "available_events")
+
+    @property
+    def page_stars(self) -> List[type]:
+        return self.available("stars", "available_page_stars")
+
+    @property
+    def tables(self) -> List[type]:
+        return self.available("tables", "available_tables")
@@ -0,0 +1,47 @@
+import asyncio as aio
+import copy
+import json
+import logging
+from typing import *
+
+log = logging.getLogger(__name__)
+
+
+class SingleFlight:
+    """Collapse identical calls running at the same time into a single one, giving its result to all the callers.
+
+    Every caller after the first one gets a deep copy of the result, so that it can be safely modified."""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, aio.Future] = {}
+        self.coalesced: int = 0
+        """The number of calls that waited for the result of another one instead of running."""
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {len(self._calls)} running>"
+
+    @staticmethod
+    def key(*args) -> Optional[str]:
+        """Get a canonical key for a call with these arguments, the same for equal :class:`dict` in any order.
+
+        Returns:
+            The key, or :const:`None` if the arguments can't be serialized to JSON."""
+        try:
+            return json.dumps(args, sort_keys=True, separators=(",", ":"))
+        except (TypeError, ValueError):
+            return None
+
+    async def run(self, key: Hashable, function: Callable[..., Awaitable[Any]], *args, **kwargs) -> Any:
+        """Await ``function(*args, **kwargs)``, unless a call with the same key is already running: in that case,
+        wait for its result instead.
+
+        The call is shielded, so that cancelling one of the callers doesn't cancel it for the others."""
+        future = self._calls.get(key)
+        if future is not None:
+            self.coalesced += 1
+            log.debug(f"Joining running call: {key}")
+            return copy.deepcopy(await aio.shield(future))
+        future = aio.ensure_future(function(*args, **kwargs))
+        self._calls[key] = future
+        future.add_done_callback(lambda _: self._calls.pop(key, None))
+        return await aio.shield(future)
@@ -1,4 +1,5 @@
 import asyncio as aio
+import heapq
 import logging
 from typing import *
 
@@ -8,25 +9,44 @@ log = logging.getLogger(__name__)
 
 
 class TaskList:
+    """A registry of the running tasks, from which the tasks remove themselves when they are done.
+
+    The errors of the tasks are reported as soon as they end."""
+
     def __init__(self, loop: aio.AbstractEventLoop):
         self.loop: aio.AbstractEventLoop = loop
-        self.tasks: List[aio.Task] = []
-
-    def collect(self):
-        """Remove finished tasks from the list."""
-        log.debug(f"Collecting done tasks")
-        new_list = []
-        for task in self.tasks:
-            try:
-                task.result()
-            except aio.CancelledError:
-                log.warning(f"Task {task} was unexpectedly cancelled.")
-            except aio.InvalidStateError:
-                log.debug(f"Task {task} hasn't finished running yet, readding it to the list.")
-                new_list.append(task)
-            except Exception as err:
-                sentry_exc(err)
-        self.tasks = new_list
+        self.tasks: Dict[aio.Task, float] = {}
+        """The running tasks, each with the :meth:`~asyncio.AbstractEventLoop.time` it was started at."""
+
+        self.completed: int = 0
+        """The number of tasks that returned successfully."""
+
+        self.failed: int = 0
+        """The number of tasks that raised an exception, including the ones that timed out."""
+
+        self.cancelled: int = 0
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {len(self.tasks)} running>"
+
+    def __len__(self):
+        return len(self.tasks)
+
+    def __contains__(self, task: aio.Task):
+        return task in self.tasks
+
+    def _done(self, task: aio.Task) -> None:
+        self.tasks.pop(task, None)
+        try:
+            task.result()
+        except aio.CancelledError:
+            log.warning(f"Task {task} was unexpectedly cancelled.")
+            self.cancelled += 1
+        except Exception as err:
+            self.failed += 1
+            sentry_exc(err)
+        else:
+            self.completed += 1
 
     def add(self, coroutine: Awaitable[Any], timeout: float = None) -> aio.Task:
         """Add a new task to the list; the task will be cancelled if ``timeout`` seconds pass."""
@@ -35,5 +55,23 @@ class TaskList:
             task = self.loop.create_task(aio.wait_for(coroutine, timeout=timeout))
         else:
             task = self.loop.create_task(coroutine)
-        self.tasks.append(task)
+        self.tasks[task] = self.loop.time()
+        task.add_done_callback(self._done)
         return task
+
+    def oldest(self, count: int = 5) -> List[Tuple[aio.Task, float]]:
+        """Get the ``count`` tasks that have been running for the longest time, and their age in seconds."""
+        now = self.loop.time()
+        return [(task, now - started)
+                for task, started in heapq.nsmallest(count, self.tasks.items(), key=lambda item: item[1])]
+
+    def stats(self) -> Dict[str, float]:
+        """Get the number of running and ended tasks, and the age in seconds of the oldest running one."""
+        oldest = self.oldest(1)
+        return {
+            "running": len(self.tasks),
+            "completed": self.completed,
+            "failed": self.failed,
+            "cancelled": self.cancelled,
+            "oldest_age": oldest[0][1] if oldest else 0.0,
+        }
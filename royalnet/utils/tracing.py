@@ -0,0 +1,79 @@
+import collections
+import contextlib
+import contextvars
+import time
+from typing import *
+
+_current_trace: contextvars.ContextVar = contextvars.ContextVar("royalnet_trace", default=None)
+
+
+class Trace:
+    """The time spent by a single invocation, such as a command call, and by its phases.
+
+    The phases are measured with :func:`trace_phase` by the code running while the trace is active; they may overlap,
+    such as an API call running in an executor."""
+
+    def __init__(self, kind: str, name: str):
+        self.kind: str = kind
+        self.name: str = name
+        self.started: float = time.perf_counter()
+        self.duration: Optional[float] = None
+        """The number of seconds the invocation took, or :const:`None` if it's still running."""
+        self.phases: Dict[str, float] = collections.defaultdict(float)
+        """The total number of seconds spent in each phase."""
+        self.error: Optional[str] = None
+        """The name of the exception raised by the invocation, if any."""
+        self._last_mark: float = self.started
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {self.kind} {self.name}>"
+
+    def mark(self, phase: str) -> None:
+        """Add the time passed since the previous mark (or the creation of the trace) to a phase, for invocations
+        made of consecutive phases, such as the startup of a process."""
+        now = time.perf_counter()
+        self.phases[phase] += now - self._last_mark
+        self._last_mark = now
+        self.duration = now - self.started
+
+    @contextlib.contextmanager
+    def activate(self) -> Iterator["Trace"]:
+        """Make this the trace the phases are added to, until the context manager exits."""
+        previous = _current_trace.get()
+        _current_trace.set(self)
+        try:
+            yield self
+        except Exception as error:
+            self.error = error.__class__.__qualname__
+            raise
+        finally:
+            self.duration = time.perf_counter() - self.started
+            _current_trace.set(previous)
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "kind": self.kind,
+            "name": self.name,
+            "duration": self.duration,
+            "phases": dict(self.phases),
+            "error": self.error,
+        }
+
+
+def current_trace() -> Optional[Trace]:
+    """Get the active :class:`Trace`, if any."""
+    return _current_trace.get()
+
+
+@contextlib.contextmanager
+def trace_phase(phase: str) -> Iterator[None]:
+    """Add the time spent inside the context manager to a phase of the active :class:`Trace`, if any."""
+    trace = _current_trace.get()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.phases[phase] += time.perf_counter() - start
@@ -0,0 +1,61 @@
+import collections
+import time
+from typing import *
+
+
+class TTLCache:
+    """A mapping that forgets its items ``ttl`` seconds after they were set, and its least recently used items when
+    it contains more than ``maxsize`` of them."""
+
+    def __init__(self, maxsize: int, ttl: float, timer: Callable[[], float] = time.monotonic):
+        if maxsize < 1:
+            raise ValueError("maxsize must be at least 1")
+        self.maxsize: int = maxsize
+        self.ttl: float = ttl
+        self.timer: Callable[[], float] = timer
+        self._items: "collections.OrderedDict[Hashable, Tuple[float, Any]]" = collections.OrderedDict()
+
+    def __repr__(self):
+        return f"<{self.__class__.__qualname__} {len(self._items)}/{self.maxsize}>"
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+    def __contains__(self, key: Hashable) -> bool:
+        try:
+            self[key]
+        except KeyError:
+            return False
+        return True
+
+    def __getitem__(self, key: Hashable) -> Any:
+        expiration, value = self._items[key]
+        if expiration <= self.timer():
+            del self._items[key]
+            raise KeyError(key)
+        self._items.move_to_end(key)
+        return value
+
+    def __setitem__(self, key: Hashable, value: Any) -> None:
+        self._items[key] = (self.timer() + self.ttl, value)
+        self._items.move_to_end(key)
+        while len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove an item, returning its value if it was still valid."""
+        try:
+            value = self[key]
+        except KeyError:
+            return default
+        del self._items[key]
+        return value
+
+    def clear(self) -> None:
+        self._items.clear()
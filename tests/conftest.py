@@ -0,0 +1,80 @@
+import asyncio as aio
+import socket
+from typing import *
+
+import pytest
+
+import royalnet.herald as rh
+from royalnet.herald.server import ConnectedClient
+
+
+@pytest.fixture
+def loop() -> aio.AbstractEventLoop:
+    """A new event loop, set as the current one for the duration of the test."""
+    loop = aio.new_event_loop()
+    aio.set_event_loop(loop)
+    yield loop
+    # Stop the tasks left running by the test, such as the ones of a Link or a Server
+    pending = aio.all_tasks(loop)
+    for task in pending:
+        task.cancel()
+    loop.run_until_complete(aio.gather(*pending, return_exceptions=True))
+    loop.close()
+    aio.set_event_loop(None)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Herald:
+    """A :class:`Server` running in the event loop of a test, to which :class:`Link` can be connected."""
+
+    def __init__(self, loop: aio.AbstractEventLoop, **kwargs):
+        self.loop: aio.AbstractEventLoop = loop
+        self.config: rh.Config = rh.Config(name="<server>", address="127.0.0.1", port=free_port(), secret="test",
+                                           **kwargs)
+        self.server: rh.Server = rh.Server(self.config, loop=loop)
+        self.tasks: Dict[rh.Link, aio.Task] = {}
+        """The tasks running the connected :class:`Link`."""
+
+    async def start(self) -> "Herald":
+        await self.server.run()
+        return self
+
+    async def link(self, name: str, handler, **kwargs) -> rh.Link:
+        """Connect a new :class:`Link`, waiting until it is identified."""
+        link = rh.Link(self.config.copy(name=name), handler, loop=self.loop, **kwargs)
+        self.tasks[link] = self.loop.create_task(link.run())
+        await aio.wait_for(link.identify_event.wait(), timeout=5)
+        return link
+
+    async def unlink(self, link: rh.Link) -> None:
+        """Stop a :class:`Link` and close its connection, so that it leaves the server."""
+        self.tasks.pop(link).cancel()
+        await link.websocket.close()
+
+
+@pytest.fixture
+def herald(loop) -> Herald:
+    """A :class:`Herald` with the default configuration, already started."""
+    return loop.run_until_complete(Herald(loop).start())
+
+
+@pytest.fixture
+def server(loop, tmp_path) -> rh.Server:
+    """A :class:`Server` that isn't listening for connections, to which clients can be added with :func:`connect`."""
+    config = rh.Config(name="<server>", address="127.0.0.1", port=44444, secret="test", outbox_path=str(tmp_path))
+    return rh.Server(config, loop=loop)
+
+
+def connect(server: rh.Server, nid: str, link_type: str) -> ConnectedClient:
+    """Add to a :class:`Server` a client without a socket, whose packages stay in its outbox."""
+    client = ConnectedClient(None)
+    client.nid = nid
+    client.link_type = link_type
+    client.features = {"ack"}
+    server.add_client(client)
+    return client
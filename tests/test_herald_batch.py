@@ -0,0 +1,39 @@
+import pytest
+
+import royalnet.herald as rh
+
+
+def unpack(b: bytes):
+    return [bytes(frame) for frame in rh.unpack_batch(b)]
+
+
+@pytest.mark.parametrize("frames", [
+    [b"{}"],
+    [b"{}", b"\x02\x00\x00"],
+    # Frames may contain the batch marker, and even be empty
+    [b"\x00\x00\x00", b"", b"\x00"],
+    [b"x" * 100000, b"y"],
+], ids=["single", "multiple", "marker", "large"])
+def test_round_trip(frames):
+    assert unpack(rh.pack_batch(frames)) == frames
+
+
+def test_empty_batch():
+    assert rh.pack_batch([]) == b"\x00"
+    assert unpack(rh.pack_batch([])) == []
+
+
+@pytest.mark.parametrize("frame", [b'{"source": {}}', b"\x02\x05"], ids=["json", "msgpack"])
+def test_not_a_batch(frame: bytes):
+    assert unpack(frame) == [frame]
+
+
+def test_empty_frame():
+    assert unpack(b"") == [b""]
+
+
+def test_packages_in_batch():
+    codec = rh.JSONCodec()
+    packages = [rh.Package({"n": n}, source="a", destination="b") for n in range(3)]
+    frames = rh.unpack_batch(rh.pack_batch([codec.dumps(package) for package in packages]))
+    assert [codec.loads(bytes(frame)) for frame in frames] == packages
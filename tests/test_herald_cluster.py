@@ -0,0 +1,64 @@
+import asyncio as aio
+
+import royalnet.herald as rh
+from conftest import Herald
+
+
+async def echo(message):
+    return rh.ResponseSuccess(message.data)
+
+
+async def wait_for(condition, timeout: float = 5) -> None:
+    async def poll():
+        while not condition():
+            await aio.sleep(0.01)
+
+    await aio.wait_for(poll(), timeout=timeout)
+
+
+def test_cluster(loop):
+    first = Herald(loop)
+    second = Herald(loop, peers=[first.config.url])
+
+    async def main():
+        await first.start()
+        await second.start()
+        await wait_for(lambda: first.server.peers and second.server.peers)
+        echo_link = await first.link("echo", echo)
+        caller = await second.link("caller", echo)
+        await wait_for(lambda: "echo" in second.server.remote_link_types)
+        # Requests are routed to the clients of the other server, and the responses back
+        response = await caller.request("echo", rh.Request("test", {"n": 1}), timeout=5)
+        assert response.data == {"n": 1}
+        response = await echo_link.request("caller", rh.Request("test", {"n": 2}), timeout=5)
+        assert response.data == {"n": 2}
+        # The other server forgets the clients that leave
+        await first.unlink(echo_link)
+        await wait_for(lambda: "echo" not in second.server.remote_link_types)
+        assert echo_link.nid not in second.server.remote_clients
+
+    loop.run_until_complete(main())
+
+
+def test_peer_leaves_and_reconnects(loop):
+    first = Herald(loop)
+    second = Herald(loop, peers=[first.config.url], reconnect_min_delay=0.01)
+
+    async def main():
+        await first.start()
+        await second.start()
+        caller = await second.link("caller", echo)
+        await wait_for(lambda: caller.nid in first.server.remote_clients)
+        # The server forgets the clients of a peer as soon as the connection with it is lost
+        (peer,) = first.server.peers.values()
+        first.server.evict(peer.connections[0])
+        assert not first.server.peers
+        assert caller.nid not in first.server.remote_clients
+        # The peer that dialed the connection opens it again, and tells the server about its clients
+        await wait_for(lambda: caller.nid in first.server.remote_clients)
+        echo_link = await first.link("echo", echo)
+        await wait_for(lambda: "echo" in second.server.remote_link_types)
+        response = await caller.request("echo", rh.Request("test", {"n": 1}), timeout=5)
+        assert response.data == {"n": 1}
+
+    loop.run_until_complete(main())
@@ -0,0 +1,98 @@
+import uuid
+
+import pytest
+
+import royalnet.herald as rh
+
+pytest.importorskip("msgpack")
+
+CODECS = [rh.JSONCodec(), rh.MsgpackCodec()]
+
+
+def package(**kwargs) -> rh.Package:
+    defaults = {
+        "source": str(uuid.uuid4()),
+        "destination": "discord",
+        "source_conv_id": str(uuid.uuid4()),
+        "destination_conv_id": None,
+    }
+    defaults.update(kwargs)
+    return rh.Package({"msg_type": "Request", "handler": "test", "data": {"text": "àèìòù", "list": [1, 2.5, None]}},
+                      **defaults)
+
+
+@pytest.mark.parametrize("codec", CODECS, ids=lambda codec: codec.name)
+@pytest.mark.parametrize("kwargs", [
+    {},
+    {"priority": 255},
+    {"destination": "#topic.*", "destination_conv_id": str(uuid.uuid4())},
+    {"source": "<server>", "destination": "*"},
+    # Strings as long as a UUID, that aren't one
+    {"source": "x" * 36, "destination": str(uuid.uuid4()).upper()},
+], ids=["default", "priority", "reply", "server", "not_uuid"])
+def test_round_trip(codec: rh.Codec, kwargs: dict):
+    original = package(**kwargs)
+    assert codec.loads(codec.dumps(original)) == original
+
+
+@pytest.mark.parametrize("codec", CODECS, ids=lambda codec: codec.name)
+def test_destination_override(codec: rh.Codec):
+    original = package()
+    decoded = codec.loads(codec.dumps(original, destination="telegram"))
+    assert decoded.destination == "telegram"
+    assert decoded.data == original.data
+
+
+def test_msgpack_unpack_keeps_data_encoded():
+    codec = rh.MsgpackCodec()
+    original = package(priority=3)
+    envelope = codec.unpack(codec.dumps(original))
+    assert envelope.source == original.source
+    assert envelope.priority == 3
+    assert envelope._data is None
+    assert envelope.data == original.data
+
+
+def test_msgpack_unknown_version():
+    codec = rh.MsgpackCodec()
+    raw = bytearray(codec.dumps(package()))
+    raw[0] = codec.version + 1
+    with pytest.raises(ValueError):
+        codec.unpack(bytes(raw))
+
+
+def test_json_is_plain_json():
+    original = package(priority=2)
+    assert rh.Package.from_json_bytes(rh.JSONCodec().dumps(original)) == original
+    assert rh.JSONCodec().loads(original.to_json_bytes()) == original
+
+
+@pytest.mark.parametrize("size, compressed", [(10, False), (1000, True)])
+def test_compression_threshold(size: int, compressed: bool):
+    codec = rh.MsgpackCodec(compression_threshold=100)
+    data = {"text": "a" * size}
+    encoded = codec.dumps_data(data)
+    assert bool(encoded[0] & 0b00000001) == compressed
+    if compressed:
+        assert len(encoded) < size
+    assert codec.loads_data(encoded) == data
+
+
+def test_compression_disabled():
+    codec = rh.MsgpackCodec(compression_threshold=None)
+    data = {"text": "a" * 100000}
+    encoded = codec.dumps_data(data)
+    assert not encoded[0] & 0b00000001
+    assert codec.loads_data(encoded) == data
+
+
+def test_compressed_packages_are_understood_by_any_threshold():
+    original = package()
+    original.data["text"] = "a" * 1000
+    assert rh.MsgpackCodec().loads(rh.MsgpackCodec(compression_threshold=1).dumps(original)) == original
+
+
+def test_available_codecs():
+    codecs = rh.available_codecs(compression_threshold=123)
+    assert list(codecs) == [rh.MsgpackCodec.name, rh.JSONCodec.name]
+    assert codecs[rh.MsgpackCodec.name].compression_threshold == 123
@@ -0,0 +1,52 @@
+import pytest
+
+import royalnet.herald as rh
+
+pytest.importorskip("msgpack")
+
+
+def broadcast_package(**kwargs) -> rh.Package:
+    return rh.Package(rh.Broadcast("test", {"n": 1}).to_dict(), source="sender", destination="discord", **kwargs)
+
+
+def test_forward_without_decoding():
+    codec = rh.MsgpackCodec()
+    raw = codec.dumps(broadcast_package())
+    envelope = codec.unpack(raw)
+    forwarded = codec.dumps(envelope, destination="receiver")
+    # The data bytes are copied as they are, after the new header
+    assert forwarded.endswith(bytes(envelope.encoded_data(codec)))
+    assert envelope._data is None
+    assert codec.loads(forwarded).destination == "receiver"
+
+
+def test_encode_once_per_codec():
+    msgpack_codec, json_codec = rh.MsgpackCodec(), rh.JSONCodec()
+    envelope = msgpack_codec.unpack(msgpack_codec.dumps(broadcast_package()))
+    first = envelope.encoded_data(json_codec)
+    assert envelope.encoded_data(json_codec) is first
+    assert json_codec.loads(json_codec.dumps(envelope)).data == broadcast_package().data
+
+
+def test_from_package():
+    original = broadcast_package(priority=7)
+    envelope = rh.Envelope.from_package(original)
+    assert envelope.codec is None
+    assert envelope.to_package() == original
+
+
+@pytest.mark.parametrize("codec", [rh.MsgpackCodec(), rh.MsgpackCodec(compression_threshold=0), rh.JSONCodec()],
+                         ids=["msgpack", "msgpack_compressed", "json"])
+def test_is_broadcast(codec: rh.Codec):
+    broadcast = codec.unpack(codec.dumps(broadcast_package()))
+    request = codec.unpack(codec.dumps(rh.Package(rh.Request("test", {}).to_dict(), source="a", destination="b")))
+    assert broadcast.is_broadcast
+    assert not request.is_broadcast
+    if isinstance(codec, rh.MsgpackCodec):
+        assert broadcast._data is None
+        assert request._data is None
+
+
+def test_missing_data():
+    with pytest.raises(ValueError):
+        rh.Envelope(source="a", destination="b", source_conv_id=None, destination_conv_id=None)
@@ -0,0 +1,166 @@
+import asyncio as aio
+
+import pytest
+
+import royalnet.herald as rh
+from conftest import Herald
+
+
+async def echo(message):
+    return rh.ResponseSuccess(message.data)
+
+
+def test_handler_exception(loop, herald: Herald):
+    async def failing(message):
+        raise ValueError("failed")
+
+    async def main():
+        await herald.link("failing", failing)
+        caller = await herald.link("caller", echo)
+        return await caller.request("failing", rh.Request("test", {}), timeout=5)
+
+    response = loop.run_until_complete(main())
+    assert isinstance(response, rh.ResponseFailure)
+    assert response.name == "exception_in_handler"
+    assert response.extra_info == {"type": "ValueError", "message": "failed"}
+
+
+def test_responses_are_received_while_the_handlers_are_busy(loop):
+    """A handler waiting for the response to its own request doesn't block the Link, even if all the slots are full."""
+    herald = Herald(loop, max_running_handlers=1, max_queued_handlers=1)
+    links = {}
+
+    async def nested(message):
+        return await links["nested"].request("echo", rh.Request("test", message.data), timeout=5)
+
+    async def main():
+        await herald.start()
+        links["nested"] = await herald.link("nested", nested)
+        await herald.link("echo", echo)
+        caller = await herald.link("caller", echo)
+        return await aio.gather(*[caller.request("nested", rh.Request("test", {"n": n}), timeout=5)
+                                  for n in range(4)])
+
+    responses = loop.run_until_complete(main())
+    assert [response.data for response in responses] == [{"n": n} for n in range(4)]
+
+
+def test_undecodable_package_is_dropped(loop, herald: Herald):
+    async def main():
+        receiver = await herald.link("receiver", echo)
+        caller = await herald.link("caller", echo)
+        assert receiver.codec.name == rh.MsgpackCodec.name
+        # A package encoded with another codec can't be decoded
+        client = herald.server.identified_clients[receiver.nid]
+        client.enqueue(rh.JSONCodec().dumps(rh.Package({}, source="<server>", destination=receiver.nid)), 0)
+        await aio.sleep(0.1)
+        return await caller.request("receiver", rh.Request("test", {"n": 1}), timeout=5)
+
+    assert loop.run_until_complete(main()).data == {"n": 1}
+
+
+def test_stream_chunks_are_in_order(loop, herald: Herald):
+    async def streamer(message):
+        async def chunks():
+            for n in range(50):
+                yield {"n": n}
+
+        return rh.ResponseStream(chunks())
+
+    request = rh.Request("test", {})
+
+    async def main():
+        await herald.link("streamer", streamer)
+        caller = await herald.link("caller", echo)
+        return [chunk["n"] async for chunk in caller.request_stream("streamer", request, window=4, timeout=5)]
+
+    assert loop.run_until_complete(main()) == list(range(50))
+    # The request of the caller is left as it was
+    assert request.stream is None
+
+
+def test_stream_window_blocks_the_producer(loop, herald: Herald):
+    produced = []
+
+    async def streamer(message):
+        async def chunks():
+            for n in range(20):
+                produced.append(n)
+                yield {"n": n}
+
+        return rh.ResponseStream(chunks())
+
+    async def main():
+        await herald.link("streamer", streamer)
+        caller = await herald.link("caller", echo)
+        stream = caller.request_stream("streamer", rh.Request("test", {}), window=4, timeout=5)
+        assert await stream.__anext__() == {"n": 0}
+        await aio.sleep(0.2)
+        # Four chunks were sent, and the next one is waiting for credit
+        assert len(produced) == 5
+        received = [chunk["n"] async for chunk in stream]
+        assert received == list(range(1, 20))
+
+    loop.run_until_complete(main())
+
+
+def test_stream_cancellation_releases_the_producer(loop, herald: Herald):
+    closed = []
+
+    async def streamer(message):
+        async def chunks():
+            try:
+                n = 0
+                while True:
+                    yield {"n": n}
+                    n += 1
+            finally:
+                closed.append(None)
+
+        return rh.ResponseStream(chunks())
+
+    async def main():
+        producer = await herald.link("streamer", streamer)
+        caller = await herald.link("caller", echo)
+        stream = caller.request_stream("streamer", rh.Request("test", {}), window=4, timeout=5)
+        assert await stream.__anext__() == {"n": 0}
+        assert len(producer._outgoing_streams) == 1
+        await stream.aclose()
+        await aio.sleep(0.2)
+        assert producer._outgoing_streams == {}
+        assert caller._pending_streams == {}
+
+    loop.run_until_complete(main())
+    assert closed == [None]
+
+
+async def slow(message):
+    await aio.sleep(message.data["delay"])
+    return rh.ResponseSuccess(message.data)
+
+
+def test_request_timeout(loop, herald: Herald):
+    async def main():
+        await herald.link("slow", slow)
+        caller = await herald.link("caller", echo)
+        with pytest.raises(rh.RequestTimeoutError):
+            await caller.request("slow", rh.Request("test", {"delay": 1}), timeout=0.1)
+        return caller
+
+    caller = loop.run_until_complete(main())
+    assert caller._pending_requests == {}
+    assert caller.request_errors.get("slow", "test", "timeout") == 1
+
+
+def test_late_response_is_dropped(loop, herald: Herald):
+    async def main():
+        await herald.link("slow", slow)
+        caller = await herald.link("caller", echo)
+        with pytest.raises(rh.RequestTimeoutError):
+            await caller.request("slow", rh.Request("test", {"delay": 0.2, "n": 1}), timeout=0.1)
+        # The response to the first request arrives while the second one is waiting
+        return await caller.request("slow", rh.Request("test", {"delay": 0.3, "n": 2}), timeout=5), caller
+
+    response, caller = loop.run_until_complete(main())
+    assert response.data == {"delay": 0.3, "n": 2}
+    assert caller._pending_requests == {}
@@ -0,0 +1,174 @@
+import asyncio as aio
+import os
+
+import royalnet.herald as rh
+from royalnet.herald.outbox import DurableOutbox
+from conftest import Herald, connect
+
+
+def broadcast(n: int, *, destination: str = "serf", priority: int = 0) -> rh.Package:
+    return rh.Package(rh.Broadcast("test", {"n": n}).to_dict(), source="sender", destination=destination,
+                      priority=priority)
+
+
+def test_append_and_read(tmp_path):
+    outbox = DurableOutbox(str(tmp_path), "serf", max_bytes=1024)
+    assert outbox.read() == []
+    assert outbox.append(b"first")
+    assert outbox.append(b"second")
+    assert outbox.read() == [b"first", b"second"]
+    # The outbox survives a restart
+    assert DurableOutbox(str(tmp_path), "serf", max_bytes=1024).read() == [b"first", b"second"]
+
+
+def test_discard(tmp_path):
+    outbox = DurableOutbox(str(tmp_path), "serf", max_bytes=1024)
+    for raw in (b"a", b"b", b"c"):
+        outbox.append(raw)
+    outbox.discard(2)
+    assert outbox.read() == [b"c"]
+    assert outbox.size == os.path.getsize(outbox.path)
+
+
+def test_max_bytes(tmp_path):
+    outbox = DurableOutbox(str(tmp_path), "serf", max_bytes=20)
+    assert outbox.append(b"x" * 10)
+    assert not outbox.append(b"x" * 10)
+    assert outbox.read() == [b"x" * 10]
+
+
+def test_truncated_record(tmp_path):
+    outbox = DurableOutbox(str(tmp_path), "serf", max_bytes=1024)
+    outbox.append(b"complete")
+    with open(outbox.path, "ab") as file:
+        file.write(b"\x00\x00\x00\x10trunc")
+    assert outbox.read() == [b"complete"]
+    # Reopening the outbox removes the truncated record, so that the ones appended later can be read
+    reopened = DurableOutbox(str(tmp_path), "serf", max_bytes=1024)
+    reopened.append(b"later")
+    assert reopened.read() == [b"complete", b"later"]
+
+
+def test_load_all(tmp_path):
+    directory = str(tmp_path / "outbox")
+    assert DurableOutbox.load_all(directory, max_bytes=1024) == {}
+    for link_type in ("serf", "a/b c"):
+        DurableOutbox(directory, link_type, max_bytes=1024).create()
+    outboxes = DurableOutbox.load_all(directory, max_bytes=1024)
+    assert set(outboxes) == {"serf", "a/b c"}
+
+
+def test_store_only_broadcasts(server: rh.Server):
+    server.remove_client(connect(server, "serf-1", "serf"))
+    codec = rh.MsgpackCodec()
+    assert server.store(codec.unpack(codec.dumps(broadcast(1))))
+    request = rh.Package(rh.Request("test", {}).to_dict(), source="sender", destination="serf")
+    assert not server.store(codec.unpack(codec.dumps(request)))
+    # Link types that are connected get the packages directly
+    connect(server, "serf-2", "serf")
+    assert not server.store(broadcast(2))
+    assert len(server.outboxes["serf"].read()) == 1
+
+
+def test_store_keeps_data_encoded(server: rh.Server):
+    server.remove_client(connect(server, "serf-1", "serf"))
+    codec = rh.MsgpackCodec(compression_threshold=0)
+    envelope = codec.unpack(codec.dumps(broadcast(1)))
+    assert server.store(envelope)
+    assert envelope._data is None
+    assert server.outboxes["serf"].read() == [codec.dumps(envelope)]
+
+
+def test_replay_and_ack(loop, server: rh.Server):
+    server.remove_client(connect(server, "serf-1", "serf"))
+    for n, priority in enumerate((0, 5, 0, 0, 0, 0)):
+        server.store(broadcast(n, priority=priority))
+    client = connect(server, "serf-2", "serf")
+    loop.run_until_complete(server.replay(client))
+    received = [client.codec.loads(client.outbox.get_nowait()) for _ in range(client.outbox.qsize())]
+    # The marker comes after all the stored packages, even if some of them have a priority
+    assert [package.data.get("data", {}).get("n") for package in received[:-1]] == list(range(6))
+    assert all(package.destination == "serf-2" for package in received)
+    assert received[-1].data == {"type": "replayed", "count": 6}
+    # Packages stored after the replay started are kept after the acknowledgement
+    server.remove_client(client)
+    server.store(broadcast(6))
+    server.replaying["serf"] = client
+    server.handle_service(client, {"type": "ack"})
+    assert [rh.MsgpackCodec().loads(raw).data["data"]["n"] for raw in server.outboxes["serf"].read()] == [6]
+    assert "serf" not in server.replaying
+
+
+def test_duplicates_are_dropped(loop, tmp_path):
+    """A link that doesn't acknowledge the stored packages receives them again, but handles them only once."""
+    herald = Herald(loop, outbox_path=str(tmp_path))
+    handled = []
+
+    async def handler(message):
+        if isinstance(message, rh.Broadcast):
+            handled.append(message.data["n"])
+        return rh.ResponseSuccess()
+
+    async def main():
+        DurableOutbox(str(tmp_path), "serf", max_bytes=1024).create()
+        await herald.start()
+        sender = await herald.link("sender", handler)
+        for n in range(3):
+            await sender.broadcast("serf", rh.Broadcast("test", {"n": n}))
+        await aio.sleep(0.1)
+        assert len(herald.server.outboxes["serf"].read()) == 3
+
+        serf = rh.Link(herald.config.copy(name="serf"), handler, loop=loop)
+        original_send = serf.send
+        acknowledged = []
+
+        async def send(package, **kwargs):
+            # Lose the first acknowledgement
+            if package.data.get("type") == "ack" and not acknowledged:
+                acknowledged.append(package)
+                return
+            await original_send(package, **kwargs)
+
+        serf.send = send
+        loop.create_task(serf.run())
+        await aio.wait_for(serf.identify_event.wait(), timeout=5)
+        await aio.sleep(0.2)
+        await serf.websocket.close()
+        await aio.wait_for(serf.identify_event.wait(), timeout=5)
+        await aio.sleep(0.2)
+
+    loop.run_until_complete(main())
+    assert sorted(handled) == [0, 1, 2]
+    assert herald.server.outboxes["serf"].read() == []
+
+
+def test_ack_waits_for_the_handlers(loop, tmp_path):
+    herald = Herald(loop, outbox_path=str(tmp_path))
+    release = aio.Event()
+    handled = []
+
+    async def slow(message):
+        if isinstance(message, rh.Broadcast):
+            await release.wait()
+            handled.append(message.data["n"])
+        return rh.ResponseSuccess()
+
+    async def main():
+        # The server stores the broadcasts for the link types it already has an outbox for
+        DurableOutbox(str(tmp_path), "serf", max_bytes=1024).create()
+        await herald.start()
+        sender = await herald.link("sender", slow)
+        for n in range(2):
+            await sender.broadcast("serf", rh.Broadcast("test", {"n": n}))
+        await aio.sleep(0.1)
+        assert len(herald.server.outboxes["serf"].read()) == 2
+        await herald.link("serf", slow)
+        await aio.sleep(0.2)
+        # The broadcasts were received, but they are still being handled
+        assert len(herald.server.outboxes["serf"].read()) == 2
+        release.set()
+        await aio.sleep(0.2)
+
+    loop.run_until_complete(main())
+    assert sorted(handled) == [0, 1]
+    assert herald.server.outboxes["serf"].read() == []
@@ -0,0 +1,110 @@
+import asyncio as aio
+
+import royalnet.herald as rh
+from royalnet.herald.server import ConnectedClient
+from conftest import Herald, connect
+
+
+async def echo(message):
+    return rh.ResponseSuccess(message.data)
+
+
+class Socket:
+    """A socket that only records if it was closed, and that answers the pings if it is ``responsive``."""
+
+    def __init__(self, loop: aio.AbstractEventLoop, responsive: bool = True):
+        self.loop: aio.AbstractEventLoop = loop
+        self.responsive: bool = responsive
+        self.closed: bool = False
+
+    async def ping(self) -> aio.Future:
+        pong_waiter = self.loop.create_future()
+        if self.responsive:
+            pong_waiter.set_result(None)
+        return pong_waiter
+
+    async def close(self) -> None:
+        self.closed = True
+
+
+def identify(server: rh.Server, client: ConnectedClient, nid: str, link_type: str) -> ConnectedClient:
+    client.nid = nid
+    client.link_type = link_type
+    server.add_client(client)
+    return client
+
+
+def test_codec_is_agreed_before_joining(loop):
+    herald = Herald(loop)
+    codecs = []
+    add_client = herald.server.add_client
+
+    def record(client):
+        codecs.append(client.codec.name)
+        add_client(client)
+
+    herald.server.add_client = record
+
+    async def main():
+        await herald.start()
+        await herald.link("link", echo)
+
+    loop.run_until_complete(main())
+    assert codecs == [rh.MsgpackCodec.name]
+
+
+def test_undecodable_frame_is_rejected(loop, herald: Herald):
+    async def main():
+        await herald.link("receiver", echo)
+        caller = await herald.link("caller", echo)
+        # Neither a valid package nor a valid batch
+        for frame in (b"\x00garbage", rh.JSONCodec().dumps(rh.Package({}, source="caller", destination="receiver")),
+                      b"\xff"):
+            await caller.websocket.send(frame)
+        # The connection is still open
+        return await caller.request("receiver", rh.Request("test", {"n": 1}), timeout=5)
+
+    assert loop.run_until_complete(main()).data == {"n": 1}
+    assert herald.server.errors.get("caller", "unknown", "undecodable") == 3
+
+
+def test_duplicate_nid_closes_the_previous_client(loop, server: rh.Server):
+    previous = identify(server, ConnectedClient(Socket(loop)), "nid", "serf")
+    current = identify(server, ConnectedClient(Socket(loop)), "nid", "serf")
+    loop.run_until_complete(aio.sleep(0))
+    assert previous.socket.closed
+    assert not current.socket.closed
+    assert server.find_client(link_type="serf") == [current]
+    assert server.stats()["joined"] == 2
+    assert server.stats()["left"] == 1
+
+
+def test_heartbeat_evicts_unresponsive_clients(loop, server: rh.Server):
+    server.config.heartbeat_timeout = 0.1
+    alive = identify(server, ConnectedClient(Socket(loop)), "alive", "serf")
+    dead = identify(server, ConnectedClient(Socket(loop, responsive=False)), "dead", "serf")
+    loop.run_until_complete(aio.gather(*[server.check_connection(client) for client in server.connections()]))
+    loop.run_until_complete(aio.sleep(0))
+    assert dead.socket.closed
+    assert not alive.socket.closed
+    assert list(server.identified_clients) == ["alive"]
+    assert server.stats() == {"connected": 1, "peers": 0, "joined": 2, "left": 1, "evicted": 1}
+
+
+def test_routed_and_dropped_counters(loop, server: rh.Server):
+    connect(server, "sender", "sender")
+    receiver = ConnectedClient(None, queue_size=1)
+    identify(server, receiver, "receiver", "serf")
+
+    def broadcast(destination: str) -> rh.Package:
+        return rh.Package(rh.Broadcast("test", {}).to_dict(), source="sender", destination=destination)
+
+    for _ in range(2):
+        loop.run_until_complete(server.route_package(broadcast("serf")))
+    # Nothing is connected to the destination, and its link type has no outbox
+    loop.run_until_complete(server.route_package(broadcast("nobody")))
+    assert server.metrics["routed"] == 2
+    assert server.metrics["dropped"] == 1
+    assert receiver.dropped == 1
+    assert server.errors.get("sender", "serf", "dropped") == 1
+    assert server.errors.get("sender", "unknown", "undeliverable") == 1
@@ -0,0 +1,55 @@
+import pytest
+
+import royalnet.herald as rh
+from royalnet.herald.server import is_pattern
+from conftest import connect
+
+
+def publish(server: rh.Server, topic: str):
+    package = rh.Package(rh.Broadcast(topic, {}).to_dict(), source="sender", destination=f"#{topic}")
+    return {client.nid for client in server.find_destination(package)}
+
+
+@pytest.mark.parametrize("topic, expected", [("news", False), ("news.*", True), ("news.?", True), ("[ab]", True)])
+def test_is_pattern(topic: str, expected: bool):
+    assert is_pattern(topic) is expected
+
+
+def test_exact_and_pattern_subscriptions(server: rh.Server):
+    exact = connect(server, "exact", "telegram")
+    pattern = connect(server, "pattern", "discord")
+    connect(server, "none", "discord")
+    server.handle_service(exact, {"type": "subscribe", "topics": ["news.sports"]})
+    server.handle_service(pattern, {"type": "subscribe", "topics": ["news.*"]})
+    assert publish(server, "news.sports") == {"exact", "pattern"}
+    assert publish(server, "news.weather") == {"pattern"}
+    assert publish(server, "other") == set()
+
+
+def test_unsubscribe(server: rh.Server):
+    client = connect(server, "client", "telegram")
+    server.handle_service(client, {"type": "subscribe", "topics": ["a", "b.*"]})
+    server.handle_service(client, {"type": "unsubscribe", "topics": ["a", "b.*"]})
+    assert publish(server, "a") == set()
+    assert publish(server, "b.c") == set()
+    assert not server.subscribers
+    assert not server.pattern_subscribers
+
+
+def test_disconnection_removes_subscriptions(server: rh.Server):
+    client = connect(server, "client", "telegram")
+    server.handle_service(client, {"type": "subscribe", "topics": ["a", "b.*"]})
+    server.remove_client(client)
+    assert publish(server, "a") == set()
+    assert not server.subscribers
+    assert not server.pattern_subscribers
+
+
+def test_topic_labels(server: rh.Server):
+    exact = connect(server, "exact", "telegram")
+    pattern = connect(server, "pattern", "discord")
+    server.handle_service(exact, {"type": "subscribe", "topics": ["news.sports"]})
+    server.handle_service(pattern, {"type": "subscribe", "topics": ["weather.*"]})
+    assert server.label("#news.sports") == "#news.sports"
+    assert server.label("#weather.rome") == "#weather.rome"
+    assert server.label("#news.weather") == "unknown"
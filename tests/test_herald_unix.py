@@ -0,0 +1,71 @@
+import asyncio as aio
+
+import pytest
+import websockets
+
+from royalnet.herald import UnixConnection
+
+
+@pytest.fixture
+def connections(loop, tmp_path):
+    """A pair of :class:`UnixConnection` connected to each other, the first one being the client."""
+    path = str(tmp_path / "herald.sock")
+    accepted = loop.create_future()
+
+    async def on_connection(reader, writer):
+        accepted.set_result(UnixConnection(reader, writer, path=path))
+
+    async def connect():
+        server = await aio.start_unix_server(on_connection, path=path)
+        client = await UnixConnection.connect(path)
+        return server, client, await accepted
+
+    server, client, other = loop.run_until_complete(connect())
+    yield client, other
+    loop.run_until_complete(client.close())
+    loop.run_until_complete(other.close())
+    server.close()
+    loop.run_until_complete(server.wait_closed())
+
+
+def test_messages(loop, connections):
+    client, other = connections
+
+    async def main():
+        await client.send("text")
+        await client.send(b"\x00binary")
+        await other.send(b"")
+        return await other.recv(), await other.recv(), await client.recv()
+
+    assert loop.run_until_complete(main()) == ("text", b"\x00binary", b"")
+
+
+def test_ping(loop, connections):
+    client, other = connections
+
+    async def main():
+        waiter = await client.ping()
+        # The pong is sent by the other side while it receives, and handled by this side while it receives
+        other_recv = loop.create_task(other.recv())
+        client_recv = loop.create_task(client.recv())
+        await aio.wait_for(waiter, timeout=1)
+        await other.send("done")
+        assert await client_recv == "done"
+        other_recv.cancel()
+
+    loop.run_until_complete(main())
+
+
+def test_close(loop, connections):
+    client, other = connections
+
+    async def main():
+        await client.close()
+        with pytest.raises(websockets.ConnectionClosedOK):
+            await other.recv()
+        with pytest.raises(websockets.ConnectionClosed):
+            await client.send("too late")
+
+    loop.run_until_complete(main())
+    assert client.closed
+    assert other.closed
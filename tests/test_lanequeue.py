@@ -0,0 +1,68 @@
+import asyncio as aio
+
+import pytest
+
+import royalnet.utils as ru
+
+
+def drain(queue: ru.LaneQueue) -> list:
+    items = []
+    while not queue.empty():
+        items.append(queue.get_nowait())
+    return items
+
+
+def test_lane_ratio(loop):
+    queue = ru.LaneQueue()
+    for n in range(10):
+        queue.put_nowait((1, f"p{n}"))
+    for n in range(3):
+        queue.put_nowait((0, f"b{n}"))
+    assert queue.lengths() == (10, 3)
+    assert queue.qsize() == 13
+    assert drain(queue) == ["p0", "p1", "p2", "p3", "b0",
+                            "p4", "p5", "p6", "p7", "b1",
+                            "p8", "p9", "b2"]
+
+
+def test_custom_weight(loop):
+    queue = ru.LaneQueue(weight=1)
+    for n in range(3):
+        queue.put_nowait((0, f"b{n}"))
+        queue.put_nowait((255, f"p{n}"))
+    assert drain(queue) == ["p0", "b0", "p1", "b1", "p2", "b2"]
+
+
+def test_single_lane_keeps_order(loop):
+    queue = ru.LaneQueue()
+    for n in range(6):
+        queue.put_nowait((0, n))
+    assert drain(queue) == list(range(6))
+    for n in range(6):
+        queue.put_nowait((n + 1, n))
+    assert drain(queue) == list(range(6))
+
+
+def test_maxsize(loop):
+    queue = ru.LaneQueue(maxsize=2)
+    queue.put_nowait((1, "p"))
+    queue.put_nowait((0, "b"))
+    assert queue.full()
+    with pytest.raises(aio.QueueFull):
+        queue.put_nowait((1, "dropped"))
+
+
+def test_get_waits_for_items(loop):
+    queue = ru.LaneQueue()
+
+    async def main():
+        getter = loop.create_task(queue.get())
+        await queue.put((0, "item"))
+        return await getter
+
+    assert loop.run_until_complete(main()) == "item"
+
+
+def test_invalid_weight():
+    with pytest.raises(ValueError):
+        ru.LaneQueue(weight=0)
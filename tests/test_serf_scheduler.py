@@ -0,0 +1,100 @@
+import asyncio as aio
+
+import pytest
+
+import royalnet.utils as ru
+from royalnet.serf import CommandScheduler
+
+
+@pytest.fixture
+def scheduler(loop) -> CommandScheduler:
+    return CommandScheduler(ru.TaskList(loop), max_concurrency=1, chat_queue_size=3, max_queued=5)
+
+
+def test_round_robin(loop, scheduler: CommandScheduler):
+    order = []
+
+    async def job(name: str):
+        order.append(name)
+        await aio.sleep(0)
+
+    for n in range(3):
+        scheduler.submit("busy", job(f"busy{n}"))
+    scheduler.submit("quiet", job("quiet0"))
+    loop.run_until_complete(aio.sleep(0.05))
+    # The first job starts as soon as it is submitted, then the chats take turns
+    assert order == ["busy0", "busy1", "quiet0", "busy2"]
+    assert scheduler.running == 0
+    assert scheduler.queued == 0
+
+
+def test_concurrency_limit(loop):
+    scheduler = CommandScheduler(ru.TaskList(loop), max_concurrency=2)
+    running = []
+    peak = []
+
+    async def job():
+        running.append(None)
+        peak.append(len(running))
+        await aio.sleep(0.01)
+        running.pop()
+
+    for n in range(6):
+        scheduler.submit(n, job())
+    loop.run_until_complete(aio.sleep(0.1))
+    assert len(peak) == 6
+    assert max(peak) == 2
+
+
+def test_shedding(loop, scheduler: CommandScheduler):
+    async def job():
+        await aio.sleep(0.01)
+
+    # One job runs, and three can wait in the queue of the chat
+    assert all(scheduler.submit("chat", job()) for _ in range(4))
+    assert not scheduler.submit("chat", job())
+    # The other chats can still queue jobs, until the total limit is reached
+    assert scheduler.submit("other", job())
+    assert scheduler.submit("another", job())
+    assert not scheduler.submit("yet another", job())
+    assert scheduler.shed == 2
+    assert scheduler.queued == 5
+    loop.run_until_complete(aio.sleep(0.2))
+    assert scheduler.queued == 0
+
+
+def test_errors_free_the_slot(loop, scheduler: CommandScheduler):
+    done = []
+
+    async def failing():
+        raise ValueError()
+
+    async def job():
+        done.append(None)
+
+    scheduler.submit("chat", failing())
+    scheduler.submit("chat", job())
+    loop.run_until_complete(aio.sleep(0.05))
+    assert done == [None]
+    assert scheduler.running == 0
+
+
+def test_invalid_concurrency(loop):
+    with pytest.raises(ValueError):
+        CommandScheduler(ru.TaskList(loop), max_concurrency=0)
+
+
+def test_cancelled_before_starting_frees_the_slot(loop, scheduler: CommandScheduler):
+    done = []
+
+    async def job():
+        done.append(None)
+
+    scheduler.submit("chat", job())
+    # The task is cancelled before the event loop gets to run it
+    for task in list(scheduler.tasks.tasks):
+        task.cancel()
+    scheduler.submit("chat", job())
+    loop.run_until_complete(aio.sleep(0.05))
+    assert done == [None]
+    assert scheduler.running == 0
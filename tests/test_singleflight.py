@@ -0,0 +1,79 @@
+import asyncio as aio
+
+import pytest
+
+import royalnet.utils as ru
+
+
+def test_key():
+    assert ru.SingleFlight.key("event", {"a": 1, "b": 2}) == ru.SingleFlight.key("event", {"b": 2, "a": 1})
+    assert ru.SingleFlight.key("event", {"a": 1}) != ru.SingleFlight.key("event", {"a": 2})
+    assert ru.SingleFlight.key("event", object()) is None
+
+
+def test_coalescing(loop):
+    flight = ru.SingleFlight()
+    calls = []
+
+    async def function(value):
+        calls.append(value)
+        await aio.sleep(0.01)
+        return {"value": value}
+
+    async def main():
+        return await aio.gather(*[flight.run("key", function, 1) for _ in range(5)])
+
+    results = loop.run_until_complete(main())
+    assert calls == [1]
+    assert flight.coalesced == 4
+    assert results == [{"value": 1}] * 5
+    # Every caller gets its own copy
+    assert len({id(result) for result in results}) == 5
+
+
+def test_sequential_calls_are_not_coalesced(loop):
+    flight = ru.SingleFlight()
+    calls = []
+
+    async def function():
+        calls.append(None)
+
+    loop.run_until_complete(flight.run("key", function))
+    loop.run_until_complete(flight.run("key", function))
+    assert len(calls) == 2
+    assert flight.coalesced == 0
+
+
+def test_error_propagation(loop):
+    flight = ru.SingleFlight()
+
+    async def function():
+        await aio.sleep(0.01)
+        raise ValueError("failed")
+
+    async def main():
+        return await aio.gather(*[flight.run("key", function) for _ in range(3)], return_exceptions=True)
+
+    results = loop.run_until_complete(main())
+    assert all(isinstance(result, ValueError) for result in results)
+    # The failed call is forgotten, so it can be tried again
+    with pytest.raises(ValueError):
+        loop.run_until_complete(flight.run("key", function))
+    assert flight.coalesced == 2
+
+
+def test_cancelling_a_caller(loop):
+    flight = ru.SingleFlight()
+
+    async def function():
+        await aio.sleep(0.02)
+        return 42
+
+    async def main():
+        first = loop.create_task(flight.run("key", function))
+        second = loop.create_task(flight.run("key", function))
+        await aio.sleep(0.005)
+        first.cancel()
+        return await second
+
+    assert loop.run_until_complete(main()) == 42
@@ -0,0 +1,72 @@
+import pytest
+
+import royalnet.utils as ru
+
+
+class Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock() -> Clock:
+    return Clock()
+
+
+def test_expiry(clock: Clock):
+    cache = ru.TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache["a"] = 1
+    clock.now = 4.9
+    assert cache["a"] == 1
+    clock.now = 5
+    assert "a" not in cache
+    with pytest.raises(KeyError):
+        cache["a"]
+    assert len(cache) == 0
+
+
+def test_reading_doesnt_extend_expiry(clock: Clock):
+    cache = ru.TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache["a"] = 1
+    clock.now = 3
+    assert cache.get("a") == 1
+    clock.now = 6
+    assert cache.get("a", "default") == "default"
+
+
+def test_setting_again_extends_expiry(clock: Clock):
+    cache = ru.TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache["a"] = 1
+    clock.now = 3
+    cache["a"] = 2
+    clock.now = 6
+    assert cache["a"] == 2
+
+
+def test_least_recently_used_eviction(clock: Clock):
+    cache = ru.TTLCache(maxsize=2, ttl=5, timer=clock)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache["a"] == 1
+    cache["c"] = 3
+    assert "a" in cache
+    assert "b" not in cache
+    assert "c" in cache
+
+
+def test_pop(clock: Clock):
+    cache = ru.TTLCache(maxsize=10, ttl=5, timer=clock)
+    cache["a"] = 1
+    cache["b"] = 2
+    assert cache.pop("a") == 1
+    assert "a" not in cache
+    clock.now = 5
+    assert cache.pop("b", "expired") == "expired"
+
+
+def test_invalid_maxsize():
+    with pytest.raises(ValueError):
+        ru.TTLCache(maxsize=0, ttl=5)